@@ -1,56 +1,220 @@
-import os, io, zipfile, csv, secrets
+import os, sys, io, re, zipfile, csv, secrets, time, json, math, mmap, tempfile, threading, bisect, itertools, statistics
+import logging
+import gzip, hashlib, heapq
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from datetime import datetime
 from typing import Optional
 from functools import wraps
 
-from flask import Flask, request, g
-from flask_restx import Api, Namespace, Resource, fields
+from flask import Blueprint, Flask, Response, current_app, request, g, has_request_context
+from flask_restx import Api, Namespace, Resource, fields, marshal
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, verify_jwt_in_request, get_jwt_identity
 from dotenv import load_dotenv
+from werkzeug.http import parse_accept_header
 
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Float, UniqueConstraint, func, or_
-from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
+from sqlalchemy import create_engine, event, Column, Integer, String, Boolean, DateTime, Float, UniqueConstraint, Index, Text, func, or_, case, insert, inspect, select, text, tuple_, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, aliased, sessionmaker, scoped_session, declarative_base
 from sqlalchemy.exc import IntegrityError
-import requests
+import click
 
 from flask import send_file, make_response
-import matplotlib
-matplotlib.use("Agg")
-import itertools
-import matplotlib.pyplot as plt
-from pyproj import Transformer
-from flask import send_file
+try:
+    import orjson  # fast JSON for the list endpoints (see _json_response); stdlib json otherwise
+except ImportError:
+    orjson = None
+try:
+    import brotli  # optional response encodings (see _compress_response)
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+# requests, matplotlib and pyproj are imported on first use (see _plotting, _download_zip):
+# together they were most of the import time, and only imports and /viz/map need them.
+# redis too (see _redis_module): only CACHE_URL/RATE_LIMIT_URL=redis://... need it.
 
 # -----------------------------------------------------------------------------
-# App & Config
+# App & Config (the Flask app itself is built by create_app() at the bottom)
 # -----------------------------------------------------------------------------
-app = Flask(__name__)
-app.config["RESTX_MASK_SWAGGER"] = False
-
-# -----------------------------------------------------------------------------
-# Swagger UI Helper Message
-# -----------------------------------------------------------------------------
-CORS(app)
 from pathlib import Path
 _base = Path(__file__).resolve().parent
 load_dotenv(_base / "transport_api_key.env")  
-app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "dev_change_me")
-app.config["JWT_HEADER_TYPE"] = None
-jwt = JWTManager(app)
 
-DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///app.sqlite")
-engine = create_engine(DATABASE_URL, future=True)
-SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
+# app-wide request hooks, /metrics and the CLI commands; registered on every app
+core = Blueprint("core", __name__, cli_group=None)
+jwt = JWTManager()
+
+# -----------------------------------------------------------------------------
+# Database: one engine per process
+# -----------------------------------------------------------------------------
+SQLITE_BUSY_TIMEOUT_S = float(os.getenv("SQLITE_BUSY_TIMEOUT_S", "30"))  # wait for another worker's write lock
+# parallel shard queries per multi-agency list (1: one after another, in the request thread)
+SHARD_QUERY_THREADS = int(os.getenv("GTFS_SHARD_THREADS", str(min(os.cpu_count() or 1, 4))))
+
+SHARD_MMAP_BYTES = int(os.getenv("GTFS_MMAP_MB", "256")) * 1024 * 1024  # per shard connection
+
+engine = None   # set by configure_database()
+shard_dir = None  # GTFS_SHARD_DIR: per-agency GTFS files (see _shard_engine); None keeps them in `engine`
+snapshot_dir = None  # GTFS_SNAPSHOT_DIR: serve read-only snapshots from here (see _sync_snapshot)
+snapshot = None      # manifest of the snapshot being served; its directory is then shard_dir
+SessionLocal = scoped_session(sessionmaker(autoflush=False, autocommit=False))
 Base = declarative_base()
 
-@app.before_request
+def _sqlite_on_connect(dbapi_conn, record):
+    # WAL lets worker processes keep reading while one of them writes (e.g. during an import)
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.close()
+
+def configure_database(url: str, gtfs_shard_dir=None, gtfs_snapshot_dir=None):
+    """(Re)create this process's engine for `url` and bind SessionLocal to it.
+
+    With `gtfs_shard_dir`, each agency's GTFS tables go to their own SQLite file in that directory
+    instead; users, favourites and gtfs_agencies stay in `url`. With `gtfs_snapshot_dir` the GTFS
+    data is the read-only snapshot activated there (and `gtfs_shard_dir` is ignored).
+    """
+    global engine, shard_dir, snapshot_dir, snapshot, _snapshot_seen, _db_ready
+    if engine is not None:
+        engine.dispose()
+    _db_ready = False
+    _dispose_shards()
+    snapshot_dir = Path(gtfs_snapshot_dir) if gtfs_snapshot_dir else None
+    snapshot = _snapshot_seen = None
+    shard_dir = Path(gtfs_shard_dir) if gtfs_shard_dir and snapshot_dir is None else None
+    for path in (shard_dir, snapshot_dir):
+        if path is not None:
+            path.mkdir(parents=True, exist_ok=True)
+    sqlite = url.startswith("sqlite")
+    engine = create_engine(url, future=True, connect_args={"timeout": SQLITE_BUSY_TIMEOUT_S} if sqlite else {})
+    if sqlite:
+        event.listen(engine, "connect", _sqlite_on_connect)
+    SessionLocal.remove()
+    SessionLocal.configure(bind=engine)
+    _agency_pks_by_key.clear()
+    _agency_keys_by_pk.clear()
+    return engine
+
+def _reset_engine_after_fork():
+    # A forked child must never touch the parent's pooled connections (SQLite handles are not
+    # fork-safe): forget them without closing, and the child opens its own on first use.
+    global _shard_pool
+    if engine is not None:
+        engine.dispose(close=False)
+    _dispose_shards(close=False)
+    _shard_pool = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_engine_after_fork)
+
+# Per-agency shards. A shard holds the same GTFS tables for one agency and is only ever replaced
+# whole: an import builds a new file beside it and renames it into place (_ShardBuild), so readers
+# open a shard as immutable (no locking or change checks; an open handle keeps the file it opened).
+# Engines are opened on first use and reopened when the file on disk is a different one (a
+# re-import in this or another worker).
+_shard_engines = {}   # agency key -> ((st_ino, st_mtime_ns), engine)
+_shard_lock = threading.Lock()
+_shard_pool = None
+
+def _shard_on_connect(dbapi_conn, record):
+    # shards never change under an open connection, so reads can come straight from the page cache
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA mmap_size={SHARD_MMAP_BYTES}")
+    cur.close()
+
+def _shard_path(agency_key: str) -> Path:
+    mode, agency_id = agency_key.split(":", 1)
+    return shard_dir / f"{mode}_{agency_id}.sqlite"
+
+def _shard_keys() -> list:
+    """Agency keys that have a shard file, sorted."""
+    return sorted(p.stem.replace("_", ":", 1) for p in shard_dir.glob("*_*.sqlite"))
+
+def _shard_engine(agency_key: str) -> Optional[Engine]:
+    """Read-only engine on the agency's current shard file, or None if it has none."""
+    path = _shard_path(agency_key)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    ident = (st.st_ino, st.st_mtime_ns)
+    with _shard_lock:
+        cached = _shard_engines.get(agency_key)
+        if cached is not None and cached[0] == ident:
+            return cached[1]
+        shard = create_engine(f"sqlite:///file:{path}?immutable=1&uri=true", future=True)
+        event.listen(shard, "connect", _shard_on_connect)
+        _shard_engines[agency_key] = (ident, shard)
+    if cached is not None:
+        cached[1].dispose()   # connections still in use keep reading the old file until returned
+    return shard
+
+def _dispose_shards(close: bool = True):
+    with _shard_lock:
+        for _, shard in _shard_engines.values():
+            shard.dispose(close=close)
+        _shard_engines.clear()
+
+class AgencyNotImported(LookupError):
+    """The agency has no GTFS data (e.g. its shard was dropped after the request checked); a 404."""
+
+def _bound_shard_engine(agency_key: str) -> Engine:
+    shard = _shard_engine(agency_key)
+    if shard is None:
+        raise AgencyNotImported(agency_key)
+    return shard
+
+def _gtfs_db(agency_key: str):
+    """Session for the agency's GTFS rows in this request: g.db, or its shard's (read-only) session."""
+    if shard_dir is None:
+        return g.db
+    dbs = g.setdefault("shard_dbs", {})
+    if agency_key not in dbs:
+        dbs[agency_key] = Session(bind=_bound_shard_engine(agency_key))
+    return dbs[agency_key]
+
+def _fan_out(fn, agency_keys) -> list:
+    """[fn(session) for each agency's shard], run in parallel threads; results in key order.
+
+    Each call's SQL is counted (and slow statements logged) for the current request.
+    """
+    global _shard_pool
+
+    def run(key):
+        _fan_out_sql.acc = ([0, 0.0], [])   # the worker has no request context; see _sql_finished
+        try:
+            with Session(bind=_bound_shard_engine(key)) as db:
+                return fn(db), _fan_out_sql.acc
+        finally:
+            _fan_out_sql.acc = None
+    if SHARD_QUERY_THREADS <= 1:
+        done = [run(key) for key in agency_keys]
+    else:
+        with _shard_lock:
+            if _shard_pool is None:
+                _shard_pool = ThreadPoolExecutor(max_workers=SHARD_QUERY_THREADS, thread_name_prefix="shard")
+        done = list(_shard_pool.map(run, agency_keys))
+    if has_request_context() and "sql" in g:
+        for _, (sql, slow) in done:
+            g.sql[0] += sql[0]
+            g.sql[1] += sql[1]
+            g.slow_sql.extend(slow)
+    return [result for result, _ in done]
+
+@core.before_app_request
 def _bind_session():
     g.db = SessionLocal()
 
-@app.teardown_request
+@core.teardown_app_request
 def _cleanup_session(exc):
+    for shard_db in g.pop("shard_dbs", {}).values():
+        shard_db.close()
     db = getattr(g, "db", None)
     if db is not None:
         if exc:
@@ -60,11 +224,725 @@ def _cleanup_session(exc):
         db.close()
         SessionLocal.remove()
 
+# -----------------------------------------------------------------------------
+# Instrumentation: per-request spans, SQL counters, Server-Timing, /metrics
+# -----------------------------------------------------------------------------
+METRICS_NAMESPACES = ('auth', 'admin', 'gtfs', 'favorites', 'viz')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))  # <= 0 turns the slow-query log off
+SLOW_QUERY_KEEP = 200                                       # entries kept for /admin/slow-queries
+PROFILE_SORTS = ('cumulative', 'tottime', 'calls')
+
+_metrics_lock = threading.Lock()
+_latency = {}         # namespace -> [count per bucket..., +Inf, sum of seconds]
+_requests_total = {}  # (namespace, status) -> requests
+_sql_totals = {}      # namespace -> [statements, seconds]
+_span_totals = {}     # (namespace, span) -> [calls, seconds]
+_slow_queries = deque(maxlen=SLOW_QUERY_KEEP)
+
+
+def _add_span(name: str, secs: float):
+    if not has_request_context():
+        return
+    spans = g.get("spans")
+    if spans is not None:
+        acc = spans.setdefault(name, [0, 0.0])
+        acc[0] += 1
+        acc[1] += secs
+
+
+@contextmanager
+def span(name: str):
+    """Time a block as one phase of the current request (no-op outside a request)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_span(name, time.perf_counter() - t0)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info["sql_t0"] = time.perf_counter()
+
+
+_fan_out_sql = threading.local()   # .acc: (sql, slow_sql) of a _fan_out worker, merged into the request's
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    secs = time.perf_counter() - conn.info.pop("sql_t0", time.perf_counter())
+    acc = getattr(_fan_out_sql, "acc", None)
+    if acc is None and has_request_context() and "sql" in g:
+        acc = g.sql, g.slow_sql
+    if acc is not None:
+        sql, slow_sql = acc
+        sql[0] += 1
+        sql[1] += secs
+        if (0 < SLOW_QUERY_MS <= secs * 1000 and not executemany
+                and statement.lstrip()[:6].upper() == "SELECT"):
+            slow_sql.append((statement, parameters, secs, conn.engine))
+
+
+def _metrics_namespace(path: str) -> str:
+    head = path.strip("/").split("/", 1)[0]
+    return head if head in METRICS_NAMESPACES else "other"
+
+
+def _observe(namespace: str, status: int, secs: float, sql, spans):
+    with _metrics_lock:
+        hist = _latency.setdefault(namespace, [0] * (len(LATENCY_BUCKETS) + 2))
+        hist[bisect.bisect_left(LATENCY_BUCKETS, secs)] += 1
+        hist[-1] += secs
+        _requests_total[(namespace, status)] = _requests_total.get((namespace, status), 0) + 1
+        totals = _sql_totals.setdefault(namespace, [0, 0.0])
+        totals[0] += sql[0]
+        totals[1] += sql[1]
+        for name, (calls, span_secs) in spans.items():
+            acc = _span_totals.setdefault((namespace, name), [0, 0.0])
+            acc[0] += calls
+            acc[1] += span_secs
+
+
+def _server_timing(spans, sql, total: float) -> str:
+    parts = [f"{name};dur={secs * 1000:.2f}" for name, (_, secs) in spans.items()]
+    parts.append(f'db;dur={sql[1] * 1000:.2f};desc="{sql[0]} queries"')
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+@core.before_app_request
+def _start_timing():
+    g.t0 = time.perf_counter()
+    g.spans = {}
+    g.sql = [0, 0.0]
+    g.slow_sql = []
+
+
+@core.after_app_request
+def _finish_timing(resp):
+    if "t0" not in g:
+        return resp
+    total = time.perf_counter() - g.t0
+    _observe(_metrics_namespace(request.path), resp.status_code, total, g.sql, g.spans)
+    if SERVER_TIMING:
+        resp.headers["Server-Timing"] = _server_timing(g.spans, g.sql, total)
+    return resp
+
+
+def _explain(bind, statement: str, parameters) -> list:
+    """Query plan for a logged statement, run on a raw connection of the engine that ran it (the
+    main database, or an agency's shard) so it is not itself counted."""
+    sqlite = bind.dialect.name == "sqlite"
+    raw = bind.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute(("EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN ") + statement, parameters)
+        rows = cur.fetchall()
+        cur.close()
+    except Exception as e:
+        return [f"explain failed: {e}"]
+    finally:
+        raw.close()
+    return [row[-1] if sqlite else " ".join(str(c) for c in row) for row in rows]
+
+
+def _jsonable_params(parameters):
+    plain = lambda v: v if v is None or isinstance(v, (int, float, str)) else str(v)
+    if isinstance(parameters, dict):
+        return {k: plain(v) for k, v in parameters.items()}
+    return [plain(v) for v in parameters or ()]
+
+
+@core.after_app_request
+def _log_slow_queries(resp):
+    for statement, parameters, secs, bind in g.get("slow_sql", ()):
+        entry = {
+            "at": datetime.utcnow().isoformat(timespec="seconds"),
+            "request": f"{request.method} {request.full_path.rstrip('?')}",
+            "ms": round(secs * 1000, 2),
+            "sql": statement,
+            "params": _jsonable_params(parameters),
+            "plan": _explain(bind, statement, parameters),
+        }
+        _slow_queries.append(entry)
+        current_app.logger.warning("slow query (%.1f ms) in %s: %s params=%s plan=%s", entry["ms"], entry["request"],
+                           " ".join(statement.split()), entry["params"], "; ".join(entry["plan"]))
+    return resp
+
+
+def _profiled(fn, *args, **kwargs):
+    """Run a view under cProfile and return the profile as text instead of the view's response."""
+    import cProfile, pstats
+    sort = request.args.get('profile_sort') or 'cumulative'
+    if sort not in PROFILE_SORTS:
+        return {"error": f"profile_sort must be one of {', '.join(PROFILE_SORTS)}"}, 400
+    try:
+        limit = max(1, min(int(request.args.get('profile_limit') or 40), 500))
+    except ValueError:
+        return {"error": "profile_limit must be int"}, 400
+
+    prof = cProfile.Profile()
+    t0 = time.perf_counter()
+    rv = prof.runcall(fn, *args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    if isinstance(rv, tuple):
+        status = rv[1] if len(rv) > 1 and isinstance(rv[1], int) else 200
+    else:
+        status = getattr(rv, "status_code", 200)
+
+    out = io.StringIO()
+    out.write(f"# {request.method} {request.full_path.rstrip('?')} -> {status} in {elapsed * 1000:.1f} ms\n")
+    out.write(f"# {g.sql[0]} SQL statements, {g.sql[1] * 1000:.1f} ms in SQL\n\n")
+    pstats.Stats(prof, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+    resp = make_response(out.getvalue())
+    resp.headers["Content-Type"] = "text/plain; charset=utf-8"
+    resp.headers["X-Profiled-Status"] = str(status)
+    return resp
+
+
+def _render_metrics() -> str:
+    lines = [
+        "# HELP api_request_duration_seconds Request latency by API namespace.",
+        "# TYPE api_request_duration_seconds histogram",
+    ]
+    with _metrics_lock:
+        for ns in METRICS_NAMESPACES + ("other",):
+            hist = _latency.get(ns, [0] * (len(LATENCY_BUCKETS) + 2))
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), hist[:-1]):
+                cumulative += n
+                lines.append(f'api_request_duration_seconds_bucket{{namespace="{ns}",le="{bound}"}} {cumulative}')
+            lines.append(f'api_request_duration_seconds_sum{{namespace="{ns}"}} {hist[-1]:.6f}')
+            lines.append(f'api_request_duration_seconds_count{{namespace="{ns}"}} {cumulative}')
+        lines += ["# HELP api_requests_total Responses by namespace and status code.",
+                  "# TYPE api_requests_total counter"]
+        for (ns, status), n in sorted(_requests_total.items()):
+            lines.append(f'api_requests_total{{namespace="{ns}",status="{status}"}} {n}')
+        lines += ["# HELP api_sql_statements_total SQL statements executed while serving requests.",
+                  "# TYPE api_sql_statements_total counter"]
+        lines += [f'api_sql_statements_total{{namespace="{ns}"}} {n}' for ns, (n, _) in sorted(_sql_totals.items())]
+        lines += ["# HELP api_sql_duration_seconds_total Time spent in SQL statements while serving requests.",
+                  "# TYPE api_sql_duration_seconds_total counter"]
+        lines += [f'api_sql_duration_seconds_total{{namespace="{ns}"}} {secs:.6f}' for ns, (_, secs) in sorted(_sql_totals.items())]
+        lines += ["# HELP api_span_duration_seconds_total Time spent per request phase (jwt, user, count, page, marshal, render, ...).",
+                  "# TYPE api_span_duration_seconds_total counter"]
+        for (ns, name), (_, secs) in sorted(_span_totals.items()):
+            lines.append(f'api_span_duration_seconds_total{{namespace="{ns}",span="{name}"}} {secs:.6f}')
+        lines += ["# HELP api_span_calls_total Number of times each request phase ran.",
+                  "# TYPE api_span_calls_total counter"]
+        for (ns, name), (calls, _) in sorted(_span_totals.items()):
+            lines.append(f'api_span_calls_total{{namespace="{ns}",span="{name}"}} {calls}')
+        lines += ["# HELP api_compress_cache_total Compressed-variant cache lookups.",
+                  "# TYPE api_compress_cache_total counter",
+                  f'api_compress_cache_total{{result="hit"}} {_compress_stats[0]}',
+                  f'api_compress_cache_total{{result="miss"}} {_compress_stats[1]}']
+        lines += ["# HELP api_cache_total Shared cache lookups (CACHE_URL) by kind: gtfs pages, viz renders, auth state, import versions.",
+                  "# TYPE api_cache_total counter"]
+        lines += [f'api_cache_total{{kind="{kind}",result="{result}"}} {n}' for (kind, result), n in sorted(_cache_stats.items())]
+        lines += ["# HELP api_admission_total Requests turned away with 429 (rate, concurrency) and limiter errors, by endpoint class.",
+                  "# TYPE api_admission_total counter"]
+        lines += [f'api_admission_total{{class="{cls}",event="{event}"}} {n}' for (cls, event), n in sorted(_admission_events.items())]
+    return "\n".join(lines) + "\n"
+
+
+@core.route("/metrics")
+def metrics():
+    return Response(_render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+# -----------------------------------------------------------------------------
+# Response compression, negotiated via Accept-Encoding
+# -----------------------------------------------------------------------------
+COMPRESS = os.getenv("COMPRESS", "1") != "0"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))  # smaller bodies are sent as they are
+COMPRESS_CACHE_BYTES = int(float(os.getenv("COMPRESS_CACHE_MB", "32")) * 1024 * 1024)
+COMPRESSIBLE = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+# encoding -> compressor, in server preference order (used to break ties in Accept-Encoding)
+COMPRESSORS = {}
+if zstandard is not None:
+    COMPRESSORS["zstd"] = lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+if brotli is not None:
+    COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=5)
+COMPRESSORS["gzip"] = lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+
+_compress_lock = threading.Lock()
+_compressed = OrderedDict()   # (body digest, encoding) -> compressed body, least recently used first
+_compressed_size = 0
+_compress_stats = [0, 0]      # cache hits, misses
+
+def _negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Best encoding we support for an Accept-Encoding header (None: send identity)."""
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding).best_match(list(COMPRESSORS))
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    """Compress `data`, reusing the stored variant of an identical body.
+
+    Keyed by content, so swagger.json and repeated list pages are compressed once per
+    encoding no matter which user asked; least recently used variants are dropped past
+    COMPRESS_CACHE_BYTES.
+    """
+    global _compressed_size
+    key = (hashlib.blake2b(data, digest_size=16).digest(), encoding)
+    with _compress_lock:
+        body = _compressed.get(key)
+        if body is not None:
+            _compressed.move_to_end(key)
+            _compress_stats[0] += 1
+            return body
+        _compress_stats[1] += 1
+    body = COMPRESSORS[encoding](data)
+    if len(body) <= COMPRESS_CACHE_BYTES:
+        with _compress_lock:
+            if key not in _compressed:
+                _compressed[key] = body
+                _compressed_size += len(body)
+            while _compressed_size > COMPRESS_CACHE_BYTES:
+                _, old = _compressed.popitem(last=False)
+                _compressed_size -= len(old)
+    return body
+
+# registered after _finish_timing, so it runs first and its span reaches Server-Timing
+@core.after_app_request
+def _compress_response(resp):
+    if (not COMPRESS or resp.status_code != 200 or "Content-Encoding" in resp.headers
+            or not (resp.mimetype or "").startswith(COMPRESSIBLE)):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    encoding = _negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None or (resp.content_length is not None and resp.content_length < COMPRESS_MIN_BYTES):
+        return resp
+    # send_file responses (the Swagger UI assets under /docs) are read into memory; their
+    # compressed variants are cached like any other body
+    resp.direct_passthrough = False
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return resp
+    with span("compress"):
+        body = _compress(data, encoding)
+    if len(body) < len(data):
+        resp.set_data(body)
+        resp.headers["Content-Encoding"] = encoding
+        etag, weak = resp.get_etag()
+        if etag and not weak:  # a strong ETag names exact bytes; the encoded variant only matches weakly
+            resp.set_etag(etag, weak=True)
+    return resp
+
+# -----------------------------------------------------------------------------
+# Shared cache: list pages, map renders and auth state (CACHE_URL)
+# -----------------------------------------------------------------------------
+CACHE_TTL_S = int(os.getenv("CACHE_TTL_S", "300"))             # /gtfs list pages and /viz/map renders
+CACHE_AUTH_TTL_S = int(os.getenv("CACHE_AUTH_TTL_S", "30"))    # a user's role/active flag behind require_auth
+CACHE_VERSION_TTL_S = float(os.getenv("CACHE_VERSION_TTL_S", "5"))  # re-read import versions at least this often
+CACHE_MEMORY_BYTES = int(float(os.getenv("CACHE_MEMORY_MB", "64")) * 1024 * 1024)
+CACHE_CHANNEL = "gtfs:invalidate"
+CACHE_ERRORS = (OSError,)   # + redis.RedisError once a redis client is built (see _redis_module)
+
+cache = None      # set by configure_cache(): _MemoryCache, _RedisCache, or None (no caching)
+cache_url = None
+_cache_versions = {}   # agency key -> (import version, time.monotonic() when read)
+_cache_stats = {}      # (kind, hit|miss|error) -> count
+
+def _redis_module(setting: str):
+    """Import redis for a redis:// `setting` and add its errors to CACHE_ERRORS."""
+    global CACHE_ERRORS
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError(f"{setting}=redis://... needs the redis package (pip install redis)")
+    if redis.RedisError not in CACHE_ERRORS:
+        CACHE_ERRORS += (redis.RedisError,)
+    return redis
+
+class _MemoryCache:
+    """This process only: an LRU of bytes with expiry, and local version counters.
+
+    Right for one process (flask run, tests); pre-forked workers each get their own and never see
+    another worker's invalidations, so serve.py/uvicorn with several workers want redis://.
+    """
+    def __init__(self, max_bytes: int = CACHE_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()   # key -> (expires at, value)
+        self._size = 0
+        self._counters = {}
+        self._callback = None
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value: bytes, ttl: int):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._items)))
+
+    def _drop(self, key: str):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._size -= len(item[1])
+
+    def delete(self, key: str):
+        with self._lock:
+            self._drop(key)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def mget(self, keys) -> list:
+        return [self._counters.get(k) for k in keys]
+
+    def publish(self, message: str):
+        if self._callback is not None:
+            self._callback(message)
+
+    def listen(self, callback):
+        self._callback = callback
+
+class _RedisCache:
+    """Any Redis-protocol server, shared by every worker and node pointed at it.
+
+    Values expire by TTL. Import versions are counters in the server, and every bump is also
+    published on CACHE_CHANNEL; each process runs one subscriber thread (started on first use, so
+    a forked worker starts its own) that applies them at once.
+    """
+    def __init__(self, url: str):
+        self.redis = _redis_module("CACHE_URL")
+        self.url = url
+        # short timeouts: a slow or missing cache server is a miss, not a stalled request
+        self.client = self.redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._listener_pid = None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self.client.set(key, value, ex=ttl)
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def mget(self, keys) -> list:
+        return [None if v is None else int(v) for v in self.client.mget(keys)]
+
+    def publish(self, message: str):
+        self.client.publish(CACHE_CHANNEL, message)
+
+    def listen(self, callback):
+        if self._listener_pid == os.getpid():
+            return
+        self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen, args=(callback,), name="cache-invalidations", daemon=True).start()
+
+    def _listen(self, callback):
+        client = self.redis.Redis.from_url(self.url, socket_connect_timeout=1)   # blocks in listen(): no read timeout
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CACHE_CHANNEL)
+                callback(None)   # (re)subscribed: anything published meanwhile was missed
+                for message in pubsub.listen():
+                    callback(message["data"])
+            except CACHE_ERRORS:
+                time.sleep(1)
+
+def configure_cache(url: Optional[str]):
+    """Use the cache at `url` (memory:// or redis://host:port/db) for this process; None turns it off."""
+    global cache, cache_url
+    if url and url.startswith("memory://"):
+        cache = _MemoryCache()
+    elif url:
+        cache = _RedisCache(url)
+    else:
+        cache = None
+    cache_url = url or None
+    _cache_versions.clear()
+    return cache
+
+def _cache_count(kind: str, result: str):
+    with _metrics_lock:
+        _cache_stats[(kind, result)] = _cache_stats.get((kind, result), 0) + 1
+
+def _on_invalidation(message):
+    """Apply a published import-version bump ({"agency", "version"}); None forgets every version."""
+    if message is None:
+        _cache_versions.clear()
+        return
+    bump = json.loads(message)
+    known = _cache_versions.get(bump["agency"])
+    if known is None or bump["version"] > known[0]:   # bumps from several nodes may arrive out of order
+        _cache_versions[bump["agency"]] = (bump["version"], time.monotonic())
+
+def _import_versions(agency_keys) -> Optional[tuple]:
+    """Current import version of each agency (None if the cache cannot be reached).
+
+    Bumps arrive through the subscriber; a version older than CACHE_VERSION_TTL_S is re-read
+    anyway, which bounds staleness if a broadcast is lost.
+    """
+    cache.listen(_on_invalidation)
+    now = time.monotonic()
+    # read each entry once: the subscriber thread may clear _cache_versions at any point
+    versions = {k: _cache_versions.get(k) for k in agency_keys}
+    stale = [k for k, v in versions.items() if v is None or now - v[1] >= CACHE_VERSION_TTL_S]
+    if stale:
+        try:
+            values = cache.mget([f"gtfs:version:{k}" for k in stale])
+        except CACHE_ERRORS:
+            _cache_count("version", "error")
+            return None
+        for k, v in zip(stale, values):
+            versions[k] = _cache_versions[k] = (v or 0, now)
+    return tuple(versions[k][0] for k in agency_keys)
+
+def _bump_import_version(agency_key: str):
+    """Make every cached page/render of an agency unreachable, on every node (after its data changed)."""
+    if cache is None:
+        return
+    try:
+        version = cache.incr(f"gtfs:version:{agency_key}")
+        message = json.dumps({"agency": agency_key, "version": version})
+        _on_invalidation(message)
+        cache.publish(message)
+    except CACHE_ERRORS:
+        # the other nodes still re-read the version within CACHE_VERSION_TTL_S once it is reachable
+        _cache_count("version", "error")
+
+def _cache_key(kind: str, agency_keys, parts) -> Optional[str]:
+    """Key for a response built from `agency_keys` at their current import versions, or None.
+
+    Read before querying: a page computed from pre-import data can only land under the old
+    version. A node serving a snapshot keys by the snapshot version too.
+    """
+    if cache is None:
+        return None
+    versions = _import_versions(agency_keys)
+    if versions is None:
+        return None
+    scope = snapshot["version"] if snapshot else ""
+    raw = json.dumps([list(agency_keys), versions, parts], separators=(",", ":"))
+    return f"{kind}:{scope}:{hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()}"
+
+def _cache_get(kind: str, key: Optional[str], span_name: Optional[str] = "cache") -> Optional[bytes]:
+    if key is None:
+        return None
+    try:
+        with span(span_name) if span_name else nullcontext():
+            value = cache.get(key)
+    except CACHE_ERRORS:
+        _cache_count(kind, "error")
+        return None
+    _cache_count(kind, "miss" if value is None else "hit")
+    return value
+
+def _cache_set(kind: str, key: Optional[str], value: bytes, ttl: int = CACHE_TTL_S):
+    if key is None:
+        return
+    try:
+        cache.set(key, value, ttl)
+    except CACHE_ERRORS:
+        _cache_count(kind, "error")
+
+def _request_parts(*skip) -> list:
+    """The query string as sorted (name, value) pairs, without `profile` and `skip`."""
+    return sorted((k, v) for k, v in request.args.items(multi=True) if k not in ("profile",) + skip)
+
+# -----------------------------------------------------------------------------
+# Admission control: per-user rate limits and concurrency caps (require_auth)
+# -----------------------------------------------------------------------------
+def _parse_limits(spec: str) -> dict:
+    """"key=a/b,..." -> {key: (a, b)}; a missing /b repeats a."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, value = item.partition("=")
+        a, _, b = value.partition("/")
+        limits[key.strip()] = (float(a), float(b or a))
+    return limits
+
+ADMISSION = os.getenv("ADMISSION", "1") != "0"
+# "role:class=requests per minute/burst"; role * matches any role, pairs not listed are unlimited.
+# Classes: render (/viz/map), import (single and bulk imports), users (/admin/users/bulk),
+# analytics (/analytics), read (everything else).
+RATE_LIMITS = {tuple(k.split(":", 1)): v for k, v in _parse_limits(os.getenv(
+    "RATE_LIMITS", "commuter:render=12/5,planner:render=30/10,admin:render=60/20,planner:import=4/3,admin:import=10/5,"
+                   "admin:users=12/6")).items()}
+# "class=in flight per user/in flight in total"
+CONCURRENCY_LIMITS = {k: (int(a), int(b)) for k, (a, b) in _parse_limits(
+    os.getenv("CONCURRENCY_LIMITS", "render=2/8,import=2/4,users=1/2,analytics=1/2")).items()}
+CONCURRENCY_RETRY_S = int(os.getenv("CONCURRENCY_RETRY_S", "2"))   # Retry-After when a cap is full
+CONCURRENCY_LEASE_S = int(os.getenv("CONCURRENCY_LEASE_S", "900"))  # shared slots a dead worker held expire
+
+limiter = None      # set by configure_limiter(): _MemoryLimiter or _RedisLimiter
+limiter_url = None
+_admission_events = {}   # (class, rate|concurrency|limiter_error) -> count
+
+class _MemoryLimiter:
+    """Token buckets and in-flight counters in this process (each worker limits on its own)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}    # key -> [tokens, time.monotonic() of the last update]
+        self._in_flight = {}  # key -> count
+
+    def take(self, key: str, per_s: float, burst: float) -> float:
+        """Take one token; 0 if there was one, else the seconds until there will be."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * per_s)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / per_s
+            self._buckets[key] = [tokens - 1 if wait == 0 else tokens, now]
+            if len(self._buckets) > 100_000:   # forget users idle for an hour (their buckets are full again)
+                self._buckets = {k: b for k, b in self._buckets.items() if now - b[1] < 3600}
+        return wait
+
+    def acquire(self, keys, caps) -> Optional[str]:
+        """Count one more in flight under every key, unless one is at its cap; returns a lease id."""
+        with self._lock:
+            if any(self._in_flight.get(k, 0) >= cap for k, cap in zip(keys, caps)):
+                return None
+            for k in keys:
+                self._in_flight[k] = self._in_flight.get(k, 0) + 1
+        return "local"
+
+    def release(self, keys, lease: str):
+        with self._lock:
+            for k in keys:
+                n = self._in_flight.get(k, 0) - 1
+                if n > 0:
+                    self._in_flight[k] = n
+                else:
+                    self._in_flight.pop(k, None)
+
+# The shared limiter keeps the same state in a Redis-protocol server, updated atomically by Lua
+# scripts on the server's clock (so nodes with skewed clocks agree). In-flight requests are
+# members of a sorted set scored by start time, so a slot held by a dead worker lapses after
+# CONCURRENCY_LEASE_S instead of leaking.
+_TAKE_LUA = """
+local per_s, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1e6
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(b[1]) or burst
+tokens = math.min(burst, tokens + math.max(0, now - (tonumber(b[2]) or now)) * per_s)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / per_s end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return tostring(wait)
+"""
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1])
+for i, key in ipairs(KEYS) do
+  redis.call('ZREMRANGEBYSCORE', key, '-inf', now - tonumber(ARGV[2]))
+  if redis.call('ZCARD', key) >= tonumber(ARGV[2 + i]) then return 0 end
+end
+for i, key in ipairs(KEYS) do
+  redis.call('ZADD', key, now, ARGV[1])
+  redis.call('EXPIRE', key, ARGV[2])
+end
+return 1
+"""
+
+class _RedisLimiter:
+    """Limiter state shared by every worker and node pointed at the same server."""
+    def __init__(self, url: str):
+        self.client = _redis_module("RATE_LIMIT_URL").Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+
+    # plain EVAL (no script cache round trips): the scripts are a few hundred bytes and only
+    # run for the limited endpoint classes
+    def take(self, key: str, per_s: float, burst: float) -> float:
+        # the bucket is full again (as if new) once it has been idle for burst / per_s seconds
+        return float(self.client.eval(_TAKE_LUA, 1, key, per_s, burst, math.ceil(burst / per_s) + 1))
+
+    def acquire(self, keys, caps) -> Optional[str]:
+        lease = secrets.token_hex(8)
+        return lease if self.client.eval(_ACQUIRE_LUA, len(keys), *keys, lease, CONCURRENCY_LEASE_S, *caps) else None
+
+    def release(self, keys, lease: str):
+        pipe = self.client.pipeline(transaction=False)
+        for k in keys:
+            pipe.zrem(k, lease)
+        pipe.execute()
+
+def configure_limiter(url: Optional[str]):
+    """Keep limiter state at `url` (redis://host:port/db), or in this process (None or memory://)."""
+    global limiter, limiter_url
+    limiter = _RedisLimiter(url) if url and not url.startswith("memory://") else _MemoryLimiter()
+    limiter_url = url or None
+    return limiter
+
+def _admission_event(endpoint_class: str, event: str):
+    with _metrics_lock:
+        _admission_events[(endpoint_class, event)] = _admission_events.get((endpoint_class, event), 0) + 1
+
+def _rejected(endpoint_class: str, reason: str, retry_after: float):
+    _admission_event(endpoint_class, reason)
+    secs = max(1, math.ceil(retry_after))
+    message = "Rate limit exceeded" if reason == "rate" else "Too many requests in progress"
+    return None, (429, {"error": f"{message}; retry after {secs}s", "retry_after": secs})
+
+def _admit(username: str, role: str, endpoint_class: str):
+    """Admission control for one request of `endpoint_class` by an authenticated user.
+
+    Returns (release, None) - call release() once the request is done - or (None, (429, body)),
+    body["retry_after"] being the seconds for the Retry-After header. Limiter errors admit.
+    """
+    if not ADMISSION:
+        return (lambda: None), None
+    caps = CONCURRENCY_LIMITS.get(endpoint_class)
+    rate = RATE_LIMITS.get((role, endpoint_class)) or RATE_LIMITS.get(("*", endpoint_class))
+    keys, lease = [], None
+    try:
+        if caps:
+            keys = [f"admit:{endpoint_class}:user:{username}", f"admit:{endpoint_class}:all"]
+            lease = limiter.acquire(keys, caps)
+            if lease is None:
+                return _rejected(endpoint_class, "concurrency", CONCURRENCY_RETRY_S)
+        if rate:
+            per_minute, burst = rate
+            wait = limiter.take(f"rate:{role}:{endpoint_class}:{username}", per_minute / 60, burst)
+            if wait > 0:
+                if lease is not None:
+                    limiter.release(keys, lease)
+                return _rejected(endpoint_class, "rate", wait)
+    except CACHE_ERRORS:
+        # an unreachable limiter must not take the API down with it
+        _admission_event(endpoint_class, "limiter_error")
+        return (lambda: None), None
+
+    def release():
+        if lease is not None:
+            try:
+                limiter.release(keys, lease)
+            except CACHE_ERRORS:
+                pass   # the shared lease lapses after CONCURRENCY_LEASE_S
+    return release, None
+
 authorizations = {
     'Bearer': {'type': 'apiKey', 'in': 'header', 'name': 'Authorization'}
 }
 api = Api(
-    app,
     version="1.0",
     title="COMP9321 A2 GTFS API",
     description=(
@@ -81,6 +959,10 @@ api = Api(
 # -----------------------------------------------------------------------------
 # Models
 # -----------------------------------------------------------------------------
+def _hash_password(raw: str) -> str:
+    # hashlib's pbkdf2 releases the GIL, so threads hash in parallel (see _hash_pool)
+    return generate_password_hash(raw, method="pbkdf2:sha256", salt_length=16)
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
@@ -90,9 +972,13 @@ class User(Base):
     active = Column(Boolean, default=True, nullable=False)
     token = Column(String(64), unique=True)  # kept for backward-compat; unused with JWT
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # /admin/users filters by role and/or active and pages in id order
+    __table_args__ = (Index('ix_users_role_active', 'role', 'active', 'id'),
+                      Index('ix_users_role', 'role', 'id'),
+                      Index('ix_users_active', 'active', 'id'))
 
     def set_password(self, raw: str):
-        self.password_hash = generate_password_hash(raw, method="pbkdf2:sha256", salt_length=16)
+        self.password_hash = _hash_password(raw)
 
     def check_password(self, raw: str) -> bool:
         return check_password_hash(self.password_hash, raw)
@@ -103,45 +989,101 @@ class Agency(Base):
     mode = Column(String(20), nullable=False)
     agency_id = Column(String(40), nullable=False)
     imported_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    import_history = Column(Text)   # JSON list of recent import telemetry, newest first
     __table_args__ = (UniqueConstraint('mode', 'agency_id', name='uq_mode_agency'),)
 
+# GTFS data tables. agency_pk is gtfs_agencies.id; stops and trips get integer surrogate keys
+# (assigned at import, see _Interner) that stop_times references instead of the string ids.
+# The public string ids (route_id, stop_id, trip_id, "buses:GSBC001") are what the API exposes.
 class Route(Base):
     __tablename__ = 'gtfs_routes'
     id = Column(Integer, primary_key=True)
-    agency_key = Column(String(80), index=True)
-    route_id = Column(String(64), index=True)
+    agency_pk = Column(Integer, nullable=False)
+    route_id = Column(String(64))
     route_short_name = Column(String(64))
     route_long_name = Column(String(255))
     route_type = Column(Integer)
+    __table_args__ = (Index('ix_gtfs_routes_agency_route', 'agency_pk', 'route_id'),)
 
 class Stop(Base):
     __tablename__ = 'gtfs_stops'
     id = Column(Integer, primary_key=True)
-    agency_key = Column(String(80), index=True)
-    stop_id = Column(String(64), index=True)
+    agency_pk = Column(Integer, nullable=False)
+    stop_id = Column(String(64))
     stop_name = Column(String(255))
     stop_lat = Column(Float)
     stop_lon = Column(Float)
+    __table_args__ = (Index('ix_gtfs_stops_agency_stop', 'agency_pk', 'stop_id', unique=True),)
 
 class Trip(Base):
     __tablename__ = 'gtfs_trips'
     id = Column(Integer, primary_key=True)
-    agency_key = Column(String(80), index=True)
-    trip_id = Column(String(64), index=True)
-    route_id = Column(String(64), index=True)
+    agency_pk = Column(Integer, nullable=False)
+    trip_id = Column(String(64))
+    route_id = Column(String(64))
     service_id = Column(String(64))
     trip_headsign = Column(String(255))
     direction_id = Column(Integer)
+    __table_args__ = (Index('ix_gtfs_trips_agency_trip', 'agency_pk', 'trip_id', unique=True),
+                      Index('ix_gtfs_trips_agency_route', 'agency_pk', 'route_id'))
 
 class StopTime(Base):
+    # clustered on (trip, sequence): a trip's stops are adjacent on disk and need no extra index
     __tablename__ = 'gtfs_stop_times'
-    id = Column(Integer, primary_key=True)
-    agency_key = Column(String(80), index=True)
-    trip_id = Column(String(64), index=True)
-    arrival_time = Column(String(16))
-    departure_time = Column(String(16))
-    stop_id = Column(String(64), index=True)
-    stop_sequence = Column(Integer)
+    trip_pk = Column(Integer, primary_key=True)       # gtfs_trips.id
+    stop_sequence = Column(Integer, primary_key=True)
+    stop_pk = Column(Integer, nullable=False)         # gtfs_stops.id
+    arrival_secs = Column(Integer)     # seconds after midnight (may exceed 86400); see _gtfs_time
+    departure_secs = Column(Integer)
+    __table_args__ = (Index('ix_gtfs_stop_times_stop', 'stop_pk'), {'sqlite_with_rowid': False})
+
+class RouteStat(Base):
+    # per-route service summary computed at import (_RouteStats); direction_id -1 is the whole route
+    __tablename__ = 'gtfs_route_stats'
+    agency_pk = Column(Integer, primary_key=True)
+    route_id = Column(String(64), primary_key=True)
+    direction_id = Column(Integer, primary_key=True)
+    trip_count = Column(Integer, nullable=False)
+    stop_count = Column(Integer, nullable=False)       # distinct stops served
+    first_departure_secs = Column(Integer)             # earliest/latest trip start, seconds after midnight
+    last_departure_secs = Column(Integer)
+    headway_secs = Column(Integer)     # median gap between consecutive trips of one direction and service
+    median_trip_secs = Column(Integer)
+    __table_args__ = ({'sqlite_with_rowid': False},)
+
+# Reverse indexes built at import (_RouteStats), so relational filters never scan stop_times.
+# Trips that stop at the same stops in the same order share one pattern; a feed has a few
+# hundred patterns where it has millions of stop_times.
+class RoutePattern(Base):
+    __tablename__ = 'gtfs_route_patterns'
+    agency_pk = Column(Integer, primary_key=True)
+    pattern_id = Column(Integer, primary_key=True)    # numbered per agency by route, direction, most trips
+    route_id = Column(String(64), nullable=False)
+    direction_id = Column(Integer, nullable=False)
+    trip_count = Column(Integer, nullable=False)
+    __table_args__ = (Index('ix_gtfs_route_patterns_route', 'agency_pk', 'route_id'), {'sqlite_with_rowid': False})
+
+class PatternStop(Base):
+    __tablename__ = 'gtfs_pattern_stops'
+    agency_pk = Column(Integer, primary_key=True)
+    pattern_id = Column(Integer, primary_key=True)
+    position = Column(Integer, primary_key=True)      # 0-based order along the pattern
+    stop_pk = Column(Integer, nullable=False)         # gtfs_stops.id
+    __table_args__ = ({'sqlite_with_rowid': False},)
+
+class TripPattern(Base):
+    __tablename__ = 'gtfs_trip_patterns'
+    trip_pk = Column(Integer, primary_key=True)       # gtfs_trips.id
+    agency_pk = Column(Integer, nullable=False)
+    pattern_id = Column(Integer, nullable=False)
+    __table_args__ = ({'sqlite_with_rowid': False},)
+
+class StopRoute(Base):
+    __tablename__ = 'gtfs_stop_routes'
+    stop_pk = Column(Integer, primary_key=True)       # gtfs_stops.id
+    route_id = Column(String(64), primary_key=True)
+    agency_pk = Column(Integer, nullable=False)
+    __table_args__ = (Index('ix_gtfs_stop_routes_route', 'agency_pk', 'route_id'), {'sqlite_with_rowid': False})
 
 class Favourite(Base):
     __tablename__ = "favourites"
@@ -157,7 +1099,65 @@ class Favourite(Base):
     )
 
 
-Base.metadata.create_all(engine)
+GTFS_DATA_MODELS = (Route, Stop, Trip, StopTime, RouteStat, RoutePattern, PatternStop, TripPattern, StopRoute)
+
+# gtfs_agencies.id <-> "mode:agency_id". Agency rows are never deleted, so entries stay valid
+# for the life of the database (configure_database clears them).
+_agency_pks_by_key = {}
+_agency_keys_by_pk = {}
+
+def _cache_agencies(rows):
+    for pk, mode, agency_id in rows:
+        key = f"{mode}:{agency_id}"
+        _agency_pks_by_key[key] = pk
+        _agency_keys_by_pk[pk] = key
+
+def _agency_pks(db, agency_keys) -> dict:
+    """{agency_key: agency pk} for the given keys that have an agency row (or are in the snapshot)."""
+    if snapshot is None and any(k not in _agency_pks_by_key for k in agency_keys):
+        _cache_agencies(db.query(Agency.id, Agency.mode, Agency.agency_id).all())
+    return {k: _agency_pks_by_key[k] for k in agency_keys if k in _agency_pks_by_key}
+
+def _agency_order(model, agency_keys):
+    """ORDER BY terms that sort rows of several agencies by agency key (pks follow import order).
+
+    The keys' pks must already be cached (resolved through _agency_pks).
+    """
+    if len(agency_keys) < 2:
+        return ()
+    ranks = {_agency_pks_by_key[k]: i for i, k in enumerate(sorted(agency_keys))}
+    return (case(ranks, value=model.agency_pk),)
+
+log = logging.getLogger(__name__)   # the Flask app's logger (app.name is the module name)
+
+class SchemaOutdated(RuntimeError):
+    """GTFS tables were built for an older schema; `flask init-db --reset-gtfs` drops them."""
+
+def _migrate_gtfs_schema(bind, reset_gtfs: bool = False):
+    """Add new nullable columns to gtfs_agencies in place, and find GTFS data tables whose columns
+    no longer match the models.
+
+    Those tables are only dropped (they are re-importable) with `reset_gtfs`; otherwise this raises
+    SchemaOutdated naming them. There are no migrations in this project; user tables are never touched here.
+    """
+    insp = inspect(bind)
+    agencies = Agency.__table__
+    if insp.has_table(agencies.name):
+        existing = {c["name"] for c in insp.get_columns(agencies.name)}
+        for col in agencies.columns:
+            if col.name not in existing:
+                log.info("schema: adding column %s.%s", agencies.name, col.name)
+                with bind.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {agencies.name} ADD COLUMN {col.name} {col.type.compile(bind.dialect)}"))
+    outdated = [model.__table__ for model in GTFS_DATA_MODELS
+                if insp.has_table(model.__table__.name)
+                and {c["name"] for c in insp.get_columns(model.__table__.name)} != {c.name for c in model.__table__.columns}]
+    if outdated and not reset_gtfs:
+        raise SchemaOutdated(f"GTFS tables {', '.join(t.name for t in outdated)} were built for an older schema; "
+                             "run `flask --app api init-db --reset-gtfs` to drop them, then re-import the agencies")
+    for table in outdated:
+        log.warning("schema: dropping outdated %s (re-import GTFS agencies to refill)", table.name)
+        table.drop(bind)
 
 # --- Seed default users (admin/planner/commuter) for first run ---
 def _ensure_user(db, username: str, password: str, role: str):
@@ -168,39 +1168,124 @@ def _ensure_user(db, username: str, password: str, role: str):
         db.add(u)
         db.commit()
 
-with SessionLocal() as _db:
-    _ensure_user(_db, 'admin',    'admin',    'admin')
-    _ensure_user(_db, 'planner',  'planner',  'planner')
-    _ensure_user(_db, 'commuter', 'commuter', 'commuter')
+
+# --- Schema + seed: explicit and idempotent, never at import time ---
+_db_ready = False
+_db_init_lock = threading.Lock()
+
+def init_db(reset_gtfs: bool = False):
+    """Create/upgrade the schema and seed the default users. Safe to run any number of times.
+
+    Raises SchemaOutdated if GTFS tables need dropping and `reset_gtfs` is not set.
+    """
+    global _db_ready
+    _migrate_gtfs_schema(engine, reset_gtfs)
+    Base.metadata.create_all(engine)
+    for index in User.__table__.indexes:   # create_all() skips new indexes of an existing table
+        index.create(engine, checkfirst=True)
+    with SessionLocal() as db:
+        _ensure_user(db, 'admin',    'admin',    'admin')
+        _ensure_user(db, 'planner',  'planner',  'planner')
+        _ensure_user(db, 'commuter', 'commuter', 'commuter')
+    SessionLocal.remove()
+    _db_ready = True
+
+def ensure_db():
+    """Run init_db() once per process."""
+    if not _db_ready:
+        with _db_init_lock:
+            if not _db_ready:
+                init_db()
+
+@core.before_app_request
+def _init_db_on_first_request():
+    if current_app.config["AUTO_INIT_DB"]:
+        try:
+            ensure_db()
+        except SchemaOutdated as e:
+            current_app.logger.error("%s", e)
+            return {"error": str(e)}, 503
 
 
 # -----------------------------------------------------------------------------
 # Auth Helpers (JWT)
 # -----------------------------------------------------------------------------
 
-def _user_from_identity(identity: str) -> Optional[User]:
+def _user_from_identity(identity: str, db=None) -> Optional[User]:
+    """The user behind a JWT identity: from the auth cache, else from `db` (default g.db)."""
     if not identity:
         return None
-    return g.db.query(User).filter(User.username == identity).first()
+    key = f"auth:{identity}" if cache is not None else None
+    with span("user"):
+        state = _cache_get("auth", key, span_name=None)   # timed as part of "user"
+        if state is not None:
+            # a detached User with what the handlers read; never added to a session
+            return User(**json.loads(state))
+        user = (db or g.db).query(User).filter(User.username == identity).first()
+    if user is not None:
+        _cache_set("auth", key, json.dumps({"id": user.id, "username": user.username, "role": user.role,
+                                            "active": user.active}).encode(), CACHE_AUTH_TTL_S)
+    return user
+
+def _forget_user(username: str):
+    """Drop a user's cached auth state after changing or deleting them (every node shares it)."""
+    if cache is not None:
+        try:
+            cache.delete(f"auth:{username}")
+        except CACHE_ERRORS:
+            _cache_count("auth", "error")
+
 
+def _authenticate(identity: str, allowed: tuple, endpoint_class: str, db=None, profile: bool = False):
+    """The checks behind require_auth, shared with asgi.py's native handlers.
 
-def require_auth(role: Optional[str] = None, roles: Optional[tuple] = None):
-    """Decorator: require logged-in user; enforce a single role or any of roles."""
+    Looks the user up (auth cache first), checks active and role (and admin for `profile`), then
+    admits the request (_admit). Returns (user, release, None) - call release() once the request
+    is done - or (None, None, (status, body)).
+    """
+    user = _user_from_identity(identity, db)
+    if user is None:
+        return None, None, (401, {"error": "Unauthorized"})
+    if not user.active:
+        return None, None, (403, {"error": "Account deactivated"})
+    if allowed and user.role not in allowed:
+        return None, None, (403, {"error": "Forbidden"})
+    if profile and user.role != 'admin':
+        return None, None, (403, {"error": "Profiling is admin-only"})
+    release, err = _admit(user.username, user.role, endpoint_class)
+    if err:
+        return None, None, err
+    return user, release, None
+
+def require_auth(role: Optional[str] = None, roles: Optional[tuple] = None, limit: str = "read"):
+    """Decorator: require logged-in user; enforce a single role or any of roles.
+
+    `limit` is the endpoint class whose rate limit and concurrency cap apply (see _admit), or a
+    callable returning it for the current request.
+    """
     allowed = roles if roles else ((role,) if role else tuple())
     def deco(fn):
-        @jwt_required()
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            username = get_jwt_identity()
-            user = _user_from_identity(username)
-            if user is None:
-                return {"error": "Unauthorized"}, 401
-            if not user.active:
-                return {"error": "Account deactivated"}, 403
-            if allowed and user.role not in allowed:
-                return {"error": "Forbidden"}, 403
+            with span("jwt"):
+                verify_jwt_in_request()
+            profile = request.args.get('profile') == '1'
+            if profile and request.method != 'GET':
+                return {"error": "profile=1 is only allowed on GET requests"}, 400
+            user, release, err = _authenticate(get_jwt_identity(), allowed, limit() if callable(limit) else limit,
+                                               profile=profile)
+            if err:
+                code, body = err
+                return (body, code, {"Retry-After": str(body["retry_after"])}) if code == 429 else (body, code)
             request.user = user
-            return fn(*args, **kwargs)
+            try:
+                if profile:
+                    return _profiled(fn, *args, **kwargs)
+                return fn(*args, **kwargs)
+            except AgencyNotImported:   # its data went away after the endpoint checked it
+                return {"error": "Agency not imported"}, 404
+            finally:
+                release()
         return wrapper
     return deco
 
@@ -235,8 +1320,24 @@ admin_user_patch_model = api.model('UserPatch', {
     'active': fields.Boolean(required=True, description='Activate or deactivate user')
 })
 
+user_page_model = api.model('UserPage', {
+    'items': fields.List(fields.Nested(user_model)),
+    'total': fields.Integer(example=1250),
+    'page': fields.Integer(example=1),
+    'page_size': fields.Integer(example=50),
+})
+
+bulk_users_model = api.model('BulkUsers', {
+    'action': fields.String(enum=['create', 'activate', 'deactivate'], required=True, example='create'),
+    'users': fields.List(fields.Raw, required=True,
+                         description="create: [{username, password, role(planner|commuter)}]; "
+                                     "activate/deactivate: [username]",
+                         example=[{"username": "c0001", "password": "pw", "role": "commuter"}]),
+})
+
 pagination_model = api.model("Pagination", {
-    "agency": fields.String(example="buses:GSBC001"),
+    "agency": fields.String(example="buses:GSBC001",
+                            description="Agency key, or comma-separated keys for a multi-agency query"),
     "total": fields.Integer(example=633),
     "page": fields.Integer(example=1),
     "page_size": fields.Integer(example=50),
@@ -245,16 +1346,49 @@ pagination_model = api.model("Pagination", {
 token_model = api.model('Token', {'token': fields.String})
 
 route_item = api.model("RouteItem", {
+    "agency": fields.String(example="buses:GSBC001"),
     "route_id": fields.String(example="4000"),
     "route_short_name": fields.String(example="4000"),
     "route_long_name": fields.String(example="Penrith to Mt Druitt"),
     "route_type": fields.Integer(example=3),
 })
+route_summary = api.model("RouteSummary", {
+    "trip_count": fields.Integer(example=412),
+    "stop_count": fields.Integer(example=57, description="Distinct stops served"),
+    "first_departure": fields.String(example="05:12:00", description="Earliest trip start (HH:MM:SS)"),
+    "last_departure": fields.String(example="23:48:00", description="Latest trip start (may pass 24:00:00)"),
+    "headway_mins": fields.Float(example=15.0, description="Median gap between consecutive trips of one "
+                                                           "direction and service"),
+    "median_trip_mins": fields.Float(example=42.5, description="Median first-to-last-stop running time"),
+})
+route_list_item = api.inherit("RouteListItem", route_item, {
+    "summary": fields.Nested(route_summary, allow_null=True,
+                             description="Whole-route statistics from the last import (null before one)"),
+})
 routes_response = api.inherit("RoutesResponse", pagination_model, {
-    "items": fields.List(fields.Nested(route_item))
+    "items": fields.List(fields.Nested(route_list_item))
+})
+route_direction_summary = api.inherit("RouteDirectionSummary", route_summary, {
+    "direction_id": fields.Integer(example=0),
+})
+route_stats_response = api.model("RouteStats", {
+    "route": fields.Nested(route_item),
+    "summary": fields.Nested(route_summary),
+    "directions": fields.List(fields.Nested(route_direction_summary)),
+})
+
+route_pattern = api.model("RoutePattern", {
+    "pattern_id": fields.Integer(example=3),
+    "direction_id": fields.Integer(example=0),
+    "trip_count": fields.Integer(example=140, description="Trips that run this exact stop sequence"),
+    "stops": fields.List(fields.String, example=["2145101", "2145102"], description="stop_ids in order"),
+})
+route_detail = api.inherit("RouteDetail", route_list_item, {
+    "patterns": fields.List(fields.Nested(route_pattern), description="Distinct stop sequences, busiest first"),
 })
 
 stop_item = api.model("StopItem", {
+    "agency": fields.String(example="buses:GSBC001"),
     "stop_id": fields.String(example="123456"),
     "stop_name": fields.String(example="Penrith Station, Stand A"),
     "stop_lat": fields.Float(example=-33.7503),
@@ -263,8 +1397,12 @@ stop_item = api.model("StopItem", {
 stops_response = api.inherit("StopsResponse", pagination_model, {
     "items": fields.List(fields.Nested(stop_item))
 })
+stop_detail = api.inherit("StopDetail", stop_item, {
+    "routes": fields.List(fields.String, example=["4000", "4001"], description="route_ids serving the stop"),
+})
 
 trip_item = api.model("TripItem", {
+    "agency": fields.String(example="buses:GSBC001"),
     "trip_id": fields.String(example="2501_4000_1"),
     "route_id": fields.String(example="4000"),
     "service_id": fields.String(example="WEEKDAY"),
@@ -274,6 +1412,33 @@ trip_item = api.model("TripItem", {
 trips_response = api.inherit("TripsResponse", pagination_model, {
     "items": fields.List(fields.Nested(trip_item))
 })
+trip_detail = api.inherit("TripDetail", trip_item, {
+    "pattern_id": fields.Integer(example=3, allow_null=True),
+    "stops": fields.List(fields.String, example=["2145101", "2145102"], description="stop_ids in order"),
+})
+
+batch_request_model = api.model("BatchRequest", {
+    "agency": fields.String(required=True, example="GSBC001"),
+    "route_ids": fields.List(fields.String, description="Routes to fetch by id"),
+    "trip_ids": fields.List(fields.String, description="Trips to fetch by id"),
+    "stop_ids": fields.List(fields.String, description="Stops to fetch by id"),
+    "trips_for_routes": fields.List(fields.String, description="Route ids whose trips should be listed"),
+    "stops_for_trips": fields.List(fields.String, description="Trip ids whose ordered stops should be listed"),
+})
+trip_stop_item = api.inherit("TripStopItem", stop_item, {
+    "stop_sequence": fields.Integer(example=1),
+    "arrival_time": fields.String(example="05:12:00"),
+    "departure_time": fields.String(example="05:12:00"),
+})
+batch_response_model = api.model("BatchResponse", {
+    "agency": fields.String(example="buses:GSBC001"),
+    "routes": fields.List(fields.Nested(route_item)),
+    "trips": fields.List(fields.Nested(trip_item)),
+    "stops": fields.List(fields.Nested(stop_item)),
+    "trips_by_route": fields.Raw(description="route_id -> list of TripItem"),
+    "stops_by_trip": fields.Raw(description="trip_id -> ordered list of TripStopItem"),
+    "missing": fields.Raw(description="Requested ids that were not found, per list"),
+})
 
 favorite_create_model = api.model('FavoriteCreate', {
     'agency': fields.String(required=True, description="Agency id (e.g., 'GSBC001')"),
@@ -338,23 +1503,162 @@ class Login(Resource):
         token = create_access_token(identity=user.username)
         return {"token": token}
 
+USER_ROLES = ('admin', 'planner', 'commuter')
+USER_BULK_MAX = int(os.getenv("USER_BULK_MAX", "500"))         # users per bulk request
+USER_WRITE_BATCH = int(os.getenv("USER_WRITE_BATCH", "500"))   # users per bulk transaction
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+_hash_pool_instance = None
+
+def _hash_pool():
+    """Shared thread pool for password hashing: pbkdf2 (about 0.4 s per password) runs outside
+    the GIL, so one thread per core hashes in parallel without pickling or extra processes."""
+    global _hash_pool_instance
+    if _hash_pool_instance is None:
+        _hash_pool_instance = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
+    return _hash_pool_instance
+
+def _user_public(u) -> dict:
+    return {"id": u.id, "username": u.username, "role": u.role, "active": u.active,
+            "created_at": (u.created_at.isoformat() if u.created_at else None)}
+
+def _flag(raw: str) -> Optional[bool]:
+    return {"1": True, "true": True, "0": False, "false": False}.get(raw.strip().lower())
+
+def _existing_users(db, usernames) -> dict:
+    """{username: (id, active)} of those that exist, in IN chunks."""
+    found = {}
+    for chunk in _chunks(usernames):
+        for uid, username, active in db.execute(select(User.id, User.username, User.active)
+                                                .where(User.username.in_(chunk))):
+            found[username] = (uid, active)
+    return found
+
+def _bulk_create_users(db, items) -> tuple:
+    """Create users; returns (results in request order, seconds waiting on hashes, seconds writing).
+
+    Every password is handed to _hash_pool() up front; rows are inserted USER_WRITE_BATCH at a time,
+    one transaction each, as soon as their hashes are ready, so writes overlap the remaining hashing.
+    """
+    results = [None] * len(items)
+    todo, seen = [], set()
+    for i, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        username = str(item.get('username') or '').strip()
+        password, role = item.get('password'), item.get('role')
+        if not username or not isinstance(password, str) or not password or role not in ('planner', 'commuter'):
+            results[i] = {"index": i, "username": username or None, "status": "error",
+                          "error": "username, password, role(planner|commuter) required"}
+        elif len(username) > User.__table__.c.username.type.length:
+            results[i] = {"index": i, "username": username, "status": "error", "error": "username too long"}
+        elif username in seen:
+            results[i] = {"index": i, "username": username, "status": "error", "error": "duplicate username in request"}
+        else:
+            seen.add(username)
+            todo.append((i, username, password, role))
+    existing = _existing_users(db, [t[1] for t in todo])
+    for i, username, _, _ in todo:
+        if username in existing:
+            results[i] = {"index": i, "username": username, "status": "error", "error": "username already exists"}
+    todo = [t for t in todo if t[1] not in existing]
+
+    hash_s = write_s = 0.0
+    hashes = _hash_pool().map(_hash_password, [t[2] for t in todo])
+    for batch in _chunks(todo, USER_WRITE_BATCH):
+        t0 = time.perf_counter()
+        rows = [{"username": username, "password_hash": next(hashes), "role": role, "active": True,
+                 "created_at": datetime.utcnow()} for _, username, _, role in batch]
+        t1 = time.perf_counter()
+        hash_s += t1 - t0
+        failed = {}
+        try:
+            db.execute(insert(User.__table__), rows)
+            db.commit()
+        except IntegrityError:   # a name taken since the check: insert this batch row by row
+            db.rollback()
+            for row in rows:
+                try:
+                    db.execute(insert(User.__table__), row)
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+                    failed[row["username"]] = "username already exists"
+        ids = {username: uid for username, (uid, _) in _existing_users(db, [t[1] for t in batch]).items()}
+        for i, username, _, role in batch:
+            results[i] = ({"index": i, "username": username, "status": "error", "error": failed[username]}
+                          if username in failed else
+                          {"index": i, "username": username, "status": "created", "id": ids.get(username), "role": role})
+        write_s += time.perf_counter() - t1
+    return results, hash_s, write_s
+
+def _bulk_set_active(db, items, active: bool) -> tuple:
+    """Activate or deactivate users by name in USER_WRITE_BATCH transactions; returns (results, write seconds)."""
+    t0 = time.perf_counter()
+    results = [None] * len(items)
+    todo, seen = [], set()
+    for i, item in enumerate(items):
+        username = item.strip() if isinstance(item, str) else ""
+        if not username:
+            results[i] = {"index": i, "username": None, "status": "error", "error": "username (string) required"}
+        elif username in seen:
+            results[i] = {"index": i, "username": username, "status": "error", "error": "duplicate username in request"}
+        elif not active and username == 'admin':
+            results[i] = {"index": i, "username": username, "status": "error", "error": "cannot deactivate the Admin account"}
+        else:
+            seen.add(username)
+            todo.append((i, username))
+    status = "activated" if active else "deactivated"
+    for batch in _chunks(todo, USER_WRITE_BATCH):
+        found = _existing_users(db, [username for _, username in batch])
+        change = [username for _, username in batch if username in found and found[username][1] != active]
+        for chunk in _chunks(change):
+            db.execute(update(User).where(User.username.in_(chunk)).values(active=active))
+        db.commit()
+        for username in change:
+            _forget_user(username)
+        for i, username in batch:
+            if username not in found:
+                results[i] = {"index": i, "username": username, "status": "error", "error": "not found"}
+            else:
+                results[i] = {"index": i, "username": username, "id": found[username][0],
+                              "status": status if username in change else "unchanged"}
+    return results, time.perf_counter() - t0
+
 @admin_ns.route('/users')
 class Users(Resource):
     @require_auth(role='admin')
+    @admin_ns.response(200, "OK", user_page_model)
+    @admin_ns.response(400, "Invalid filter", error_model)
     @admin_ns.doc(
         summary="List users",
-        description="**Role:** Admin only.",
-        responses={200: "OK", 401: "Unauthorized", 403: "Forbidden"}
+        description="**Role:** Admin only. Pages in id order; filter by `role` and/or `active`.",
+        params={"role": "admin | planner | commuter", "active": "true | false",
+                "page": "Page number (default 1)", "page_size": "Items per page (default 50, max 200)"},
+        responses={401: "Unauthorized", 403: "Forbidden"}
     )
     def get(self):
-        users = g.db.query(User).order_by(User.id.asc()).all()
-        return [{
-            'id': u.id,
-            'username': u.username,
-            'role': u.role,
-            'active': u.active,
-            'created_at': (u.created_at.isoformat() if u.created_at else None)
-        } for u in users]
+        page, page_size = _get_pagination()
+        clauses = []
+        role = request.args.get('role')
+        if role:
+            if role not in USER_ROLES:
+                return {"error": f"role must be one of: {', '.join(USER_ROLES)}"}, 400
+            clauses.append(User.role == role)
+        if request.args.get('active'):
+            active = _flag(request.args['active'])
+            if active is None:
+                return {"error": "active must be true or false"}, 400
+            clauses.append(User.active == active)
+        # one (role, active, id) / (role, id) / (active, id) index per filter: the count and the page
+        # read it in id order, with no sort
+        with span("count"):
+            total = g.db.query(func.count(User.id)).filter(*clauses).scalar()
+        with span("page"):
+            users = (g.db.query(User.id, User.username, User.role, User.active, User.created_at)
+                     .filter(*clauses).order_by(User.id.asc())
+                     .offset((page - 1) * page_size).limit(page_size).all())
+        return _json_response({"items": [_user_public(u) for u in users], "total": total,
+                               "page": page, "page_size": page_size})
 
     @require_auth(role='admin')
     @admin_ns.expect(user_create_model, validate=False)
@@ -377,7 +1681,47 @@ class Users(Resource):
         u.set_password(password)
         g.db.add(u)
         g.db.commit()
-        return {"id": u.id, "username": u.username, "role": u.role, "active": u.active, "created_at": (u.created_at.isoformat() if u.created_at else None)}, 201
+        return _user_public(u), 201
+
+@admin_ns.route('/users/bulk')
+class UsersBulk(Resource):
+    @require_auth(role='admin', limit="users")
+    @admin_ns.expect(bulk_users_model, validate=False)
+    @admin_ns.response(200, "Per-user results and timings")
+    @admin_ns.response(400, "Bad request", error_model)
+    @admin_ns.response(429, "User provisioning rate limit or concurrency cap reached (see Retry-After)", error_model)
+    @admin_ns.doc(
+        summary="Create, activate or deactivate many users in one call",
+        description=(
+            "**Role:** Admin only. `action=create` takes `users: [{username, password, role}]` "
+            "(role planner|commuter); `activate`/`deactivate` take `users: [username]`. "
+            f"Up to {USER_BULK_MAX} users. Passwords are hashed in parallel and rows are written in "
+            f"transactions of {USER_WRITE_BATCH}. Each user gets a result in request order "
+            "(`created`, `activated`, `deactivated`, `unchanged` or `error` with a reason); "
+            "one bad item never fails the others."
+        ),
+    )
+    def post(self):
+        wall0 = time.perf_counter()
+        payload = request.get_json(silent=True) or {}
+        if not isinstance(payload, dict):
+            return {"error": "body must be a JSON object"}, 400
+        action, items = payload.get('action'), payload.get('users')
+        if action not in ('create', 'activate', 'deactivate'):
+            return {"error": "action must be 'create', 'activate' or 'deactivate'"}, 400
+        if not isinstance(items, list) or not items:
+            return {"error": "users must be a non-empty list"}, 400
+        if len(items) > USER_BULK_MAX:
+            return {"error": f"at most {USER_BULK_MAX} users per request"}, 400
+        hash_s = 0.0
+        if action == 'create':
+            results, hash_s, write_s = _bulk_create_users(g.db, items)
+        else:
+            results, write_s = _bulk_set_active(g.db, items, action == 'activate')
+        failed = sum(r["status"] == "error" for r in results)
+        return _json_response({"action": action, "total": len(results), "ok": len(results) - failed,
+                               "failed": failed, "hash_s": round(hash_s, 3), "write_s": round(write_s, 3),
+                               "wall_s": round(time.perf_counter() - wall0, 3), "results": results})
 
 @admin_ns.route('/users/<int:user_id>')
 class UserItem(Resource):
@@ -386,7 +1730,7 @@ class UserItem(Resource):
         u = g.db.query(User).get(user_id)
         if not u:
             return {"error":"not found"}, 404
-        return {"id": u.id, "username": u.username, "role": u.role, "active": u.active, "created_at": (u.created_at.isoformat() if u.created_at else None)}
+        return _user_public(u)
 
     @require_auth(role='admin')
     @admin_ns.expect(admin_user_patch_model, validate=True)
@@ -400,178 +1744,2015 @@ class UserItem(Resource):
             return {"error":"active(boolean) required"}, 400
         u.active = bool(payload['active'])
         g.db.commit()
+        _forget_user(u.username)
+        return _user_public(u)
+    
+    @require_auth(role='admin')
+    def delete(self, user_id: int):
+        u = g.db.query(User).get(user_id)
+        if not u:
+            return {"error":"not found"}, 404
+        if u.username == 'admin':
+            return {"error":"cannot delete the Admin account"}, 400
+        g.db.delete(u)
+        g.db.commit()
+        _forget_user(u.username)
+        return {"status":"deleted"}
+
+@admin_ns.route('/slow-queries')
+class SlowQueries(Resource):
+    @require_auth(role='admin')
+    @admin_ns.doc(
+        summary="Recent slow SQL statements",
+        description=(
+            f"SELECTs that took at least `SLOW_QUERY_MS` (currently {SLOW_QUERY_MS:g} ms) while serving a request, "
+            "newest first, with parameters and `EXPLAIN QUERY PLAN` output. Keeps the last "
+            f"{SLOW_QUERY_KEEP}.\n\n"
+            "Any authenticated GET endpoint can also be profiled by an admin with `?profile=1` "
+            "(optional `profile_sort=cumulative|tottime|calls`, `profile_limit`): the response is then "
+            "the cProfile report as text instead of the normal body.\n\n"
+            "**Role:** Admin only."
+        ),
+        params={"limit": "Max entries to return (default 50)"},
+    )
+    def get(self):
+        try:
+            limit = max(1, int(request.args.get('limit') or 50))
+        except ValueError:
+            return {"error": "limit must be int"}, 400
+        items = list(_slow_queries)[::-1][:limit]
+        return {"threshold_ms": SLOW_QUERY_MS, "total": len(_slow_queries), "items": items}
+
+# -----------------------------------------------------------------------------
+# GTFS Constants & Import
+# -----------------------------------------------------------------------------
+GTFS_BASE_URL = "https://api.transport.nsw.gov.au/v1/gtfs/schedule"
+GTFS_VALID = {
+    'buses': ['GSBC001','GSBC002','GSBC003','GSBC004','SBSC006','GSBC007','GSBC008','GSBC009','GSBC010','GSBC014']
+}
+
+def _tfnsw_api_key():
+    """Read TfNSW API key from env; this course mandates the name TRANSPORT_API_KEY."""
+    key = os.getenv('TRANSPORT_API_KEY')
+    return key
+
+GTFS_LOCAL_DIR = Path(os.getenv("GTFS_LOCAL_DIR", _base / "feeds"))  # offline feeds: <agency_id>.zip
+GTFS_SPOOL_DIR = Path(os.getenv("GTFS_SPOOL_DIR", Path(tempfile.gettempdir()) / "gtfs-spool"))
+GTFS_MAX_ZIP_BYTES = int(os.getenv("GTFS_MAX_ZIP_MB", "1024")) * 1024 * 1024
+# hosts `?url=` may fetch from without the public-address check (e.g. an internal feed mirror)
+GTFS_URL_ALLOWLIST = frozenset(h.strip().lower() for h in os.getenv("GTFS_URL_ALLOWLIST", "").split(",") if h.strip())
+SPOOL_CHUNK = 1024 * 1024
+WRITE_BATCH = 5000  # rows per INSERT ... VALUES batch
+
+IMPORT_HISTORY = int(os.getenv("GTFS_IMPORT_HISTORY", "20"))  # telemetry runs kept per agency
+
+_PAGE_BYTES = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def _rss_mb() -> Optional[float]:
+    """Current resident set size of the calling process in MB (None without /proc).
+
+    Not getrusage's ru_maxrss: that is the process's lifetime high-water mark, so in a long-lived
+    worker every phase would report the largest import it ever ran.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            resident = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident * _PAGE_BYTES / (1024 * 1024), 1)
+
+
+class ImportTelemetry:
+    """Per-phase seconds, bytes, rows and peak RSS for one import run.
+
+    Parsing and inserting are pipelined, so parse:* seconds are summed worker time and insert:*
+    seconds summed writer time; `total_s` is wall time. A phase's peak RSS is the largest RSS
+    sampled at the end of its batches: the parser process's for parse phases, this process's
+    for everything else.
+    """
+
+    def __init__(self, agency_key: str, source: str = ""):
+        self.agency_key = agency_key
+        self.source = source
+        self.started_at = datetime.utcnow()
+        self.t0 = time.perf_counter()
+        self.phases = {}      # name -> {"phase", "secs", "bytes", "rows", "peak_rss_mb"}, in first-seen order
+        self.current = None   # phase in progress, for live progress
+
+    def add(self, name: str, secs: float, rows: Optional[int] = None, nbytes: Optional[int] = None,
+            peak_rss_mb: Optional[float] = None):
+        ph = self.phases.setdefault(name, {"phase": name, "secs": 0.0, "bytes": None, "rows": None,
+                                           "peak_rss_mb": None})
+        ph["secs"] += secs
+        if rows is not None:
+            ph["rows"] = (ph["rows"] or 0) + rows
+        if nbytes is not None:
+            ph["bytes"] = (ph["bytes"] or 0) + nbytes
+        if peak_rss_mb is not None:
+            ph["peak_rss_mb"] = max(ph["peak_rss_mb"] or 0, peak_rss_mb)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block; the block may set info["rows"] / info["bytes"]."""
+        self.current = name
+        info = {}
+        t0 = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.current = None
+        self.add(name, time.perf_counter() - t0, rows=info.get("rows"), nbytes=info.get("bytes"),
+                 peak_rss_mb=_rss_mb())
+
+    def as_dict(self, status: str = "ok", error: Optional[str] = None) -> dict:
+        phases = []
+        for ph in self.phases.values():
+            secs = ph["secs"]
+            phases.append(dict(ph, secs=round(secs, 3),
+                               rows_per_s=round(ph["rows"] / secs) if ph["rows"] and secs > 0 else None))
+        total_s = time.perf_counter() - self.t0
+        rows = sum(ph["rows"] or 0 for ph in self.phases.values() if ph["phase"].startswith("insert:"))
+        return {
+            "agency": self.agency_key,
+            "source": self.source,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "status": status,
+            "error": error,
+            "current_phase": self.current,
+            "total_s": round(total_s, 3),
+            "rows": rows,
+            "rows_per_s": round(rows / total_s) if total_s > 0 else None,
+            "peak_rss_mb": max((ph["peak_rss_mb"] for ph in phases if ph["peak_rss_mb"] is not None), default=None),
+            "phases": phases,
+        }
+
+_imports_running = {}  # agency_key -> ImportTelemetry of an import in progress
+
+class FeedTooLarge(ValueError):
+    pass
+
+def _spool_file(suffix: str):
+    """Create an empty temp file in GTFS_SPOOL_DIR; return (open binary file, path)."""
+    GTFS_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(prefix="gtfs-", suffix=suffix, dir=GTFS_SPOOL_DIR)
+    return os.fdopen(fd, "wb"), Path(name)
+
+class _ZipSpool:
+    """Incremental form of _spool_zip for callers that receive chunks one at a time (asgi.py).
+
+    write() each chunk, then finish() to validate and get the path, or abort() to delete the file.
+    """
+
+    def __init__(self):
+        self.file, self.path = _spool_file(".zip")
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > GTFS_MAX_ZIP_BYTES:
+            raise FeedTooLarge(f"GTFS zip exceeds {GTFS_MAX_ZIP_BYTES // (1024 * 1024)} MB")
+        self.file.write(chunk)
+
+    def finish(self) -> Path:
+        self.file.close()
+        if not zipfile.is_zipfile(self.path):
+            raise zipfile.BadZipFile("not a zip archive")
+        return self.path
+
+    def abort(self):
+        self.file.close()
+        self.path.unlink(missing_ok=True)
+
+def _spool_zip(chunks) -> Path:
+    """Write an iterable of byte chunks to a temp file in GTFS_SPOOL_DIR and return its path.
+
+    Keeps at most one chunk in memory; the file is validated as a zip archive.
+    """
+    spool = _ZipSpool()
+    try:
+        for chunk in chunks:
+            spool.write(chunk)
+        return spool.finish()
+    except BaseException:
+        spool.abort()
+        raise
+
+def _discard_spooled(path):
+    """Delete `path` if it is one of our spooled temp files (local feeds are left alone)."""
+    if isinstance(path, Path) and path.parent == GTFS_SPOOL_DIR:
+        path.unlink(missing_ok=True)
+
+def _stream_chunks(fp, size: int = SPOOL_CHUNK):
+    while True:
+        chunk = fp.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+def _download_zip(url: str, headers=None, session=None, redirects: bool = True, address=None) -> Path:
+    """Stream `url` into the spool dir; with `address` (see _check_feed_url), connect to that
+    address instead of resolving the host again."""
+    import requests
+    if address is not None:
+        with _pinned_session(url) as pinned:
+            url, host = _pin_url(url, address)
+            return _download_zip(url, headers={**(headers or {}), "Host": host}, session=pinned,
+                                 redirects=redirects)
+    with (session or requests).get(url, headers=headers, timeout=60, stream=True, allow_redirects=redirects) as r:
+        if r.status_code != 200:
+            raise RuntimeError(f"GTFS fetch failed: {r.status_code}")
+        return _spool_zip(r.iter_content(SPOOL_CHUNK))
+
+def _fetch_gtfs_zip(mode: str, agency_id: str, session=None) -> Path:
+    url = f"{GTFS_BASE_URL}/{mode}/{agency_id}"
+    headers = {"Authorization": f"apikey {_tfnsw_api_key()}"}
+    return _download_zip(url, headers=headers, session=session)
+
+def _local_gtfs_zip(source_dir, agency_id: str) -> Path:
+    path = Path(source_dir) / f"{agency_id}.zip"
+    if not path.is_file():
+        raise FileNotFoundError(f"no local feed {path}")
+    return path
+
+SYNTHETIC_MAX_SCALE = float(os.getenv("SYNTHETIC_MAX_SCALE", "1"))  # over HTTP; the CLI goes up to 100
+
+def _synthetic_scale(raw) -> float:
+    """Check a synthetic import requested over HTTP: off unless ALLOW_SYNTHETIC_IMPORT, scale capped."""
+    if not current_app.config["ALLOW_SYNTHETIC_IMPORT"]:
+        raise PermissionError("synthetic imports are disabled (set ALLOW_SYNTHETIC_IMPORT=1)")
+    scale = float(raw)
+    if not 0 < scale <= SYNTHETIC_MAX_SCALE:
+        raise ValueError(f"synthetic scale must be in (0, {SYNTHETIC_MAX_SCALE:g}]")
+    return scale
+
+def _synthetic_gtfs_zip(agency_id: str, scale: float, seed: int = 0) -> Path:
+    """Generate a deterministic synthetic feed (see gtfs_synth.py) into the spool dir."""
+    import gtfs_synth
+    if not 0 < scale <= 100:
+        raise ValueError("synthetic scale must be in (0, 100]")
+    f, path = _spool_file(".zip")
+    try:
+        with f:
+            gtfs_synth.write_feed(f, scale=scale, seed=gtfs_synth.agency_seed(seed, agency_id))
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
+
+def _resolve_local_path(raw: str) -> Path:
+    """Resolve a client-supplied feed path; it must stay inside GTFS_LOCAL_DIR."""
+    root = GTFS_LOCAL_DIR.resolve()
+    path = (root / raw).resolve()
+    if root != path and root not in path.parents:
+        raise PermissionError("path must be inside GTFS_LOCAL_DIR")
+    if not path.is_file():
+        raise FileNotFoundError(f"no such feed: {raw}")
+    return path
+
+def _check_feed_url(url: str) -> Optional[str]:
+    """Vet a client-supplied feed url before it is fetched; returns the address to fetch it from.
+
+    Hosts in GTFS_URL_ALLOWLIST pass as given (None: fetch by name); any other host must resolve to
+    public addresses only, so `?url=` cannot reach loopback, private, link-local or reserved ranges
+    (cloud metadata, the database, internal services). Callers fetch it from the returned address
+    (see _pin_url), so a DNS server cannot answer the fetch's own lookup with a private address,
+    and without following redirects.
+    """
+    import ipaddress, socket
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        raise ValueError("url must be http(s)")
+    host = parts.hostname.lower()
+    if host in GTFS_URL_ALLOWLIST:
+        return None
+    try:
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as e:
+        raise FileNotFoundError(f"cannot resolve {host}: {e}")
+    for *_, sockaddr in infos:
+        ip = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        ip = getattr(ip, "ipv4_mapped", None) or ip
+        if not ip.is_global or ip.is_multicast or ip.is_reserved:
+            raise PermissionError(f"url host {host} resolves to a non-public address")
+    return infos[0][4][0]
+
+def _pin_url(url: str, address: str) -> tuple:
+    """(`url` with its host replaced by `address`, the Host header that names the original host)."""
+    from urllib.parse import urlsplit, urlunsplit
+    parts = urlsplit(url)
+    userinfo, _, host = parts.netloc.rpartition("@")
+    netloc = f"[{address}]" if ":" in address else address
+    if parts.port is not None:
+        netloc += f":{parts.port}"
+    return urlunsplit(parts._replace(netloc=f"{userinfo}@{netloc}" if userinfo else netloc)), host
+
+def _pinned_session(url: str):
+    """requests Session for a url rewritten by _pin_url: TLS still sends and verifies the url's host name."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib.parse import urlsplit
+    hostname = urlsplit(url).hostname
+
+    class PinnedAdapter(HTTPAdapter):
+        def build_connection_pool_key_attributes(self, request, verify, cert=None):
+            host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+            pool_kwargs.update(server_hostname=hostname, assert_hostname=hostname)
+            return host_params, pool_kwargs
+
+    session = requests.Session()
+    session.mount("https://", PinnedAdapter())
+    return session
+
+def _zip_size(source) -> int:
+    return len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source)
+
+class _MappedFile(io.RawIOBase):
+    """Seekable read-only file over an mmap (mmap itself is not seekable() before Python 3.13)."""
+    def __init__(self, mm):
+        self._mm = mm
+    def readable(self):
+        return True
+    def seekable(self):
+        return True
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._mm.seek(offset, whence)
+        return self._mm.tell()
+    def tell(self):
+        return self._mm.tell()
+    def readinto(self, b):
+        data = self._mm.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+@contextmanager
+def _open_zip(source):
+    """Open a GTFS archive from bytes or a file path; files are memory-mapped, not read into memory."""
+    if isinstance(source, (bytes, bytearray)):
+        with zipfile.ZipFile(io.BytesIO(source)) as z:
+            yield z
+        return
+    with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            zipfile.ZipFile(_MappedFile(mm)) as z:
+        yield z
+
+def _agency_row(db, agency_key: str) -> Agency:
+    """The agency's row, created (uncommitted) on its first import."""
+    mode, agency_id = agency_key.split(":", 1)
+    rec = db.query(Agency).filter(Agency.mode == mode, Agency.agency_id == agency_id).first()
+    if rec is None:
+        rec = Agency(mode=mode, agency_id=agency_id)
+        db.add(rec)
+        db.flush()
+    return rec
+
+def _clear_agency_data(db, agency_pk: int) -> int:
+    """Delete the agency's GTFS rows (uncommitted); returns how many rows went."""
+    trips = db.query(Trip.id).filter(Trip.agency_pk == agency_pk)
+    n = db.query(StopTime).filter(StopTime.trip_pk.in_(trips.scalar_subquery())).delete(synchronize_session=False)
+    return n + sum(db.query(model).filter(model.agency_pk == agency_pk).delete(synchronize_session=False)
+                   for model in GTFS_DATA_MODELS if model is not StopTime)
+
+def _shard_build_pragmas(dbapi_conn, record):
+    # a shard under construction is a private file that is deleted if the import fails
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=OFF")
+    cur.execute("PRAGMA synchronous=OFF")
+    cur.close()
+
+class _ShardBuild:
+    """A new shard file for one agency, built beside the live one: finish() renames it into place
+    (readers switch to it on their next query), abort() deletes it and leaves the old one serving."""
+
+    def __init__(self, agency_key: str):
+        self.path = _shard_path(agency_key)
+        self.tmp = shard_dir / f".{self.path.stem}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.tmp.unlink(missing_ok=True)   # left by a crashed import
+        self.engine = create_engine(f"sqlite:///{self.tmp}", future=True)
+        event.listen(self.engine, "connect", _shard_build_pragmas)
+        Base.metadata.create_all(self.engine, tables=[m.__table__ for m in GTFS_DATA_MODELS])
+        self.db = Session(bind=self.engine)
+
+    def finish(self):
+        self.db.commit()
+        self.db.close()
+        self.engine.dispose()
+        with open(self.tmp, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self.db.close()
+        self.engine.dispose()
+        self.tmp.unlink(missing_ok=True)
+
+def _drop_agency_data(db, agency_key: str) -> int:
+    """Remove an agency's GTFS data (its shard file, or its rows); the agency row and its import
+    history stay. Returns the rows deleted (0 for a shard)."""
+    if shard_dir is not None:
+        _shard_path(agency_key).unlink(missing_ok=True)
+        _bump_import_version(agency_key)
+        return 0
+    pk = _agency_pks(db, [agency_key]).get(agency_key)
+    n = 0 if pk is None else _clear_agency_data(db, pk)
+    db.commit()
+    _bump_import_version(agency_key)
+    return n
+
+# GTFS member -> (model, [(column, csv field, converter)])
+def _int0(v):
+    return int(v or 0)
+
+def _float0(v):
+    return float(v or 0.0)
+
+def _text(v):
+    return v
+
+def _gtfs_secs(v):
+    """'HH:MM:SS' (hours may exceed 24) -> seconds after midnight; blank or malformed -> None.
+
+    A malformed time is treated like a blank one (a stop without a scheduled time), so one bad
+    row does not fail the import.
+    """
+    try:
+        h, m, sec = v.split(':')
+        return int(h) * 3600 + int(m) * 60 + int(sec)
+    except (AttributeError, ValueError):
+        return None
+
+GTFS_TABLES = {
+    'routes.txt': (Route, [('route_id', 'route_id', _text), ('route_short_name', 'route_short_name', _text),
+                           ('route_long_name', 'route_long_name', _text), ('route_type', 'route_type', _int0)]),
+    'stops.txt': (Stop, [('stop_id', 'stop_id', _text), ('stop_name', 'stop_name', _text),
+                         ('stop_lat', 'stop_lat', _float0), ('stop_lon', 'stop_lon', _float0)]),
+    'trips.txt': (Trip, [('trip_id', 'trip_id', _text), ('route_id', 'route_id', _text),
+                         ('service_id', 'service_id', _text), ('trip_headsign', 'trip_headsign', _text),
+                         ('direction_id', 'direction_id', _int0)]),
+    'stop_times.txt': (StopTime, [('trip_pk', 'trip_id', _text), ('stop_pk', 'stop_id', _text),
+                                  ('stop_sequence', 'stop_sequence', _int0),
+                                  ('arrival_secs', 'arrival_time', _gtfs_secs),
+                                  ('departure_secs', 'departure_time', _gtfs_secs)]),
+}
+# Surrogate keys filled in by the writer: member -> {column: (id space, string id column)}.
+# stop_times' trip_pk/stop_pk arrive from the parser as the string ids and are replaced.
+GTFS_ENCODED = {
+    'stops.txt': {'id': ('stops', 'stop_id')},
+    'trips.txt': {'id': ('trips', 'trip_id')},
+    'stop_times.txt': {'trip_pk': ('trips', 'trip_pk'), 'stop_pk': ('stops', 'stop_pk')},
+}
+
+class _Interner:
+    """Dictionary-encode string ids to integer surrogate keys, numbering from `next_pk`.
+
+    One per id space and import; stop_times may be written before the trips/stops they refer
+    to, so whichever batch sees an id first allocates its key.
+    """
+
+    def __init__(self, next_pk: int):
+        self.pks = {}
+        self.next_pk = next_pk
+
+    def encode(self, ids) -> list:
+        pks = self.pks
+        out = []
+        for v in ids:
+            pk = pks.get(v)
+            if pk is None:
+                pk = pks[v] = self.next_pk
+                self.next_pk += 1
+            out.append(pk)
+        return out
+
+def _gtfs_time(secs):
+    """Seconds after midnight -> 'HH:MM:SS' (hours may exceed 24); None stays None."""
+    if secs is None:
+        return None
+    return f"{secs // 3600:02d}:{secs // 60 % 60:02d}:{secs % 60:02d}"
+# Members split into byte ranges and parsed in parallel. Only members without free-text
+# fields qualify: a quoted field with an embedded newline would straddle a chunk boundary.
+GTFS_CHUNKED = {'stop_times.txt'}
+PARSE_CHUNK_BYTES = int(os.getenv("GTFS_PARSE_CHUNK_MB", "8")) * 1024 * 1024
+PARSE_WORKERS = int(os.getenv("GTFS_PARSE_WORKERS", str(os.cpu_count() or 1)))
+
+def _find_member(z, target_basename: str):
+    # handle zips that have a folder prefix like 'google_transit/routes.txt'
+    tl = target_basename.lower()
+    for n in z.namelist():
+        if n.lower().endswith('/' + tl) or n.lower() == tl:
+            return n
+    return None
+
+def _columnar(member: str, header, lines) -> dict:
+    """Parse CSV `lines` of `member` into a typed columnar batch {column: [values]}."""
+    _, spec = GTFS_TABLES[member]
+    pos = {name.strip(): i for i, name in enumerate(header)}
+    cols = {col: [] for col, _, _ in spec}
+    getters = [(cols[col].append, pos.get(field), conv) for col, field, conv in spec]
+    for rec in csv.reader(lines):
+        if not rec:
+            continue
+        n = len(rec)
+        for append, i, conv in getters:
+            append(conv(rec[i] if i is not None and i < n else None))
+    return cols
+
+def _parse_member(source, member: str):
+    """Worker task: parse a whole (small) member. Returns (member, batch, rows, seconds, peak RSS MB)."""
+    t0 = time.perf_counter()
+    with _open_zip(source) as z:
+        path = _find_member(z, member)
+        if not path:
+            return member, None, 0, 0.0, _rss_mb()
+        with z.open(path) as f:
+            lines = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+            header = next(csv.reader([lines.readline()]), [])
+            batch = _columnar(member, header, lines)
+    rows = len(next(iter(batch.values())))
+    return member, batch, rows, time.perf_counter() - t0, _rss_mb()
+
+def _parse_range(path, start: int, end: int, member: str, header):
+    """Worker task: parse bytes [start, end) of an extracted member; the range is line-aligned."""
+    t0 = time.perf_counter()
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    batch = _columnar(member, header, text.splitlines())
+    rows = len(next(iter(batch.values())))
+    return member, batch, rows, time.perf_counter() - t0, _rss_mb()
+
+def _extract_member(z, path: str) -> Path:
+    out, tmp = _spool_file(".csv")
+    with out, z.open(path) as src:
+        for chunk in _stream_chunks(src):
+            out.write(chunk)
+    return tmp
+
+def _line_ranges(path, chunk_bytes: int):
+    """Read the header and split the rest of the file into [start, end) ranges ending on a newline."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = next(csv.reader([f.readline().decode('utf-8-sig')]), [])
+        ranges, start = [], f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()  # advance to the end of the current line
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+def _parse_tasks(z, source, extracted: list):
+    """Yield (fn, args) parse tasks for every stored member of the open archive `z`."""
+    for member in GTFS_TABLES:
+        path = _find_member(z, member)
+        if not path:
+            continue
+        if member in GTFS_CHUNKED and z.getinfo(path).file_size > PARSE_CHUNK_BYTES:
+            tmp = _extract_member(z, path)
+            extracted.append(tmp)
+            header, ranges = _line_ranges(tmp, PARSE_CHUNK_BYTES)
+            for start, end in ranges:
+                yield _parse_range, (str(tmp), start, end, member, header)
+        else:
+            yield _parse_member, (source, member)
+
+_parse_pool_instance = None
+
+def _parse_pool():
+    """Shared parser process pool (None when GTFS_PARSE_WORKERS <= 1: parse inline)."""
+    global _parse_pool_instance
+    if PARSE_WORKERS <= 1:
+        return None
+    if _parse_pool_instance is None:
+        _parse_pool_instance = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    return _parse_pool_instance
+
+def _write_batch(db, agency_pk: int, member: str, batch: dict, interners: dict):
+    model, _ = GTFS_TABLES[member]
+    for col, (space, src) in GTFS_ENCODED.get(member, {}).items():
+        batch[col] = interners[space].encode(batch[src])
+    if 'agency_pk' in model.__table__.c:
+        batch['agency_pk'] = [agency_pk] * len(next(iter(batch.values())))
+    names = list(batch)
+    rows = list(zip(*batch.values()))
+    # a feed repeating a stop/trip id or (trip, stop_sequence) keeps the first row, as lookups did
+    stmt = insert(model.__table__).prefix_with("OR IGNORE", dialect="sqlite")
+    for i in range(0, len(rows), WRITE_BATCH):
+        db.execute(stmt, [dict(zip(names, r)) for r in rows[i:i + WRITE_BATCH]])
+
+class _RouteStats:
+    """Per-route summaries and reverse indexes of one import: gtfs_route_stats, the route patterns
+    and the stop -> routes / trip -> pattern tables.
+
+    add() keeps the columns they need from each written trips/stop_times batch (integer keys and
+    times as NumPy arrays, about 11 MB for a scale-1 feed); tables() then computes everything in
+    vectorized passes with pandas, so neither the import nor a request re-reads stop_times.
+    """
+    def __init__(self):
+        self.trips = []
+        self.stop_times = []
+        self.stops = []
+        self.frames = None   # (trips, stop_times in trip order) once tables() has run
+
+    def add(self, member: str, batch: dict):
+        if member == 'stops.txt':
+            self.stops.append({k: batch[k] for k in ('id', 'stop_id', 'stop_name', 'stop_lat', 'stop_lon')})
+        elif member == 'trips.txt':
+            self.trips.append({k: batch[k] for k in ('id', 'route_id', 'direction_id', 'service_id')})
+        elif member == 'stop_times.txt':
+            import numpy as np
+            self.stop_times.append({
+                "trip_pk": np.asarray(batch['trip_pk'], dtype=np.int64),
+                "stop_pk": np.asarray(batch['stop_pk'], dtype=np.int64),
+                "seq": np.asarray(batch['stop_sequence'], dtype=np.int64),
+                # None (a missing time) becomes NaN; pandas skips it in min/max/median
+                "departure": np.array(batch['departure_secs'], dtype=float),
+                "arrival": np.array(batch['arrival_secs'], dtype=float),
+            })
+
+    def tables(self, agency_pk: int):
+        """Yield (model, rows) for every table built here."""
+        if not self.trips:
+            return
+        import pandas as pd
+        # a repeated trip id or (trip, stop_sequence) keeps its first row, as the inserts did
+        trips = pd.concat([pd.DataFrame(b) for b in self.trips], ignore_index=True).drop_duplicates("id")
+        trips["direction_id"] = trips["direction_id"].fillna(0).astype(int)
+        if self.stop_times:
+            st = pd.concat([pd.DataFrame(b) for b in self.stop_times], ignore_index=True)
+        else:
+            st = pd.DataFrame({"trip_pk": [], "stop_pk": [], "seq": [], "departure": [], "arrival": []},
+                              dtype="int64")
+        st = self._in_trip_order(st)
+        self.frames = (trips, st)
+        patterns, trip_patterns, pattern_stops = self._patterns(trips, st)
+        yield RouteStat, self._records(self._stats(trips, st, pattern_stops), agency_pk)
+        yield RoutePattern, self._records(patterns[["pattern_id", "route_id", "direction_id", "trip_count"]], agency_pk)
+        yield TripPattern, self._records(trip_patterns, agency_pk)
+        yield PatternStop, self._records(pattern_stops[["pattern_id", "position", "stop_pk"]], agency_pk)
+        yield StopRoute, self._records(pattern_stops[["stop_pk", "route_id"]].drop_duplicates(), agency_pk)
+
+    @staticmethod
+    def _in_trip_order(st):
+        """stop_times sorted by (trip, stop_sequence), first row of each pair kept."""
+        import numpy as np
+        trip, seq = st["trip_pk"].to_numpy(), st["seq"].to_numpy()
+        step = (trip[1:] > trip[:-1]) | ((trip[1:] == trip[:-1]) & (seq[1:] > seq[:-1]))
+        if step.all():   # feeds are usually written in this order already
+            return st
+        st = st.iloc[np.lexsort((seq, trip))]   # stable: repeats stay in file order
+        trip, seq = st["trip_pk"].to_numpy(), st["seq"].to_numpy()
+        return st[np.r_[True, (trip[1:] != trip[:-1]) | (seq[1:] != seq[:-1])]]
+
+    @staticmethod
+    def _records(table, agency_pk: int) -> list:
+        """Rows for executemany: numbers rounded to int, NaN as None."""
+        import numpy as np, pandas as pd
+        columns = {"agency_pk": [agency_pk] * len(table)}
+        for name, col in table.items():
+            if not pd.api.types.is_numeric_dtype(col):
+                columns[name] = col.tolist()
+                continue
+            values = col.to_numpy(dtype=float)
+            ints = np.rint(np.nan_to_num(values)).astype(np.int64).tolist()
+            missing = np.flatnonzero(np.isnan(values))
+            for i in missing.tolist():
+                ints[i] = None
+            columns[name] = ints
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+    @staticmethod
+    def _patterns(trips, st):
+        """(patterns, trip -> pattern rows, pattern stops with route/direction) of the trips that
+        have stop_times. Trips share a pattern when route, direction and stop sequence all match."""
+        import numpy as np, pandas as pd
+        # one key per distinct stop sequence: the bytes of the trip's stop pks, in order
+        trip, stop = st["trip_pk"].to_numpy(np.int64), st["stop_pk"].to_numpy(np.int64)
+        starts = np.flatnonzero(np.r_[True, trip[1:] != trip[:-1]]) if len(trip) else np.array([], dtype=np.int64)
+        sequences = pd.Series([a.tobytes() for a in np.split(stop, starts[1:])] if len(trip) else [],
+                              index=trip[starts], name="stops", dtype=object)
+        trips = trips.join(sequences, on="id").dropna(subset=["stops"])
+        keys = ["route_id", "direction_id", "stops"]
+        patterns = trips.groupby(keys).size().rename("trip_count").reset_index()
+        patterns = patterns.sort_values(["route_id", "direction_id", "trip_count"], ascending=[True, True, False])
+        patterns["pattern_id"] = range(1, len(patterns) + 1)
+        trip_patterns = (trips.merge(patterns[keys + ["pattern_id"]], on=keys)[["id", "pattern_id"]]
+                         .rename(columns={"id": "trip_pk"}))
+        pattern_stops = patterns[["pattern_id", "route_id", "direction_id"]].assign(
+            stop_pk=[np.frombuffer(key, dtype=np.int64) for key in patterns["stops"]])
+        pattern_stops = pattern_stops.explode("stop_pk").astype({"stop_pk": "int64"})
+        pattern_stops["position"] = pattern_stops.groupby("pattern_id").cumcount()
+        return patterns, trip_patterns, pattern_stops
+
+    @staticmethod
+    def _stats(trips, st, pattern_stops):
+        import pandas as pd
+        per_trip = st.groupby("trip_pk").agg(start=("departure", "min"), end=("arrival", "max"))
+        trips = trips.join(per_trip, on="id")
+        trips["duration"] = trips["end"] - trips["start"]
+        # headway: gaps between consecutive starts of the same route, direction and service
+        trips = trips.sort_values(["route_id", "direction_id", "service_id", "start"])
+        group = ["route_id", "direction_id", "service_id"]
+        same = (trips[group] == trips[group].shift()).all(axis=1)
+        trips["gap"] = trips["start"].diff().where(same)
+        # distinct stops served, from the patterns rather than every stop_times row
+        served = pattern_stops[["route_id", "direction_id", "stop_pk"]]
+        out = []
+        for t, stops in ((trips, served), (trips.assign(direction_id=-1), served.assign(direction_id=-1))):
+            keys = ["route_id", "direction_id"]
+            summary = t.groupby(keys).agg(trip_count=("id", "size"), first_departure_secs=("start", "min"),
+                                          last_departure_secs=("start", "max"), headway_secs=("gap", "median"),
+                                          median_trip_secs=("duration", "median"))
+            summary["stop_count"] = stops.drop_duplicates().groupby(keys).size()
+            out.append(summary)
+        table = pd.concat(out).reset_index()
+        table["stop_count"] = table["stop_count"].fillna(0)
+        return table
+
+    def timetable(self) -> Optional["_Timetable"]:
+        """The import's _Timetable, from the frames tables() already sorted."""
+        if self.frames is None:
+            return None
+        import pandas as pd
+        trips, st = self.frames
+        stops = (pd.concat([pd.DataFrame(b) for b in self.stops], ignore_index=True).drop_duplicates("id")
+                 if self.stops else None)
+        return _Timetable(trips[["id", "service_id"]], st, stops)
+
+class _Timetable:
+    """Compact in-memory timetable of one agency for reachability searches.
+
+    For each service_id, every hop between consecutive stops of a trip (a "connection") as int32
+    arrays sorted by departure: departure stop, arrival stop, departure, arrival and trip, with
+    stops and trips numbered from 0. About 20 bytes per stop_times row.
+    """
+    def __init__(self, trips, st, stops=None):
+        """`trips`: id, service_id; `st`: trip_pk, stop_pk, departure, arrival in (trip, stop_sequence)
+        order; `stops`: id, stop_id, stop_name, stop_lat, stop_lon (None: stop pks only)."""
+        import numpy as np, pandas as pd
+        trip = st["trip_pk"].to_numpy(np.int64)
+        stop = st["stop_pk"].to_numpy(np.int64)
+        dep, arr = st["departure"].to_numpy(float), st["arrival"].to_numpy(float)
+        # a stop time with one of its two times blank uses the other
+        dep, arr = np.where(np.isnan(dep), arr, dep), np.where(np.isnan(arr), dep, arr)
+
+        stop_pks = np.unique(np.concatenate([stop, stops["id"].to_numpy(np.int64) if stops is not None else []]))
+        self.stop_pks = stop_pks
+        info = (pd.DataFrame({"id": stop_pks}).merge(stops, on="id", how="left") if stops is not None
+                else pd.DataFrame({"id": stop_pks, "stop_id": None, "stop_name": None,
+                                   "stop_lat": np.nan, "stop_lon": np.nan}))
+        self.stop_ids = info["stop_id"].tolist()
+        self.stop_names = info["stop_name"].tolist()
+        self.stop_lats = info["stop_lat"].to_numpy(float)
+        self.stop_lons = info["stop_lon"].to_numpy(float)
+
+        hop = np.flatnonzero(trip[1:] == trip[:-1])   # row i -> row i + 1 of the same trip
+        c_dep, c_arr = dep[hop], arr[hop + 1]
+        keep = ~np.isnan(c_dep) & ~np.isnan(c_arr) & (c_arr >= c_dep)
+        hop, c_dep, c_arr = hop[keep], c_dep[keep], c_arr[keep]
+        trip_pks, c_trip = np.unique(trip[hop], return_inverse=True)
+        services = (trips.drop_duplicates("id").set_index("id")["service_id"]
+                    .reindex(trip_pks).fillna("").astype(str).to_numpy())
+        self.trip_count = len(trip_pks)
+        self.services = {}
+        trips_per_service = {}
+        for service in np.unique(services).tolist():
+            members = np.flatnonzero(services[c_trip] == service)
+            order = members[np.lexsort((c_arr[members], c_dep[members]))]
+            self.services[service] = tuple(a.astype(np.int32) for a in (
+                c_dep[order], c_arr[order], np.searchsorted(stop_pks, stop[hop[order]]),
+                np.searchsorted(stop_pks, stop[hop[order] + 1]), c_trip[order]))
+            trips_per_service[service] = int((services == service).sum())
+        # a typical day: the service with the most trips (WEEKDAY rather than SUN)
+        self.default_service = max(trips_per_service, key=trips_per_service.get) if trips_per_service else None
+
+    @classmethod
+    def load(cls, agency_key: str) -> "_Timetable":
+        """Build from the database: stop_times in primary-key order, read through the DBAPI cursor."""
+        db, pk = _gtfs_db(agency_key), _agency_pks_by_key[agency_key]
+        trips = _extract(db, select(Trip.id, Trip.service_id).where(Trip.agency_pk == pk), ["id", "service_id"])
+        st = _extract(db, select(StopTime.trip_pk, StopTime.stop_pk, StopTime.departure_secs, StopTime.arrival_secs)
+                      .where(StopTime.trip_pk.in_(select(Trip.id).where(Trip.agency_pk == pk)))
+                      .order_by(StopTime.trip_pk, StopTime.stop_sequence),
+                      ["trip_pk", "stop_pk", "departure", "arrival"], numeric=True)
+        stops = _extract(db, select(Stop.id, Stop.stop_id, Stop.stop_name, Stop.stop_lat, Stop.stop_lon)
+                         .where(Stop.agency_pk == pk), ["id", "stop_id", "stop_name", "stop_lat", "stop_lon"])
+        return cls(trips, st, stops)
+
+    def stop_index(self, stop_pk: int) -> Optional[int]:
+        import numpy as np
+        i = int(np.searchsorted(self.stop_pks, stop_pk))
+        return i if i < len(self.stop_pks) and self.stop_pks[i] == stop_pk else None
+
+    def profile(self, service: str, source: int, start: int, end: int) -> dict:
+        """Profile connection scan from stop index `source` over departures in [start, end].
+
+        Returns {stop: (arrivals, source_departures)}: the Pareto set of journeys to each stop,
+        where a later departure from the source and an earlier arrival are both better. Both
+        lists ascend, so the best arrival for leaving at any time t >= start is the first entry
+        whose source departure is >= t. Transfers happen at the same stop with no minimum time.
+        """
+        import numpy as np
+        deps, arrs, from_stop, to_stop, trip = self.services[service]
+        lo, hi = int(np.searchsorted(deps, start, side="left")), int(np.searchsorted(deps, end, side="right"))
+        boarded = [-1] * self.trip_count   # latest source departure that reaches each trip
+        labels = {}
+        for d, a, u, v, t in zip(deps[lo:hi].tolist(), arrs[lo:hi].tolist(), from_stop[lo:hi].tolist(),
+                                 to_stop[lo:hi].tolist(), trip[lo:hi].tolist()):
+            sd = boarded[t]
+            if u == source and d > sd:
+                sd = d
+            at = labels.get(u)
+            if at is not None:
+                i = bisect.bisect_right(at[0], d)
+                if i and at[1][i - 1] > sd:
+                    sd = at[1][i - 1]
+            if sd < 0:
+                continue
+            boarded[t] = sd
+            if v == source:
+                continue
+            at = labels.get(v)
+            if at is None:
+                labels[v] = ([a], [sd])
+                continue
+            times, sds = at
+            j = bisect.bisect_right(times, a)
+            if j and sds[j - 1] >= sd:
+                continue   # as early and leaving no earlier
+            i = bisect.bisect_left(times, a)
+            k = i
+            while k < len(sds) and sds[k] <= sd:
+                k += 1   # arriving no earlier and leaving no later: dominated by this journey
+            times[i:k] = [a]
+            sds[i:k] = [sd]
+        return labels
+
+    @staticmethod
+    def reachable(labels: dict, depart: int, budget: int) -> list:
+        """[(stop, source departure, arrival)] of the stops a profile reaches by depart + budget."""
+        out = []
+        for stop, (times, sds) in labels.items():
+            i = bisect.bisect_left(sds, depart)
+            if i < len(sds) and times[i] - depart <= budget:
+                out.append((stop, sds[i], times[i]))
+        return out
+
+def _import_gtfs(db, agency_key: str, source, pool=None, workers: int = 1,
+                 telemetry: Optional["ImportTelemetry"] = None) -> dict:
+    """Parse `source` (zip bytes or path) and replace the agency's rows in one transaction.
+
+    With shards the rows go to a new shard file that replaces the agency's old one on commit, and
+    `db` only records the agency row. Parse tasks run in `pool` (inline if None); finished batches reach this thread through a queue
+    and are written here, the only writer. At most 2 x `workers` batches are in flight at once.
+    Phases (unzip, parse:<file>, delete, insert:<table>, stats, commit, timetable) are recorded on `telemetry`.
+    Returns {"rows": {table: n}, "parse_s": worker seconds, "write_s": writer seconds, "timetable":
+    the agency's _Timetable (or None), to hand to _record_import}.
+    """
+    tel = telemetry or ImportTelemetry(agency_key)
+    counts = {str(model.__table__.name): 0 for model, _ in GTFS_TABLES.values()}   # plain str: orjson rejects subclasses
+    parse_s = write_s = 0.0
+    extracted = []
+    shard = None
+    try:
+        with tel.phase("unzip") as ph, _open_zip(source) as z:
+            sizes = {m: z.getinfo(p).file_size for m in GTFS_TABLES if (p := _find_member(z, m))}
+            tasks = list(_parse_tasks(z, source, extracted))
+            ph["bytes"] = sum(sizes.values())
+        for member, size in sizes.items():
+            tel.add(f"parse:{member}", 0.0, nbytes=size)
+        with tel.phase("delete") as ph:
+            agency_pk = _agency_row(db, agency_key).id
+            if shard_dir is None:
+                out = db
+                ph["rows"] = _clear_agency_data(db, agency_pk)
+            else:   # the old rows go with the old file when the new one replaces it
+                db.commit()   # nothing else to write there: don't hold the main database's write lock
+                shard = _ShardBuild(agency_key)
+                out = shard.db
+                ph["rows"] = 0
+        # inside the write transaction (the delete took SQLite's write lock), so no other
+        # import can allocate the same keys before we commit; a new shard starts at 1
+        interners = {"stops": _Interner((out.query(func.max(Stop.id)).scalar() or 0) + 1),
+                     "trips": _Interner((out.query(func.max(Trip.id)).scalar() or 0) + 1)}
+        stats = _RouteStats()
+        done = queue.Queue()
+        pending = iter(tasks)
+        in_flight = 0
+        limit = 2 * max(workers, 1)
+
+        def submit_next():
+            task = next(pending, None)
+            if task is None:
+                return False
+            fn, args = task
+            if pool is None:
+                fut = Future()
+                try:
+                    fut.set_result(fn(*args))
+                except Exception as e:
+                    fut.set_exception(e)
+                done.put(fut)
+            else:
+                pool.submit(fn, *args).add_done_callback(done.put)
+            return True
+
+        while in_flight < limit and submit_next():
+            in_flight += 1
+        while in_flight:
+            member, batch, rows, secs, worker_rss = done.get().result()
+            in_flight -= 1
+            if submit_next():
+                in_flight += 1
+            parse_s += secs
+            tel.add(f"parse:{member}", secs, rows=rows, peak_rss_mb=worker_rss)
+            if batch:
+                table = GTFS_TABLES[member][0].__table__.name
+                t0 = time.perf_counter()
+                _write_batch(out, agency_pk, member, batch, interners)
+                secs = time.perf_counter() - t0
+                stats.add(member, batch)
+                write_s += secs
+                counts[table] += rows
+                tel.add(f"insert:{table}", secs, rows=rows, peak_rss_mb=_rss_mb())
+        t0 = time.perf_counter()
+        with tel.phase("stats") as ph:
+            ph["rows"] = 0
+            for model, rows in stats.tables(agency_pk):
+                for i in range(0, len(rows), WRITE_BATCH):
+                    out.execute(insert(model.__table__), rows[i:i + WRITE_BATCH])
+                ph["rows"] += len(rows)
+        with tel.phase("commit"):
+            if shard is not None:
+                shard.finish()
+            db.commit()
+        write_s += time.perf_counter() - t0
+        with tel.phase("timetable") as ph:   # returned for _record_import, which knows the import's marker
+            timetable = stats.timetable()
+            ph["rows"] = sum(len(c[0]) for c in timetable.services.values()) if timetable else 0
+    except BaseException:
+        if shard is not None:
+            shard.abort()
+        db.rollback()
+        raise
+    finally:
+        for tmp in extracted:
+            tmp.unlink(missing_ok=True)
+    return {"rows": counts, "parse_s": parse_s, "write_s": write_s, "timetable": timetable}
+
+def _record_import(db, mode: str, agency_id: str, telemetry: Optional["ImportTelemetry"] = None,
+                   timetable: Optional["_Timetable"] = None):
+    """Mark an agency imported (keeping its telemetry); `timetable` from _import_gtfs is kept for reachability."""
+    rec = db.query(Agency).filter(Agency.mode==mode, Agency.agency_id==agency_id).first()
+    if not rec:
+        rec = Agency(mode=mode, agency_id=agency_id)
+        db.add(rec)
+    rec.imported_at = datetime.utcnow()
+    if telemetry is not None:
+        history = json.loads(rec.import_history or "[]")
+        rec.import_history = json.dumps([telemetry.as_dict()] + history[:IMPORT_HISTORY - 1])
+    db.commit()
+    _bump_import_version(f"{mode}:{agency_id}")
+    if timetable is not None:
+        _remember_timetable((f"{mode}:{agency_id}", rec.imported_at.isoformat()), timetable)
+
+def _parse_and_store(db, agency_key: str, source, telemetry: Optional["ImportTelemetry"] = None) -> dict:
+    """_import_gtfs with the shared parser pool; returns its result dict."""
+    return _import_gtfs(db, agency_key, source, pool=_parse_pool(), workers=PARSE_WORKERS,
+                        telemetry=telemetry)
+
+
+# -----------------------------
+# Bulk import: concurrent fetch -> process-pool parse -> single writer
+# -----------------------------
+
+def _pooled_http_session(size: int):
+    import requests, requests.adapters
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+def _bulk_import(db, agency_ids, mode: str = 'buses', source_dir=None, fetchers: int = 4, parsers: Optional[int] = None,
+                 synthetic: Optional[float] = None, seed: int = 0) -> dict:
+    """Import several agencies: feeds are fetched concurrently, each one is parsed in chunks across a
+    process pool, and rows are written through `db` (the only writer). Returns a per-agency timing report.
+
+    Feeds come from TfNSW, from `source_dir`/<agency_id>.zip, or are generated when `synthetic` (a scale) is set.
+    """
+    wall0 = time.perf_counter()
+    report = {aid: {"agency": f"{mode}:{aid}", "status": "pending"} for aid in agency_ids}
+    http = None if source_dir or synthetic else _pooled_http_session(fetchers)
+
+    def fetch(aid):
+        t0 = time.perf_counter()
+        if synthetic:
+            data = _synthetic_gtfs_zip(aid, synthetic, seed)
+        elif source_dir:
+            data = _local_gtfs_zip(source_dir, aid)
+        else:
+            data = _fetch_gtfs_zip(mode, aid, session=http)
+        return data, time.perf_counter() - t0
+
+    own_pool = parsers is not None
+    workers = parsers if own_pool else PARSE_WORKERS
+    pool = (ProcessPoolExecutor(max_workers=parsers) if parsers > 1 else None) if own_pool else _parse_pool()
+    try:
+        with ThreadPoolExecutor(max_workers=fetchers) as fetch_pool:
+            fetching = {fetch_pool.submit(fetch, aid): aid for aid in agency_ids}
+            # later downloads keep running while earlier agencies are parsed and written
+            for fut in as_completed(fetching):
+                aid = fetching[fut]
+                rep = report[aid]
+                try:
+                    data, fetch_s = fut.result()
+                except Exception as e:
+                    rep.update(status="error", error=f"fetch: {e}")
+                    continue
+                rep.update(bytes=_zip_size(data), fetch_s=round(fetch_s, 3))
+                tel = ImportTelemetry(rep["agency"], source="synthetic" if synthetic else "local" if source_dir else "tfnsw")
+                tel.add("download", fetch_s, nbytes=rep["bytes"])
+                _imports_running[rep["agency"]] = tel
+                t0 = time.perf_counter()
+                try:
+                    stats = _import_gtfs(db, rep["agency"], data, pool=pool, workers=workers, telemetry=tel)
+                    _record_import(db, mode, aid, telemetry=tel, timetable=stats["timetable"])
+                except Exception as e:
+                    db.rollback()
+                    rep.update(status="error", error=f"import: {e}")
+                    continue
+                finally:
+                    _imports_running.pop(rep["agency"], None)
+                    _discard_spooled(data)
+                rep.update(status="ok", rows=stats["rows"], parse_s=round(stats["parse_s"], 3),
+                           write_s=round(stats["write_s"], 3), import_s=round(time.perf_counter() - t0, 3))
+    finally:
+        if http is not None:
+            http.close()
+        if own_pool and pool is not None:
+            pool.shutdown()
+
+    items = [report[aid] for aid in agency_ids]
+    return {
+        "mode": mode,
+        "source": f"synthetic:{synthetic}" if synthetic else (str(source_dir) if source_dir else "tfnsw"),
+        "wall_s": round(time.perf_counter() - wall0, 3),
+        "ok": sum(1 for r in items if r["status"] == "ok"),
+        "failed": sum(1 for r in items if r["status"] != "ok"),
+        "agencies": items,
+    }
+
+
+gtfs_ns = Namespace('gtfs', description='GTFS import')
+
+from flask_restx.reqparse import RequestParser
+from werkzeug.datastructures import FileStorage
+
+routes_parser = RequestParser(bundle_errors=True)
+AGENCY_HELP = "Agency id (e.g. GSBC001), a comma-separated list of ids, or * for every imported agency."
+
+routes_parser.add_argument("agency", type=str, required=True, help=AGENCY_HELP)
+routes_parser.add_argument("q", type=str, help="Fuzzy search string.")
+routes_parser.add_argument("route_type", type=int, help="Filter by GTFS route_type (int).")
+routes_parser.add_argument("route_id", type=str, help="Exact route_id.")
+routes_parser.add_argument("stop_id", type=str, help="Only routes serving this stop_id.")
+routes_parser.add_argument("page", type=int, default=1)
+routes_parser.add_argument("page_size", type=int, default=50)
+
+stops_parser = RequestParser(bundle_errors=True)
+stops_parser.add_argument("agency", type=str, required=True, help=AGENCY_HELP)
+stops_parser.add_argument("q", type=str, help="Stop name/id contains this text.")
+stops_parser.add_argument("stop_id", type=str, help="Exact stop_id.")
+stops_parser.add_argument("trip_id", type=str, help="Only stops this trip calls at.")
+stops_parser.add_argument("route_id", type=str, help="Only stops served by this route.")
+stops_parser.add_argument("page", type=int, default=1)
+stops_parser.add_argument("page_size", type=int, default=50)
+
+trips_parser = RequestParser(bundle_errors=True)
+trips_parser.add_argument("agency", type=str, required=True, help=AGENCY_HELP)
+trips_parser.add_argument("route_id", type=str, help="Filter trips by route_id.")
+trips_parser.add_argument("trip_id", type=str, help="Exact trip_id.")
+trips_parser.add_argument("q", type=str, help="Trip id/headsign contains this text.")
+trips_parser.add_argument("direction_id", type=int, help="0 or 1")
+trips_parser.add_argument("page", type=int, default=1)
+trips_parser.add_argument("page_size", type=int, default=50)
+
+
+import_parser = RequestParser()
+import_parser.add_argument("file", type=FileStorage, location="files",
+                           help="GTFS zip upload (multipart/form-data); skips the TfNSW download.")
+import_parser.add_argument("path", type=str, location="args",
+                           help="Server-side GTFS zip, relative to GTFS_LOCAL_DIR.")
+import_parser.add_argument("synthetic", type=float, location="args",
+                           help="Generate a deterministic synthetic feed of this scale instead (see gtfs_synth.py). "
+                                "Only when ALLOW_SYNTHETIC_IMPORT is set; scale up to SYNTHETIC_MAX_SCALE.")
+import_parser.add_argument("seed", type=int, location="args", help="Seed for `synthetic` (default 0).")
+import_parser.add_argument("url", type=str, location="args", help="http(s) URL of a GTFS zip.")
+
+
+api.add_namespace(gtfs_ns, path='/gtfs')
+
+# -----------------------------
+# Query helpers (Set 3/4)
+# -----------------------------
+
+def _requested_agencies(args):
+    """Parse `agency` (one id, a comma-separated/repeated list, or `*`) without touching the database.
+
+    Returns ('*', None), (list of agency keys, None) or (None, (status, body)).
+    """
+    names = [a.strip() for v in args.getlist('agency') for a in v.split(',') if a.strip()]
+    if not names:
+        return None, (400, {"error": "query parameter 'agency' is required"})
+    if '*' in names:
+        return '*', None
+    unknown = [a for a in names if a not in GTFS_VALID.get('buses', [])]
+    if unknown:
+        return None, (404, {"error": "Unknown agency" if len(names) == 1 else f"Unknown agency: {', '.join(unknown)}"})
+    return [f"buses:{a}" for a in dict.fromkeys(names)], None
+
+def _agency_keys_from_query(optional: bool = False):
+    """Resolve `agency` to imported agency keys. Returns (keys, None) or (None, (status, body)).
+
+    With `optional`, a missing `agency` means every imported agency.
+    """
+    if optional and not request.args.get('agency'):
+        keys, err = '*', None
+    else:
+        keys, err = _requested_agencies(request.args)
+    if err:
+        return None, err
+    if keys == '*':
+        keys = _imported_agency_keys()
+        if not keys:
+            return None, (404, {"error": "No agency imported"})
+        return keys, None
+    missing = _missing_imports(keys)
+    if missing:
+        return None, (404, {"error": "Agency not imported" if len(keys) == 1 else f"Agency not imported: {', '.join(missing)}"})
+    return keys, None
+
+
+def _ensure_imported(agency_key: str):
+    # consider imported if there is at least one route (or a shard file) for this agency
+    with span("imported"):
+        pk = _agency_pks(g.db, [agency_key]).get(agency_key)
+        if pk is None or shard_dir is not None:
+            return pk is not None and _shard_engine(agency_key) is not None
+        return g.db.query(Route.id).filter(Route.agency_pk == pk).first() is not None
+
+
+def _imported_agency_keys():
+    if shard_dir is not None:
+        keys = _shard_keys()
+        return sorted(_agency_pks(g.db, keys)) if keys else []
+    pks = [pk for (pk,) in g.db.query(Route.agency_pk).distinct()]
+    if any(pk not in _agency_keys_by_pk for pk in pks):
+        _cache_agencies(g.db.query(Agency.id, Agency.mode, Agency.agency_id).all())
+    return sorted(_agency_keys_by_pk[pk] for pk in pks)
+
+
+def _missing_imports(agency_keys):
+    """Return the keys in `agency_keys` that have no imported data (one query for all of them)."""
+    if len(agency_keys) == 1 or shard_dir is not None:
+        return [k for k in agency_keys if not _ensure_imported(k)]
+    with span("imported"):
+        pks = _agency_pks(g.db, agency_keys)
+        present = {pk for (pk,) in g.db.query(Route.agency_pk).filter(Route.agency_pk.in_(pks.values())).distinct()}
+    return [k for k in agency_keys if pks.get(k) not in present]
+
+
+# Public fields of each list item -> column. The list endpoints select exactly these columns as
+# tuples; the batch lookups build the same dicts from ORM rows. "agency" is selected as the
+# agency pk and rendered as its key.
+ROUTE_COLUMNS = {"agency": Route.agency_pk, "route_id": Route.route_id, "route_short_name": Route.route_short_name,
+                 "route_long_name": Route.route_long_name, "route_type": Route.route_type}
+STOP_COLUMNS = {"agency": Stop.agency_pk, "stop_id": Stop.stop_id, "stop_name": Stop.stop_name,
+                "stop_lat": Stop.stop_lat, "stop_lon": Stop.stop_lon}
+TRIP_COLUMNS = {"agency": Trip.agency_pk, "trip_id": Trip.trip_id, "route_id": Trip.route_id,
+                "service_id": Trip.service_id, "trip_headsign": Trip.trip_headsign, "direction_id": Trip.direction_id}
+
+def _public(columns, obj):
+    item = {name: getattr(obj, col.key) for name, col in columns.items()}
+    item["agency"] = _agency_keys_by_pk[item["agency"]]
+    return item
+
+def _route_public(r):
+    return _public(ROUTE_COLUMNS, r)
+
+def _stop_public(s):
+    return _public(STOP_COLUMNS, s)
+
+def _trip_public(t):
+    return _public(TRIP_COLUMNS, t)
+
+ROUTE_STAT_COLUMNS = (RouteStat.route_id, RouteStat.direction_id, RouteStat.trip_count, RouteStat.stop_count,
+                      RouteStat.first_departure_secs, RouteStat.last_departure_secs, RouteStat.headway_secs,
+                      RouteStat.median_trip_secs)
+
+def _route_summary(r) -> dict:
+    """A gtfs_route_stats row (ROUTE_STAT_COLUMNS) as the public summary."""
+    mins = lambda secs: None if secs is None else round(secs / 60, 1)
+    return {"trip_count": r.trip_count, "stop_count": r.stop_count,
+            "first_departure": _gtfs_time(r.first_departure_secs), "last_departure": _gtfs_time(r.last_departure_secs),
+            "headway_mins": mins(r.headway_secs), "median_trip_mins": mins(r.median_trip_secs)}
+
+def _route_summaries_stmt(agency_pk: int, route_ids):
+    """Whole-route summaries of some routes: primary-key lookups, no aggregation."""
+    return select(*ROUTE_STAT_COLUMNS).where(RouteStat.agency_pk == agency_pk, RouteStat.direction_id == -1,
+                                             RouteStat.route_id.in_(route_ids))
+
+def _items_by_agency(items) -> dict:
+    groups = {}
+    for it in items:
+        groups.setdefault(it["agency"], []).append(it)
+    return groups
+
+def _fill_route_summaries(items, rows):
+    by_route = {r.route_id: _route_summary(r) for r in rows}
+    for it in items:
+        it["summary"] = by_route.get(it["route_id"])
+
+def _lookup_item(name: str, public_id: str):
+    """Find one route/stop/trip by its public id in the `agency` query (default: every imported
+    agency). Returns ((agency_key, db, row), None) or (None, (status, body)); row starts with the
+    surrogate key, then the public columns."""
+    model, _, id_column, columns, _ = GTFS_LISTS[name]
+    agency_keys, err = _agency_keys_from_query(optional=True)
+    if err:
+        return None, err
+    found = []
+    for agency_key in agency_keys:
+        db = _gtfs_db(agency_key)
+        row = (db.query(model.id, *columns.values())
+               .filter(model.agency_pk == _agency_pks_by_key[agency_key], id_column == public_id).first())
+        if row is not None:
+            found.append((agency_key, db, row))
+    if not found:
+        return None, (404, {"error": f"{name[:-1].capitalize()} not found"})
+    if len(found) > 1:
+        agencies = ", ".join(key for key, _, _ in found)
+        return None, (409, {"error": f"{id_column.key} {public_id!r} exists in several agencies ({agencies}); "
+                                     "pass agency"})
+    return found[0], None
+
+def _item_public(name: str, agency_key: str, row) -> dict:
+    return dict(zip(GTFS_LISTS[name][3], row[1:]), agency=agency_key)
+
+def _pattern_stop_ids(db, agency_pk: int, pattern_ids) -> dict:
+    """{pattern_id: [stop_id, ...] in order} from gtfs_pattern_stops (primary-key ranges)."""
+    out = {pid: [] for pid in pattern_ids}
+    rows = db.execute(select(PatternStop.pattern_id, Stop.stop_id)
+                      .join(Stop, Stop.id == PatternStop.stop_pk)
+                      .where(PatternStop.agency_pk == agency_pk, PatternStop.pattern_id.in_(pattern_ids))
+                      .order_by(PatternStop.pattern_id, PatternStop.position))
+    for pattern_id, stop_id in rows:
+        out[pattern_id].append(stop_id)
+    return out
+
+def _json_dumps(body) -> bytes:
+    return orjson.dumps(body) if orjson else json.dumps(body, separators=(",", ":")).encode()
+
+def _json_response(body, status: int = 200):
+    """Encode `body` directly, skipping flask-restx marshalling (the caller has already shaped it)."""
+    with span("encode"):
+        data = _json_dumps(body)
+    return current_app.response_class(data, status=status, mimetype="application/json")
+
+
+def _pagination(args):
+    try:
+        page = int(args.get('page', 1))
+        page_size = int(args.get('page_size', 50))
+    except ValueError:
+        return 1, 50
+    page = max(page, 1)
+    page_size = max(1, min(page_size, 200))
+    return page, page_size
+
+def _get_pagination():
+    return _pagination(request.args)
+
+# Query-string filters for the list endpoints, shared with the async handlers in asgi.py.
+# Each takes the query args and the requested agencies' pks and returns (list of WHERE clauses,
+# None) or (None, (status, body)). Relational filters read the reverse indexes built at import
+# (gtfs_stop_routes, gtfs_trip_patterns, gtfs_pattern_stops), never gtfs_stop_times.
+
+def _arg(args, name: str) -> str:
+    return (args.get(name) or '').strip()
+
+def _in_pairs(model, id_column, pairs, agency_pks) -> list:
+    """Clauses keeping the rows whose (agency_pk, public id) is in `pairs`, a SELECT of both.
+
+    Matching the public id walks the (agency_pk, id) index for just those ids; matching surrogate
+    pks instead makes SQLite scan every row of the agency (it prefers the agency_pk range). With
+    several agencies the same id may exist in two, so the exact pair is checked as well.
+    """
+    clauses = [id_column.in_(pairs.with_only_columns(pairs.selected_columns[1]))]
+    if len(agency_pks) > 1:
+        clauses.append(tuple_(model.agency_pk, id_column).in_(pairs))
+    return clauses
+
+def _route_filters(args, agency_pks):
+    clauses = []
+    qstr = _arg(args, 'q')
+    if qstr:
+        ilike = f"%{qstr}%"
+        clauses.append(or_(Route.route_id.ilike(ilike), Route.route_short_name.ilike(ilike), Route.route_long_name.ilike(ilike)))
+    rtype = args.get('route_type')
+    if rtype is not None and rtype != '':
+        try:
+            clauses.append(Route.route_type == int(rtype))
+        except ValueError:
+            return None, (400, {"error": "route_type must be int"})
+    if _arg(args, 'route_id'):
+        clauses.append(Route.route_id == _arg(args, 'route_id'))
+    if _arg(args, 'stop_id'):
+        stops = select(Stop.id).where(Stop.agency_pk.in_(agency_pks), Stop.stop_id == _arg(args, 'stop_id'))
+        pairs = select(StopRoute.agency_pk, StopRoute.route_id).where(StopRoute.stop_pk.in_(stops))
+        clauses += _in_pairs(Route, Route.route_id, pairs, agency_pks)
+    return clauses, None
+
+def _stop_filters(args, agency_pks):
+    clauses = []
+    qstr = _arg(args, 'q')
+    if qstr:
+        ilike = f"%{qstr}%"
+        clauses.append(or_(Stop.stop_id.ilike(ilike), Stop.stop_name.ilike(ilike)))
+    if _arg(args, 'stop_id'):
+        clauses.append(Stop.stop_id == _arg(args, 'stop_id'))
+    served = aliased(Stop)
+    if _arg(args, 'trip_id'):
+        trip = aliased(Trip)
+        pairs = (select(served.agency_pk, served.stop_id)
+                 .join(PatternStop, PatternStop.stop_pk == served.id)
+                 .join(TripPattern, (TripPattern.agency_pk == PatternStop.agency_pk)
+                       & (TripPattern.pattern_id == PatternStop.pattern_id))
+                 .join(trip, trip.id == TripPattern.trip_pk)
+                 .where(trip.agency_pk.in_(agency_pks), trip.trip_id == _arg(args, 'trip_id')))
+        clauses += _in_pairs(Stop, Stop.stop_id, pairs, agency_pks)
+    if _arg(args, 'route_id'):
+        pairs = (select(served.agency_pk, served.stop_id).join(StopRoute, StopRoute.stop_pk == served.id)
+                 .where(StopRoute.agency_pk.in_(agency_pks), StopRoute.route_id == _arg(args, 'route_id')))
+        clauses += _in_pairs(Stop, Stop.stop_id, pairs, agency_pks)
+    return clauses, None
+
+def _trip_filters(args, agency_pks):
+    clauses = []
+    route_id = _arg(args, 'route_id')
+    if route_id:
+        clauses.append(Trip.route_id == route_id)
+    if _arg(args, 'trip_id'):
+        clauses.append(Trip.trip_id == _arg(args, 'trip_id'))
+    qstr = _arg(args, 'q')
+    if qstr:
+        ilike = f"%{qstr}%"
+        clauses.append(or_(Trip.trip_id.ilike(ilike), Trip.trip_headsign.ilike(ilike)))
+    direction = args.get('direction_id')
+    if direction is not None and direction != '':
+        try:
+            clauses.append(Trip.direction_id == int(direction))
+        except ValueError:
+            return None, (400, {"error": "direction_id must be int"})
+    return clauses, None
+
+# name -> (model, filters, public id column (the sort key), columns, documented response model)
+GTFS_LISTS = {
+    "routes": (Route, _route_filters, Route.route_id, ROUTE_COLUMNS, routes_response),
+    "stops": (Stop, _stop_filters, Stop.stop_id, STOP_COLUMNS, stops_response),
+    "trips": (Trip, _trip_filters, Trip.trip_id, TRIP_COLUMNS, trips_response),
+}
+
+def _list_gtfs(name: str):
+    """Shared body of the /gtfs/routes|stops|trips handlers: count and page with one global
+    order across agencies.
+
+    Selects only the public columns as tuples and encodes the page with _json_response. With
+    FAST_JSON off it loads ORM rows and marshals them through the documented model instead
+    (the old path; bench.py --json compares the two).
+    """
+    model, filters, id_column, columns, response_model = GTFS_LISTS[name]
+    agency_keys, err = _agency_keys_from_query()
+    if err:
+        code, body = err
+        return body, code
+    clauses, err = filters(request.args, [_agency_pks_by_key[k] for k in agency_keys])
+    if err:
+        code, body = err
+        return body, code
+    fast = current_app.config["FAST_JSON"]
+    page, page_size = _get_pagination()
+    key = _cache_key(f"gtfs:{name}", agency_keys, _request_parts("agency")) if fast else None
+    data = _cache_get("gtfs", key)
+    if data is not None:
+        return current_app.response_class(data, mimetype="application/json")
+    entities = tuple(columns.values()) if fast else (model,)
+    if shard_dir is not None and len(agency_keys) > 1:
+        with span("shards"):
+            total, rows = _page_shards(agency_keys, entities, clauses, id_column, (page-1)*page_size, page_size)
+    else:
+        if shard_dir is None:
+            q = g.db.query(*entities).filter(model.agency_pk.in_(_agency_pks(g.db, agency_keys).values()), *clauses)
+        else:   # one shard: no agency predicate, only that agency's rows and indexes
+            q = _gtfs_db(agency_keys[0]).query(*entities).filter(*clauses)
+        with span("count"):
+            total = q.count()
+        with span("page"):
+            rows = (q.order_by(id_column, *_agency_order(model, agency_keys))
+                    .offset((page-1)*page_size).limit(page_size).all())
+    body = {"agency": ",".join(agency_keys), "total": total, "page": page, "page_size": page_size}
+    if fast:
+        names = tuple(columns)
+        keys = _agency_keys_by_pk
+        body["items"] = [dict(zip(names, r), agency=keys[r.agency_pk]) for r in rows]
+    else:
+        body["items"] = [_public(columns, r) for r in rows]
+    if name == "routes":
+        with span("summaries"):
+            for agency_key, items in _items_by_agency(body["items"]).items():
+                stmt = _route_summaries_stmt(_agency_pks_by_key[agency_key], [it["route_id"] for it in items])
+                _fill_route_summaries(items, _gtfs_db(agency_key).execute(stmt).all())
+    if not fast:
+        with span("marshal"):
+            return marshal(body, response_model)
+    resp = _json_response(body)
+    _cache_set("gtfs", key, resp.get_data())
+    return resp
+
+def _page_shards(agency_keys, entities, clauses, id_column, offset: int, limit: int):
+    """(total, rows) of one page across agency shards, in the same order as the single-table query.
+
+    Each shard counts its matches and returns its first offset+limit rows by id (in parallel);
+    heapq.merge interleaves them by id, ties going to the agency key that sorts first.
+    """
+    def first_rows(db):
+        q = db.query(*entities).filter(*clauses)
+        return q.count(), q.order_by(id_column).limit(offset + limit).all()
+
+    def order(row):
+        value = getattr(row, id_column.key)
+        return value is not None, value   # SQLite sorts NULL first
+    results = _fan_out(first_rows, sorted(agency_keys))
+    merged = heapq.merge(*(rows for _, rows in results), key=order)
+    return sum(n for n, _ in results), list(itertools.islice(merged, offset, offset + limit))
+
+def _import_target_error(mode: str, agency_id: str):
+    """Validate an import target; (status, body) if it is not allowed, else None."""
+    err = _read_only_error()
+    if err:
+        return err
+    # Set 2: only buses with GSBC* or SBSC*
+    if mode != 'buses' or not (agency_id.startswith('GSBC') or agency_id.startswith('SBSC')):
+        return 400, {"error": "Only Sydney Metro bus agencies (GSBC*/SBSC*) are allowed"}
+    if agency_id not in GTFS_VALID.get('buses', []):
+        return 404, {"error": "Unknown agency"}
+    return None
+
+SOURCE_ERRORS = (ValueError, PermissionError, FileNotFoundError, zipfile.BadZipFile)
+
+def _source_error(e: Exception):
+    """Map an exception from fetching/spooling an import source to (status, body)."""
+    if isinstance(e, FeedTooLarge):
+        return 413, {"error": str(e)}
+    if isinstance(e, zipfile.BadZipFile):
+        return 400, {"error": f"invalid GTFS zip: {e}"}
+    if isinstance(e, PermissionError):
+        return 403, {"error": str(e)}
+    if isinstance(e, FileNotFoundError):
+        return 404, {"error": str(e)}
+    return 400, {"error": str(e)}
+
+def _request_gtfs_source(mode: str, agency_id: str):
+    """Return (zip path, source kind) for an import request; the path is spooled or local.
+
+    Order of precedence: raw zip body, multipart `file`, `path`, `synthetic`, `url`, then the TfNSW feed.
+    """
+    if request.mimetype in ("application/zip", "application/octet-stream"):
+        return _spool_zip(_stream_chunks(request.stream)), "upload"
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("file")
+        if upload is None:
+            raise ValueError("multipart upload needs a 'file' field")
+        return _spool_zip(_stream_chunks(upload.stream)), "upload"
+    payload = request.get_json(silent=True) or {}
+    path = request.args.get("path") or payload.get("path")
+    if path:
+        return _resolve_local_path(path), "path"
+    synthetic = request.args.get("synthetic") or payload.get("synthetic")
+    if synthetic:
+        try:
+            scale = _synthetic_scale(synthetic)
+            seed = int(request.args.get("seed") or payload.get("seed") or 0)
+        except TypeError:
+            raise ValueError("synthetic must be a scale (float) and seed an int")
+        return _synthetic_gtfs_zip(agency_id, scale, seed), "synthetic"
+    url = request.args.get("url") or payload.get("url")
+    if url:
+        address = _check_feed_url(url)
+        import requests
+        try:
+            return _download_zip(url, redirects=False, address=address), "url"
+        except (requests.RequestException, RuntimeError) as e:
+            raise FileNotFoundError(str(e))
+    return _fetch_gtfs_zip(mode, agency_id), "tfnsw"
+
+@gtfs_ns.route('/import/<string:mode>/<string:agency_id>')
+class Import(Resource):
+    @require_auth(roles=('admin','planner'), limit="import")
+    @gtfs_ns.expect(import_parser)
+    @gtfs_ns.response(200, "Imported")
+    @gtfs_ns.response(400, "Only GSBC*/SBSC* allowed / invalid feed", error_model)
+    @gtfs_ns.response(403, "Path outside GTFS_LOCAL_DIR / url host not public / synthetic imports disabled", error_model)
+    @gtfs_ns.response(404, "Unknown agency / feed not found", error_model)
+    @gtfs_ns.response(409, "Read-only snapshot node", error_model)
+    @gtfs_ns.response(413, "Feed too large", error_model)
+    @gtfs_ns.response(429, "Import rate limit or concurrency cap reached (see Retry-After)", error_model)
+    @gtfs_ns.doc(
+        summary="Import GTFS zip for a bus agency",
+        description=(
+            "Downloads GTFS zip from TfNSW and stores into local SQLite.\n\n"
+            "**Role:** Admin & Planner.\n"
+            "**Allowed:** `mode=buses` and `agency_id` prefix `GSBC` or `SBSC` (Sydney Metro buses).\n\n"
+            "**Offline sources** (instead of TfNSW): upload the zip as multipart field `file`, "
+            "send it as the raw body with `Content-Type: application/zip`, "
+            "or pass `path` (relative to `GTFS_LOCAL_DIR`), `url`, or `synthetic=<scale>` for a generated feed. "
+            "A `url` host must resolve to public addresses or be listed in `GTFS_URL_ALLOWLIST`; redirects are not followed. "
+            "Uploads are streamed to disk and the archive is memory-mapped while parsing."
+        ),
+        params={"mode": "buses", "agency_id": "GSBC001 / SBSC006"},
+    )
+    def post(self, mode, agency_id):
+        err = _import_target_error(mode, agency_id)
+        if err:
+            code, body = err
+            return body, code
+        agency_key = f"{mode}:{agency_id}"
+        tel = ImportTelemetry(agency_key)
+        _imports_running[agency_key] = tel
+        try:
+            return self._import(mode, agency_id, agency_key, tel)
+        finally:
+            _imports_running.pop(agency_key, None)
+
+    def _import(self, mode, agency_id, agency_key, tel):
+        # Fetch first so a failed download leaves the old data in place
+        try:
+            with tel.phase("download") as ph:
+                data, tel.source = _request_gtfs_source(mode, agency_id)
+                ph["bytes"] = _zip_size(data)
+        except SOURCE_ERRORS as e:
+            code, body = _source_error(e)
+            return body, code
+        try:
+            stored = _parse_and_store(g.db, agency_key, data, telemetry=tel)
+        except zipfile.BadZipFile as e:
+            g.db.rollback()
+            return {"error": f"invalid GTFS zip: {e}"}, 400
+        finally:
+            _discard_spooled(data)
+        # record import time and phase telemetry
+        _record_import(g.db, mode, agency_id, telemetry=tel, timetable=stored["timetable"])
+        return {"status": "ok", "agency": agency_key, "rows": stored["rows"], "total_s": tel.as_dict()["total_s"]}
+
+bulk_import_model = api.model('BulkImport', {
+    'mode': fields.String(example='buses', description="Transport mode (only 'buses')"),
+    'agencies': fields.List(fields.String, description="Agency ids (or one comma-separated string); omit for every GSBC*/SBSC* agency"),
+    'source': fields.String(enum=['tfnsw', 'local', 'synthetic'], example='tfnsw',
+                            description="'tfnsw' downloads feeds; 'local' reads <agency_id>.zip from GTFS_LOCAL_DIR; "
+                                        "'synthetic' generates feeds of the given `scale` (needs ALLOW_SYNTHETIC_IMPORT)"),
+    'scale': fields.Float(example=0.5, description="Synthetic feed scale (source=synthetic, up to SYNTHETIC_MAX_SCALE)"),
+    'seed': fields.Integer(example=0, description="Synthetic feed seed (source=synthetic)"),
+    'fetchers': fields.Integer(example=4, description="Concurrent downloads (1-10)"),
+})
+
+def _bulk_agency_ids(mode: str, agencies):
+    """Agency ids to import: a list (or comma-separated string) of ids, or every valid agency when empty."""
+    valid = GTFS_VALID.get(mode, [])
+    if isinstance(agencies, str):
+        agencies = [a.strip() for a in agencies.split(",") if a.strip()]
+    if agencies and not (isinstance(agencies, (list, tuple)) and all(isinstance(a, str) for a in agencies)):
+        raise ValueError("agencies must be a list of agency ids")
+    ids = list(dict.fromkeys(agencies)) if agencies else list(valid)
+    unknown = [a for a in ids if a not in valid]
+    if unknown:
+        raise ValueError(f"Unknown agency: {', '.join(unknown)}")
+    return ids
+
+@admin_ns.route('/import/bulk')
+class BulkImport(Resource):
+    @require_auth(role='admin', limit="import")
+    @admin_ns.expect(bulk_import_model, validate=False)
+    @admin_ns.response(200, "Import report (per-agency status and timings)")
+    @admin_ns.response(400, "Bad request", error_model)
+    @admin_ns.response(403, "Synthetic imports disabled", error_model)
+    @admin_ns.response(409, "Read-only snapshot node", error_model)
+    @admin_ns.response(429, "Import rate limit or concurrency cap reached (see Retry-After)", error_model)
+    @admin_ns.doc(
+        summary="Import several agencies in one call",
+        description=(
+            "Fetches feeds concurrently, parses them in a process pool and writes them through a "
+            "single writer. Returns a per-agency report with bytes, rows and fetch/parse/write seconds.\n\n"
+            "**Role:** Admin only."
+        ),
+    )
+    def post(self):
+        payload = request.get_json(silent=True) or {}
+        if not isinstance(payload, dict):
+            return {"error": "body must be a JSON object"}, 400
+        mode = payload.get('mode') or 'buses'
+        source = payload.get('source') or 'tfnsw'
+        err = _read_only_error()
+        if err:
+            code, body = err
+            return body, code
+        if mode != 'buses':
+            return {"error": "Only mode=buses is supported"}, 400
+        if source not in ('tfnsw', 'local', 'synthetic'):
+            return {"error": "source must be 'tfnsw', 'local' or 'synthetic'"}, 400
+        try:
+            agency_ids = _bulk_agency_ids(mode, payload.get('agencies'))
+            fetchers = max(1, min(int(payload.get('fetchers') or 4), 10))
+            synthetic = _synthetic_scale(payload.get('scale') or SYNTHETIC_MAX_SCALE) if source == 'synthetic' else None
+            seed = int(payload.get('seed') or 0)
+        except PermissionError as e:
+            return {"error": str(e)}, 403
+        except (TypeError, ValueError) as e:
+            return {"error": str(e)}, 400
+        source_dir = GTFS_LOCAL_DIR if source == 'local' else None
+        return _bulk_import(g.db, agency_ids, mode=mode, source_dir=source_dir, fetchers=fetchers,
+                            synthetic=synthetic, seed=seed)
+
+def _import_summary(rec: Agency) -> dict:
+    """Latest run of an agency plus its throughput relative to the median of earlier runs."""
+    agency_key = f"{rec.mode}:{rec.agency_id}"
+    history = json.loads(rec.import_history or "[]")
+    last = history[0] if history else None
+    earlier = [h["rows_per_s"] for h in history[1:] if h.get("rows_per_s")]
+    running = _imports_running.get(agency_key)
+    return {
+        "agency": agency_key,
+        "imported_at": rec.imported_at.isoformat() if rec.imported_at else None,
+        "runs": len(history),
+        "last": {k: last[k] for k in ("started_at", "source", "total_s", "rows", "rows_per_s", "peak_rss_mb")} if last else None,
+        "throughput_vs_median": (round(last["rows_per_s"] / statistics.median(earlier), 2)
+                                 if last and last.get("rows_per_s") and earlier else None),
+        "running": running.as_dict(status="running") if running else None,
+    }
+
+@admin_ns.route('/imports')
+class ImportTelemetryList(Resource):
+    @require_auth(role='admin')
+    @admin_ns.doc(
+        summary="Import telemetry per agency",
+        description=(
+            "Latest import of every agency (wall seconds, rows, rows/s, peak RSS) and its throughput "
+            "relative to the median of earlier runs (`throughput_vs_median` < 1 means slower). Imports in "
+            "progress are listed under `running` with their current phase.\n\n"
+            "**Role:** Admin only."
+        ),
+    )
+    def get(self):
+        recs = g.db.query(Agency).order_by(Agency.mode, Agency.agency_id).all()
+        items = [_import_summary(r) for r in recs]
+        known = {it["agency"] for it in items}
+        for agency_key, tel in list(_imports_running.items()):
+            if agency_key not in known:
+                items.append({"agency": agency_key, "imported_at": None, "runs": 0, "last": None,
+                              "throughput_vs_median": None, "running": tel.as_dict(status="running")})
+        return {"items": items}
+
+@admin_ns.route('/imports/<string:mode>/<string:agency_id>')
+class ImportTelemetryItem(Resource):
+    @require_auth(role='admin')
+    @admin_ns.doc(
+        summary="Import history of one agency",
+        description=(
+            f"Up to {IMPORT_HISTORY} recent imports, newest first, each with per-phase telemetry: "
+            "download, unzip, parse:<file>, delete, insert:<table> and commit, with seconds, bytes, rows, "
+            "rows/s and peak RSS (MB). Parse and insert overlap, so their seconds are summed worker/writer time.\n\n"
+            "**Role:** Admin only."
+        ),
+        params={"limit": "Max runs to return (default all kept)"},
+    )
+    def get(self, mode, agency_id):
+        agency_key = f"{mode}:{agency_id}"
+        rec = g.db.query(Agency).filter(Agency.mode == mode, Agency.agency_id == agency_id).first()
+        running = _imports_running.get(agency_key)
+        if rec is None and running is None:
+            return {"error": "Agency not imported"}, 404
+        try:
+            limit = max(1, int(request.args.get('limit') or IMPORT_HISTORY))
+        except ValueError:
+            return {"error": "limit must be int"}, 400
+        history = json.loads(rec.import_history or "[]") if rec else []
         return {
-            "id": u.id, "username": u.username, "role": u.role,
-            "active": u.active, "created_at": (u.created_at.isoformat() if u.created_at else None)
+            "agency": agency_key,
+            "imported_at": rec.imported_at.isoformat() if rec and rec.imported_at else None,
+            "running": running.as_dict(status="running") if running else None,
+            "history": history[:limit],
         }
-    
-    @require_auth(role='admin')
-    def delete(self, user_id: int):
-        u = g.db.query(User).get(user_id)
-        if not u:
-            return {"error":"not found"}, 404
-        if u.username == 'admin':
-            return {"error":"cannot delete the Admin account"}, 400
-        g.db.delete(u)
-        g.db.commit()
-        return {"status":"deleted"}
 
-# -----------------------------------------------------------------------------
-# GTFS Constants & Import
-# -----------------------------------------------------------------------------
-GTFS_BASE_URL = "https://api.transport.nsw.gov.au/v1/gtfs/schedule"
-GTFS_VALID = {
-    'buses': ['GSBC001','GSBC002','GSBC003','GSBC004','SBSC006','GSBC007','GSBC008','GSBC009','GSBC010','GSBC014']
-}
+# -----------------------------
+# GTFS snapshots: versioned, compressed, read-only copies of all imported GTFS data
+# -----------------------------
+# A snapshot is one archive (tar + zstd, or gzip without zstandard) holding manifest.json and one
+# SQLite file per agency in the shard layout, vacuumed and ANALYZEd. A writer exports it
+# (`flask snapshot-export`); read nodes with GTFS_SNAPSHOT_DIR pull it (`flask snapshot-pull`),
+# unpack it to <dir>/<version>/ and serve it read-only and memory-mapped, switching versions when
+# <dir>/CURRENT changes (`flask snapshot-activate`, POST /admin/snapshots/<version>/activate).
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_KEEP = int(os.getenv("GTFS_SNAPSHOT_KEEP", "3"))  # unpacked versions kept by snapshot-pull
+_SNAPSHOT_VERSION = re.compile(r"\d{8}T\d{6}Z-[0-9a-f]{8}")  # as built by _export_snapshot; never a path
+_snapshot_seen = None   # (st_ino, st_mtime_ns) of the CURRENT file last activated
+_snapshot_lock = threading.Lock()
 
-def _tfnsw_api_key():
-    """Read TfNSW API key from env; this course mandates the name TRANSPORT_API_KEY."""
-    key = os.getenv('TRANSPORT_API_KEY')
-    return key
+def _snapshot_schema() -> dict:
+    """Table -> column names of the GTFS data tables; a snapshot only loads into the same schema."""
+    return {m.__table__.name: sorted(c.name for c in m.__table__.columns) for m in GTFS_DATA_MODELS}
 
-def _fetch_gtfs_zip(mode: str, agency_id: str) -> bytes:
-    url = f"{GTFS_BASE_URL}/{mode}/{agency_id}"
-    headers = {"Authorization": f"apikey {_tfnsw_api_key()}"}
-    r = requests.get(url, headers=headers, timeout=60)
-    if r.status_code != 200:
-        raise RuntimeError(f"TfNSW fetch failed: {r.status_code}")
-    return r.content
-
-def _clear_agency_data(agency_key: str):
-    for model in (Route, Stop, Trip, StopTime):
-        g.db.query(model).filter(model.agency_key == agency_key).delete(synchronize_session=False)
-    g.db.commit()
-
-def _parse_and_store(agency_key: str, zip_bytes: bytes):
-    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as z:
-        names = {n.lower(): n for n in z.namelist()}  # case-insensitive map
-        def find_path(target_basename: str):
-            # handle zips that have a folder prefix like 'google_transit/routes.txt'
-            tl = target_basename.lower()
-            for n in z.namelist():
-                if n.lower().endswith('/' + tl) or n.lower() == tl:
-                    return n
-            return None
-        def read_csv(target_basename):
-            p = find_path(target_basename)
-            if not p:
-                return []
-            with z.open(p) as f:
-                return list(csv.DictReader(io.TextIOWrapper(f, encoding='utf-8-sig')))
-
-        routes = read_csv('routes.txt')
-        stops = read_csv('stops.txt')
-        trips = read_csv('trips.txt')
-        stop_times = read_csv('stop_times.txt')
-
-        for r in routes:
-            g.db.add(Route(agency_key=agency_key, route_id=r.get('route_id'),
-                           route_short_name=r.get('route_short_name'), route_long_name=r.get('route_long_name'),
-                           route_type=int(r.get('route_type') or 0)))
-        for s in stops:
-            g.db.add(Stop(agency_key=agency_key, stop_id=s.get('stop_id'), stop_name=s.get('stop_name'),
-                          stop_lat=float(s.get('stop_lat') or 0.0), stop_lon=float(s.get('stop_lon') or 0.0)))
-        for t in trips:
-            g.db.add(Trip(agency_key=agency_key, trip_id=t.get('trip_id'), route_id=t.get('route_id'),
-                          service_id=t.get('service_id'), trip_headsign=t.get('trip_headsign'),
-                          direction_id=int(t.get('direction_id') or 0)))
-        for st in stop_times:
-            g.db.add(StopTime(agency_key=agency_key, trip_id=st.get('trip_id'), arrival_time=st.get('arrival_time'),
-                              departure_time=st.get('departure_time'), stop_id=st.get('stop_id'),
-                              stop_sequence=int(st.get('stop_sequence') or 0)))
-        g.db.commit()
+def _read_only_error():
+    """(409, body) on a node serving snapshots, where imports are refused; else None."""
+    if snapshot_dir is None:
+        return None
+    active = _current_snapshot_version() or "none active"
+    return 409, {"error": f"this node serves read-only GTFS snapshots ({active}); "
+                          "import on the writer and publish a new snapshot"}
 
+def _current_snapshot_version() -> Optional[str]:
+    try:
+        return (snapshot_dir / "CURRENT").read_text().strip() or None
+    except FileNotFoundError:
+        return None
 
-gtfs_ns = Namespace('gtfs', description='GTFS import')
+def _snapshot_manifest(version: str) -> Optional[dict]:
+    try:
+        return json.loads((snapshot_dir / version / "manifest.json").read_text())
+    except (FileNotFoundError, NotADirectoryError):
+        return None
 
-from flask_restx.reqparse import RequestParser
+def _sync_snapshot():
+    """Serve the version named in <snapshot_dir>/CURRENT, if it changed since the last call.
 
-routes_parser = RequestParser(bundle_errors=True)
-routes_parser.add_argument("agency", type=str, required=True, help="Agency id (e.g. GSBC001).")
-routes_parser.add_argument("q", type=str, help="Fuzzy search string.")
-routes_parser.add_argument("route_type", type=int, help="Filter by GTFS route_type (int).")
-routes_parser.add_argument("page", type=int, default=1)
-routes_parser.add_argument("page_size", type=int, default=50)
+    One stat per call; workers pick up an activation made by any process on their next request.
+    """
+    global snapshot, shard_dir, _snapshot_seen, _agency_pks_by_key, _agency_keys_by_pk
+    try:
+        st = os.stat(snapshot_dir / "CURRENT")
+    except FileNotFoundError:
+        return
+    ident = (st.st_ino, st.st_mtime_ns)
+    if ident == _snapshot_seen:
+        return
+    with _snapshot_lock:
+        if ident == _snapshot_seen:
+            return
+        version = _current_snapshot_version()
+        manifest = _snapshot_manifest(version) if version and _SNAPSHOT_VERSION.fullmatch(version) else None
+        if manifest is None or manifest["schema"] != _snapshot_schema():
+            log.warning("snapshot: cannot serve %r: missing or built for another schema", version)
+        else:
+            by_key = {key: a["pk"] for key, a in manifest["agencies"].items()}
+            # swap whole dicts: requests in flight keep the mapping they started with
+            _agency_pks_by_key, _agency_keys_by_pk = by_key, {pk: key for key, pk in by_key.items()}
+            shard_dir = snapshot_dir / version
+            snapshot = manifest
+        _snapshot_seen = ident
 
-stops_parser = RequestParser(bundle_errors=True)
-stops_parser.add_argument("agency", type=str, required=True)
-stops_parser.add_argument("q", type=str, help="Stop name/id contains this text.")
-stops_parser.add_argument("page", type=int, default=1)
-stops_parser.add_argument("page_size", type=int, default=50)
+@core.before_app_request
+def _serve_current_snapshot():
+    if snapshot_dir is not None:
+        _sync_snapshot()
 
-trips_parser = RequestParser(bundle_errors=True)
-trips_parser.add_argument("agency", type=str, required=True)
-trips_parser.add_argument("route_id", type=str, help="Filter trips by route_id.")
-trips_parser.add_argument("q", type=str, help="Trip id/headsign contains this text.")
-trips_parser.add_argument("direction_id", type=int, help="0 or 1")
-trips_parser.add_argument("page", type=int, default=1)
-trips_parser.add_argument("page_size", type=int, default=50)
+def _activate_snapshot(version: str) -> dict:
+    """Point <snapshot_dir>/CURRENT at an unpacked version (atomically) and serve it here now."""
+    manifest = _snapshot_manifest(version) if _SNAPSHOT_VERSION.fullmatch(version) else None
+    if manifest is None:
+        raise FileNotFoundError(f"no unpacked snapshot {version!r} in {snapshot_dir}")
+    if manifest["schema"] != _snapshot_schema():
+        raise ValueError(f"snapshot {version} was built for a different GTFS schema")
+    tmp = snapshot_dir / f".CURRENT.{os.getpid()}.{threading.get_ident()}"
+    tmp.write_text(version)
+    os.replace(tmp, snapshot_dir / "CURRENT")
+    _sync_snapshot()
+    return manifest
 
+def _snapshot_agency(db, agency_key: str, pk: int, dest: Path):
+    """Write one agency's GTFS tables to `dest` as a standalone, vacuumed and analyzed shard."""
+    import shutil, sqlite3
+    if shard_dir is not None:
+        shutil.copyfile(_shard_path(agency_key), dest)
+    else:
+        target = create_engine(f"sqlite:///{dest}", future=True)
+        event.listen(target, "connect", _shard_build_pragmas)
+        Base.metadata.create_all(target, tables=[m.__table__ for m in GTFS_DATA_MODELS])
+        with target.begin() as out:
+            if engine.dialect.name == "sqlite" and engine.url.database:
+                # copy inside SQLite, without a Python round trip per row
+                out.exec_driver_sql("ATTACH DATABASE ? AS src", (engine.url.database,))
+                for model in GTFS_DATA_MODELS:
+                    table = model.__table__
+                    cols = ", ".join(c.name for c in table.columns)
+                    where = ("trip_pk IN (SELECT id FROM src.gtfs_trips WHERE agency_pk = ?)" if model is StopTime
+                             else "agency_pk = ?")
+                    out.exec_driver_sql(f"INSERT INTO main.{table.name} ({cols}) "
+                                        f"SELECT {cols} FROM src.{table.name} WHERE {where}", (pk,))
+            else:
+                trips = db.query(Trip.id).filter(Trip.agency_pk == pk).scalar_subquery()
+                for model in GTFS_DATA_MODELS:
+                    where = StopTime.trip_pk.in_(trips) if model is StopTime else model.agency_pk == pk
+                    table = model.__table__
+                    rows = db.execute(table.select().where(where).execution_options(yield_per=WRITE_BATCH))
+                    for part in rows.mappings().partitions():
+                        out.execute(insert(table), [dict(r) for r in part])
+        target.dispose()
+    conn = sqlite3.connect(dest, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("ANALYZE")   # planner statistics travel with the file
+        conn.execute("VACUUM")
+        counts = {m.__table__.name: conn.execute(f"SELECT COUNT(*) FROM {m.__table__.name}").fetchone()[0]
+                  for m in GTFS_DATA_MODELS}
+    finally:
+        conn.close()
+    return counts
 
-api.add_namespace(gtfs_ns, path='/gtfs')
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in _stream_chunks(f):
+            h.update(chunk)
+    return h.hexdigest()
 
-# -----------------------------
-# Query helpers (Set 3/4)
-# -----------------------------
+def _export_snapshot(db, out_dir) -> tuple:
+    """Package every imported agency into a snapshot archive in `out_dir`; returns (path, manifest)."""
+    import tarfile
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if shard_dir is not None:
+        keys = _shard_keys()
+    else:
+        pks = [pk for (pk,) in db.query(Route.agency_pk).distinct()]
+        _cache_agencies(db.query(Agency.id, Agency.mode, Agency.agency_id).filter(Agency.id.in_(pks)).all())
+        keys = sorted(_agency_keys_by_pk[pk] for pk in pks)
+    agencies = {}
+    imported_at = {f"{m}:{a}": t for m, a, t in db.query(Agency.mode, Agency.agency_id, Agency.imported_at)}
+    with tempfile.TemporaryDirectory(dir=out_dir, prefix=".export-") as work:
+        for key, pk in _agency_pks(db, keys).items():
+            name = f"{key.replace(':', '_', 1)}.sqlite"
+            rows = _snapshot_agency(db, key, pk, Path(work) / name)
+            agencies[key] = {"pk": pk, "file": name, "bytes": (Path(work) / name).stat().st_size,
+                             "sha256": _file_sha256(Path(work) / name), "rows": rows,
+                             "imported_at": imported_at[key].isoformat(timespec="seconds") if imported_at.get(key) else None}
+        if not agencies:
+            raise ValueError("no imported agencies to snapshot")
+        digest = hashlib.sha256(json.dumps({k: a["sha256"] for k, a in agencies.items()}, sort_keys=True).encode())
+        created = datetime.utcnow()
+        version = f"{created:%Y%m%dT%H%M%SZ}-{digest.hexdigest()[:8]}"
+        manifest = {"format": SNAPSHOT_FORMAT, "version": version, "created_at": created.isoformat(timespec="seconds"),
+                    "schema": _snapshot_schema(), "agencies": agencies}
+        Path(work, "manifest.json").write_text(json.dumps(manifest, indent=1))
+        path = out_dir / f"gtfs-snapshot-{version}.tar.{'zst' if zstandard else 'gz'}"
+        partial = path.with_name(f".{path.name}.partial")
+        with open(partial, "wb") as raw:
+            compressed = (zstandard.ZstdCompressor(level=9, threads=-1).stream_writer(raw, closefd=False)
+                          if zstandard else gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6))
+            with compressed, tarfile.open(fileobj=compressed, mode="w|") as tar:
+                for name in ["manifest.json"] + [a["file"] for a in agencies.values()]:
+                    tar.add(Path(work) / name, arcname=name)
+        os.replace(partial, path)
+    return path, manifest
 
-def _agency_key_from_query():
-    agency = (request.args.get('agency') or '').strip()
-    if not agency:
-        return None, (400, {"error": "query parameter 'agency' is required"})
-    if agency not in GTFS_VALID.get('buses', []):
-        return None, (404, {"error": "Unknown agency"})
-    return f"buses:{agency}", None
+def _open_snapshot_stream(raw):
+    """Decompressing reader for a snapshot archive, chosen by its magic bytes."""
+    magic = raw.read(4)
+    raw.seek(0)
+    if magic == b"\x28\xb5\x2f\xfd":
+        if zstandard is None:
+            raise ValueError("snapshot is zstd-compressed; install zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    if magic[:2] == b"\x1f\x8b":
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    raise ValueError("not a GTFS snapshot archive (expected .tar.zst or .tar.gz)")
 
+def _unpack_snapshot(archive: Path) -> dict:
+    """Verify and unpack an archive into <snapshot_dir>/<version>/; returns its manifest."""
+    import shutil, tarfile
+    work = snapshot_dir / f".unpack-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(work, ignore_errors=True)   # left by a crashed pull
+    work.mkdir()
+    try:
+        digests = {}
+        with open(archive, "rb") as raw, _open_snapshot_stream(raw) as stream, \
+                tarfile.open(fileobj=stream, mode="r|") as tar:
+            for member in tar:
+                name = member.name
+                if not member.isfile() or "/" in name or not (name == "manifest.json" or name.endswith(".sqlite")):
+                    raise ValueError(f"unexpected snapshot member {name!r}")
+                h = hashlib.sha256()
+                with tar.extractfile(member) as src, open(work / name, "wb") as dst:
+                    for chunk in _stream_chunks(src):
+                        h.update(chunk)
+                        dst.write(chunk)
+                digests[name] = h.hexdigest()
+        manifest = json.loads((work / "manifest.json").read_text())
+        version = str(manifest.get("version") or "")
+        if manifest.get("format") != SNAPSHOT_FORMAT or not _SNAPSHOT_VERSION.fullmatch(version):
+            raise ValueError("unsupported snapshot manifest")
+        if manifest["schema"] != _snapshot_schema():
+            raise ValueError(f"snapshot {version} was built for a different GTFS schema")
+        files = {a["file"]: a["sha256"] for a in manifest["agencies"].values()}
+        if {n: d for n, d in digests.items() if n != "manifest.json"} != files:
+            raise ValueError(f"snapshot {version} is incomplete or corrupt (checksum mismatch)")
+        final = snapshot_dir / version
+        if final.exists():
+            shutil.rmtree(work)
+        else:
+            os.replace(work, final)
+        return manifest
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
 
-def _ensure_imported(agency_key: str):
-    # consider imported if there is at least one route for this agency
-    return g.db.query(Route).filter(Route.agency_key == agency_key).count() > 0
+def _prune_snapshots(keep: int = SNAPSHOT_KEEP) -> list:
+    """Delete unpacked versions beyond the newest `keep`, never the active one; returns their names."""
+    import shutil
+    active = _current_snapshot_version()
+    versions = sorted((p.name for p in snapshot_dir.iterdir() if p.is_dir() and not p.name.startswith(".")),
+                      reverse=True)
+    dropped = [v for v in versions[keep:] if v != active]
+    for v in dropped:
+        shutil.rmtree(snapshot_dir / v, ignore_errors=True)
+    return dropped
 
+def _pull_snapshot(source: str) -> dict:
+    """Fetch a snapshot archive (http(s) URL or local path) and unpack it; returns its manifest.
 
-def _get_pagination():
+    Old versions are left in place: snapshot-pull prunes them once it has activated (or not) the new one.
+    """
+    if not source.lower().startswith(("http://", "https://")):
+        return _unpack_snapshot(Path(source))
+    import requests
+    fd, name = tempfile.mkstemp(prefix=".download-", dir=snapshot_dir)
     try:
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 50))
-    except ValueError:
-        return 1, 50
-    page = max(page, 1)
-    page_size = max(1, min(page_size, 200))
-    return page, page_size
+        with os.fdopen(fd, "wb") as f, requests.get(source, timeout=60, stream=True) as r:
+            if r.status_code != 200:
+                raise RuntimeError(f"snapshot fetch failed: {r.status_code}")
+            for chunk in r.iter_content(SPOOL_CHUNK):
+                f.write(chunk)
+        return _unpack_snapshot(Path(name))
+    finally:
+        Path(name).unlink(missing_ok=True)
 
-@gtfs_ns.route('/import/<string:mode>/<string:agency_id>')
-class Import(Resource):
-    @require_auth(roles=('admin','planner'))
-    @gtfs_ns.response(200, "Imported")
-    @gtfs_ns.response(400, "Only GSBC*/SBSC* allowed", error_model)
-    @gtfs_ns.response(404, "Unknown agency", error_model)
-    @gtfs_ns.doc(
-        summary="Import GTFS zip for a bus agency",
+def _snapshot_summary(manifest: dict) -> dict:
+    return {"version": manifest["version"], "created_at": manifest["created_at"],
+            "agencies": sorted(manifest["agencies"]),
+            "bytes": sum(a["bytes"] for a in manifest["agencies"].values())}
+
+@admin_ns.route('/snapshots')
+class Snapshots(Resource):
+    @require_auth(role='admin')
+    @admin_ns.response(404, "Not a snapshot node (GTFS_SNAPSHOT_DIR unset)", error_model)
+    @admin_ns.doc(
+        summary="GTFS snapshot versions on this node",
         description=(
-            "Downloads GTFS zip from TfNSW and stores into local SQLite.\n\n"
-            "**Role:** Admin & Planner.\n"
-            "**Allowed:** `mode=buses` and `agency_id` prefix `GSBC` or `SBSC` (Sydney Metro buses)."
+            "Lists the snapshot versions unpacked in `GTFS_SNAPSHOT_DIR` (newest first) and the one being "
+            "served. Snapshots are made on the writer with `flask snapshot-export` and fetched with "
+            "`flask snapshot-pull`.\n\n**Role:** Admin only."
         ),
-        params={"mode": "buses", "agency_id": "GSBC001 / SBSC006"},
     )
-    def post(self, mode, agency_id):
-        # Set 2: only buses with GSBC* or SBSC*
-        if mode != 'buses' or not (agency_id.startswith('GSBC') or agency_id.startswith('SBSC')):
-            return {"error": "Only Sydney Metro bus agencies (GSBC*/SBSC*) are allowed"}, 400
-        if agency_id not in GTFS_VALID.get('buses', []):
-            return {"error": "Unknown agency"}, 404
-        agency_key = f"{mode}:{agency_id}"
-        # Replace old data if exists
-        _clear_agency_data(agency_key)
-        data = _fetch_gtfs_zip(mode, agency_id)
-        _parse_and_store(agency_key, data)
-        # (Optional) record import time
-        rec = g.db.query(Agency).filter(Agency.mode==mode, Agency.agency_id==agency_id).first()
-        if not rec:
-            rec = Agency(mode=mode, agency_id=agency_id)
-            g.db.add(rec)
-        rec.imported_at = datetime.utcnow()
-        g.db.commit()
-        return {"status": "ok", "agency": agency_key}
+    def get(self):
+        if snapshot_dir is None:
+            return {"error": "GTFS_SNAPSHOT_DIR is not set on this node"}, 404
+        versions = sorted((p.name for p in snapshot_dir.iterdir() if p.is_dir() and not p.name.startswith(".")),
+                          reverse=True)
+        manifests = [m for m in map(_snapshot_manifest, versions) if m]
+        return {"active": snapshot["version"] if snapshot else None,
+                "versions": [_snapshot_summary(m) for m in manifests]}
+
+@admin_ns.route('/snapshots/<string:version>/activate')
+class SnapshotActivate(Resource):
+    @require_auth(role='admin')
+    @admin_ns.response(404, "Unknown version, or not a snapshot node", error_model)
+    @admin_ns.response(409, "Snapshot built for a different schema", error_model)
+    @admin_ns.doc(
+        summary="Serve another GTFS snapshot version",
+        description=(
+            "Switches every worker on this node to an unpacked snapshot version without a restart: "
+            "requests already running finish on the old files.\n\n**Role:** Admin only."
+        ),
+    )
+    def post(self, version):
+        if snapshot_dir is None:
+            return {"error": "GTFS_SNAPSHOT_DIR is not set on this node"}, 404
+        try:
+            return {"active": _snapshot_summary(_activate_snapshot(version))}
+        except FileNotFoundError as e:
+            return {"error": str(e)}, 404
+        except ValueError as e:
+            return {"error": str(e)}, 409
 
 # -----------------------------
 # Set 3/4: Read-only query endpoints
@@ -581,7 +3762,7 @@ class Import(Resource):
 class Routes(Resource):
     @require_auth(roles=('admin','planner','commuter'))
     @gtfs_ns.expect(routes_parser)
-    @gtfs_ns.marshal_with(routes_response, code=200, description="OK")
+    @gtfs_ns.response(200, "OK", routes_response)
     @gtfs_ns.response(400, "Invalid query", error_model)
     @gtfs_ns.response(404, "Agency not imported / unknown agency", error_model)
     @gtfs_ns.doc(
@@ -589,130 +3770,264 @@ class Routes(Resource):
         description=(
             "Lists routes with pagination and optional fuzzy search.\n\n"
             "**Role:** All users.\n"
-            "Query: `agency` (required), `q`, `route_type`, `page`, `page_size`."
+            "Query: `agency` (required), `q`, `route_type`, `route_id`, `stop_id` (routes serving that stop), "
+            "`page`, `page_size`.\n\n"
+            "`agency` may list several ids (`GSBC001,GSBC002`) or be `*` for every imported agency; "
+            "results are merged and paged in one global order.\n\n"
+            "Each route carries a `summary` (trip/stop counts, first/last departure, headway) computed at import; "
+            "per-direction figures are at `/gtfs/routes/<route_id>/stats`."
         )
     )
     def get(self):
-        agency_key, err = _agency_key_from_query()
+        return _list_gtfs('routes')
+
+ITEM_DOC = ("**Role:** All users. Query: `agency` (optional; without it every imported agency is "
+            "searched and an id found in several of them returns 409).")
+
+@gtfs_ns.route('/routes/<string:route_id>')
+class RouteById(Resource):
+    @require_auth(roles=('admin','planner','commuter'))
+    @gtfs_ns.response(200, "OK", route_detail)
+    @gtfs_ns.response(404, "Agency not imported / route not found", error_model)
+    @gtfs_ns.response(409, "Route id exists in several agencies", error_model)
+    @gtfs_ns.doc(
+        summary="One route with its summary and stop patterns",
+        description=ITEM_DOC + "\n\nEach pattern is one ordered stop sequence run by `trip_count` trips.",
+        params={"agency": "Agency id, e.g. GSBC001"},
+    )
+    def get(self, route_id):
+        found, err = _lookup_item("routes", route_id)
         if err:
             code, body = err
             return body, code
-        if not _ensure_imported(agency_key):
-            return {"error": "Agency not imported"}, 404
-        q = g.db.query(Route).filter(Route.agency_key == agency_key)
-        qstr = (request.args.get('q') or '').strip()
-        if qstr:
-            ilike = f"%{qstr}%"
-            q = q.filter(or_(Route.route_id.ilike(ilike), Route.route_short_name.ilike(ilike), Route.route_long_name.ilike(ilike)))
-        rtype = request.args.get('route_type')
-        if rtype is not None and rtype != '':
-            try:
-                q = q.filter(Route.route_type == int(rtype))
-            except ValueError:
-                return {"error": "route_type must be int"}, 400
-        page, page_size = _get_pagination()
-        total = q.count()
-        items = q.order_by(Route.route_id).offset((page-1)*page_size).limit(page_size).all()
-        return {
-            "agency": agency_key,
-            "total": total,
-            "page": page,
-            "page_size": page_size,
-            "items": [{
-                "route_id": r.route_id,
-                "route_short_name": r.route_short_name,
-                "route_long_name": r.route_long_name,
-                "route_type": r.route_type,
-            } for r in items]
-        }
+        agency_key, db, row = found
+        pk = _agency_pks_by_key[agency_key]
+        item = _item_public("routes", agency_key, row)
+        _fill_route_summaries([item], db.execute(_route_summaries_stmt(pk, [route_id])).all())
+        patterns = db.execute(select(RoutePattern.pattern_id, RoutePattern.direction_id, RoutePattern.trip_count)
+                              .where(RoutePattern.agency_pk == pk, RoutePattern.route_id == route_id)
+                              .order_by(RoutePattern.pattern_id)).all()
+        stops = _pattern_stop_ids(db, pk, [p.pattern_id for p in patterns])
+        item["patterns"] = [{"pattern_id": p.pattern_id, "direction_id": p.direction_id,
+                             "trip_count": p.trip_count, "stops": stops[p.pattern_id]} for p in patterns]
+        return _json_response(item)
+
+@gtfs_ns.route('/routes/<string:route_id>/stats')
+class RouteStats(Resource):
+    @require_auth(roles=('admin','planner','commuter'))
+    @gtfs_ns.response(200, "OK", route_stats_response)
+    @gtfs_ns.response(400, "agency must name one agency", error_model)
+    @gtfs_ns.response(404, "Agency not imported / route not found / no statistics", error_model)
+    @gtfs_ns.doc(
+        summary="Service statistics of one route",
+        description=(
+            "**Role:** All users. Query: `agency` (one id).\n\n"
+            "Trip and stop counts, first/last departure, median headway and median running time for the "
+            "whole route and per direction, computed when the agency was imported."
+        ),
+        params={"agency": "Agency id, e.g. GSBC001"},
+    )
+    def get(self, route_id):
+        agency_keys, err = _agency_keys_from_query()
+        if err:
+            code, body = err
+            return body, code
+        if len(agency_keys) != 1:
+            return {"error": "query parameter 'agency' must name one agency"}, 400
+        agency_key = agency_keys[0]
+        pk = _agency_pks_by_key[agency_key]
+        db = _gtfs_db(agency_key)
+        route = (db.query(*ROUTE_COLUMNS.values())
+                 .filter(Route.agency_pk == pk, Route.route_id == route_id).first())
+        if route is None:
+            return {"error": "Route not found"}, 404
+        rows = db.execute(select(*ROUTE_STAT_COLUMNS)
+                          .where(RouteStat.agency_pk == pk, RouteStat.route_id == route_id)
+                          .order_by(RouteStat.direction_id)).all()
+        if not rows:
+            return {"error": "No statistics for this route (no trips, or imported before they were kept)"}, 404
+        return _json_response({
+            "route": dict(zip(ROUTE_COLUMNS, route), agency=agency_key),
+            "summary": _route_summary(rows[0]),
+            "directions": [dict(_route_summary(r), direction_id=r.direction_id) for r in rows[1:]],
+        })
 
 @gtfs_ns.route('/stops')
 class Stops(Resource):
-    @require_auth(roles=('admin','planner','commuter'))
     @require_auth(roles=('admin','planner','commuter'))
     @gtfs_ns.expect(stops_parser)
-    @gtfs_ns.marshal_with(stops_response, code=200, description="OK")
+    @gtfs_ns.response(200, "OK", stops_response)
     @gtfs_ns.response(404, "Agency not imported / unknown agency", error_model)
     @gtfs_ns.doc(
         summary="List stops for an agency",
-        description="**Role:** All users. Supports case-insensitive & partial matches via `q`.",
+        description=(
+            "**Role:** All users. Supports case-insensitive & partial matches via `q`. "
+            "`stop_id`, `trip_id` (stops the trip calls at) and `route_id` (stops the route serves) filter "
+            "through indexes built at import. `agency` accepts a comma-separated list or `*`."
+        ),
     )
     def get(self):
-        agency_key, err = _agency_key_from_query()
+        return _list_gtfs('stops')
+
+@gtfs_ns.route('/stops/<string:stop_id>')
+class StopById(Resource):
+    @require_auth(roles=('admin','planner','commuter'))
+    @gtfs_ns.response(200, "OK", stop_detail)
+    @gtfs_ns.response(404, "Agency not imported / stop not found", error_model)
+    @gtfs_ns.response(409, "Stop id exists in several agencies", error_model)
+    @gtfs_ns.doc(summary="One stop with the routes serving it", description=ITEM_DOC,
+                 params={"agency": "Agency id, e.g. GSBC001"})
+    def get(self, stop_id):
+        found, err = _lookup_item("stops", stop_id)
         if err:
             code, body = err
             return body, code
-        if not _ensure_imported(agency_key):
-            return {"error": "Agency not imported"}, 404
-        q = g.db.query(Stop).filter(Stop.agency_key == agency_key)
-        qstr = (request.args.get('q') or '').strip()
-        if qstr:
-            ilike = f"%{qstr}%"
-            q = q.filter(or_(Stop.stop_id.ilike(ilike), Stop.stop_name.ilike(ilike)))
-        page, page_size = _get_pagination()
-        total = q.count()
-        items = q.order_by(Stop.stop_id).offset((page-1)*page_size).limit(page_size).all()
-        return {
-            "agency": agency_key,
-            "total": total,
-            "page": page,
-            "page_size": page_size,
-            "items": [{
-                "stop_id": s.stop_id,
-                "stop_name": s.stop_name,
-                "stop_lat": s.stop_lat,
-                "stop_lon": s.stop_lon,
-            } for s in items]
-        }
+        agency_key, db, row = found
+        item = _item_public("stops", agency_key, row)
+        item["routes"] = list(db.execute(select(StopRoute.route_id).where(StopRoute.stop_pk == row.id)
+                                         .order_by(StopRoute.route_id)).scalars())
+        return _json_response(item)
 
 @gtfs_ns.route('/trips')
 class Trips(Resource):
     @require_auth(roles=('admin','planner','commuter'))
     @gtfs_ns.expect(trips_parser)
-    @gtfs_ns.marshal_with(trips_response, code=200, description="OK")
+    @gtfs_ns.response(200, "OK", trips_response)
     @gtfs_ns.response(404, "Agency not imported / unknown agency", error_model)
     @gtfs_ns.doc(
         summary="List trips for an agency (optionally filter by route)",
         description=(
-            "**Role:** All users. Query: `agency` (required), `route_id`, `q`, `direction_id`, `page`, `page_size`."
+            "**Role:** All users. Query: `agency` (required), `route_id`, `trip_id`, `q`, `direction_id`, `page`, `page_size`. "
+            "`agency` accepts a comma-separated list or `*`."
         ),
     )
     def get(self):
-        agency_key, err = _agency_key_from_query()
+        return _list_gtfs('trips')
+
+@gtfs_ns.route('/trips/<string:trip_id>')
+class TripById(Resource):
+    @require_auth(roles=('admin','planner','commuter'))
+    @gtfs_ns.response(200, "OK", trip_detail)
+    @gtfs_ns.response(404, "Agency not imported / trip not found", error_model)
+    @gtfs_ns.response(409, "Trip id exists in several agencies", error_model)
+    @gtfs_ns.doc(summary="One trip with its stops in order", description=ITEM_DOC,
+                 params={"agency": "Agency id, e.g. GSBC001"})
+    def get(self, trip_id):
+        found, err = _lookup_item("trips", trip_id)
         if err:
             code, body = err
             return body, code
+        agency_key, db, row = found
+        item = _item_public("trips", agency_key, row)
+        item["pattern_id"] = db.execute(select(TripPattern.pattern_id)
+                                        .where(TripPattern.trip_pk == row.id)).scalar()
+        item["stops"] = (_pattern_stop_ids(db, _agency_pks_by_key[agency_key], [item["pattern_id"]])
+                         [item["pattern_id"]] if item["pattern_id"] is not None else [])
+        return _json_response(item)
+
+
+# -----------------------------
+# Batch lookups (one round-trip instead of N+1)
+# -----------------------------
+BATCH_MAX_IDS = 500      # per list in one batch request
+_IN_CHUNK = 400          # keep IN (...) below SQLite's bound-parameter limit
+
+def _chunks(values, size=_IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def _batch_ids(payload, name):
+    """Return the de-duplicated, order-preserving id list `name` from a batch payload."""
+    raw = payload.get(name) or []
+    if not isinstance(raw, list):
+        raise ValueError(f"'{name}' must be a list of ids")
+    ids = list(dict.fromkeys(str(v).strip() for v in raw if str(v).strip()))
+    if len(ids) > BATCH_MAX_IDS:
+        raise ValueError(f"'{name}' accepts at most {BATCH_MAX_IDS} ids")
+    return ids
+
+def _fetch_in(db, model, column, agency_pk: int, ids):
+    """Fetch all rows of `model` whose `column` is in `ids`, chunking the IN list."""
+    rows = []
+    for chunk in _chunks(ids):
+        rows.extend(db.query(model).filter(model.agency_pk == agency_pk, column.in_(chunk)).all())
+    return rows
+
+@gtfs_ns.route('/batch')
+class Batch(Resource):
+    @require_auth(roles=('admin','planner','commuter'))
+    @gtfs_ns.expect(batch_request_model, validate=False)
+    @gtfs_ns.response(200, "OK", batch_response_model)
+    @gtfs_ns.response(400, "Invalid payload", error_model)
+    @gtfs_ns.response(404, "Agency not imported / unknown agency", error_model)
+    @gtfs_ns.doc(
+        summary="Resolve many routes/trips/stops in one request",
+        description=(
+            "Replaces per-id round-trips: look up routes, trips and stops by id, list the trips of "
+            "several routes and the ordered stops of several trips, all in one call.\n\n"
+            "**Role:** All users. Each list accepts at most "
+            f"{BATCH_MAX_IDS} ids; unknown ids are reported under `missing`."
+        ),
+    )
+    def post(self):
+        payload = request.get_json(silent=True) or {}
+        if not isinstance(payload, dict):
+            return {"error": "body must be a JSON object"}, 400
+        agency = payload.get('agency') or ''
+        if not isinstance(agency, str) or not agency.strip():
+            return {"error": "'agency' is required"}, 400
+        agency = agency.strip()
+        if agency not in GTFS_VALID.get('buses', []):
+            return {"error": "Unknown agency"}, 404
+        agency_key = f"buses:{agency}"
+        try:
+            route_ids = _batch_ids(payload, 'route_ids')
+            trip_ids = _batch_ids(payload, 'trip_ids')
+            stop_ids = _batch_ids(payload, 'stop_ids')
+            trips_for_routes = _batch_ids(payload, 'trips_for_routes')
+            stops_for_trips = _batch_ids(payload, 'stops_for_trips')
+        except ValueError as e:
+            return {"error": str(e)}, 400
         if not _ensure_imported(agency_key):
             return {"error": "Agency not imported"}, 404
-        q = g.db.query(Trip).filter(Trip.agency_key == agency_key)
-        route_id = (request.args.get('route_id') or '').strip()
-        if route_id:
-            q = q.filter(Trip.route_id == route_id)
-        qstr = (request.args.get('q') or '').strip()
-        if qstr:
-            ilike = f"%{qstr}%"
-            q = q.filter(or_(Trip.trip_id.ilike(ilike), Trip.trip_headsign.ilike(ilike)))
-        direction = request.args.get('direction_id')
-        if direction is not None and direction != '':
-            try:
-                q = q.filter(Trip.direction_id == int(direction))
-            except ValueError:
-                return {"error": "direction_id must be int"}, 400
-        page, page_size = _get_pagination()
-        total = q.count()
-        items = q.order_by(Trip.trip_id).offset((page-1)*page_size).limit(page_size).all()
+        agency_pk = _agency_pks_by_key[agency_key]
+        db = _gtfs_db(agency_key)
+
+        routes = {r.route_id: r for r in _fetch_in(db, Route, Route.route_id, agency_pk, route_ids)}
+        trips = {t.trip_id: t for t in _fetch_in(db, Trip, Trip.trip_id, agency_pk, trip_ids)}
+        stops = {s.stop_id: s for s in _fetch_in(db, Stop, Stop.stop_id, agency_pk, stop_ids)}
+
+        trips_by_route = {rid: [] for rid in trips_for_routes}
+        for t in sorted(_fetch_in(db, Trip, Trip.route_id, agency_pk, trips_for_routes), key=lambda t: t.trip_id):
+            trips_by_route[t.route_id].append(_trip_public(t))
+
+        stops_by_trip = {tid: [] for tid in stops_for_trips}
+        for chunk in _chunks(stops_for_trips):
+            rows = (db.query(Trip.trip_id, StopTime.stop_sequence, StopTime.arrival_secs,
+                               StopTime.departure_secs, Stop)
+                    .join(StopTime, StopTime.trip_pk == Trip.id)
+                    .join(Stop, Stop.id == StopTime.stop_pk)
+                    .filter(Trip.agency_pk == agency_pk, Trip.trip_id.in_(chunk))
+                    .order_by(Trip.trip_id, StopTime.stop_sequence)
+                    .all())
+            for tid, seq, arr, dep, s in rows:
+                item = _stop_public(s)
+                item.update(stop_sequence=seq, arrival_time=_gtfs_time(arr), departure_time=_gtfs_time(dep))
+                stops_by_trip[tid].append(item)
+
         return {
             "agency": agency_key,
-            "total": total,
-            "page": page,
-            "page_size": page_size,
-            "items": [{
-                "trip_id": t.trip_id,
-                "route_id": t.route_id,
-                "service_id": t.service_id,
-                "trip_headsign": t.trip_headsign,
-                "direction_id": t.direction_id,
-            } for t in items]
+            "routes": [_route_public(routes[i]) for i in route_ids if i in routes],
+            "trips": [_trip_public(trips[i]) for i in trip_ids if i in trips],
+            "stops": [_stop_public(stops[i]) for i in stop_ids if i in stops],
+            "trips_by_route": trips_by_route,
+            "stops_by_trip": stops_by_trip,
+            "missing": {
+                "route_ids": [i for i in route_ids if i not in routes],
+                "trip_ids": [i for i in trip_ids if i not in trips],
+                "stop_ids": [i for i in stop_ids if i not in stops],
+            },
         }
 
 
@@ -859,37 +4174,46 @@ class FavouriteItem(Resource):
 viz_ns = Namespace('viz', description='Visualisation & Export')
 api.add_namespace(viz_ns, path='/viz')
 
-def _pick_one_trip_for_route(agency_key: str, route_id: str) -> Optional[str]:
-    """Pick a representative trip of a route."""
-    t = (g.db.query(Trip)
-         .filter(Trip.agency_key == agency_key, Trip.route_id == route_id)
+_plot_modules = None
+
+def _plotting():
+    """(pyplot, pyproj.Transformer), imported on first use with the Agg backend selected."""
+    global _plot_modules
+    if _plot_modules is None:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        from pyproj import Transformer
+        _plot_modules = (plt, Transformer)
+    return _plot_modules
+
+def _pick_one_trip_for_route(agency_key: str, route_id: str) -> Optional[int]:
+    """Pick a representative trip of a route; returns its surrogate key."""
+    t = (_gtfs_db(agency_key).query(Trip.id)
+         .filter(Trip.agency_pk == _agency_pks_by_key[agency_key], Trip.route_id == route_id)
          .order_by(Trip.trip_id.asc()).first())
-    return t.trip_id if t else None
+    return t.id if t else None
 
-def _coords_for_trip(agency_key: str, trip_id: str):
+def _coords_for_trip(agency_key: str, trip_pk: int):
     """Return ordered (lon, lat, stop_name, stop_id, seq) for a trip."""
-    sts = (g.db.query(StopTime.stop_id, StopTime.stop_sequence)
-           .filter(StopTime.agency_key == agency_key,
-                   StopTime.trip_id == trip_id)
-           .order_by(StopTime.stop_sequence.asc())
-           .all())
-    if not sts:
-        return []
-
-    stop_ids = [sid for sid, _ in sts]
-    stops_map = {s.stop_id: s for s in g.db.query(Stop)
-                 .filter(Stop.agency_key == agency_key,
-                         Stop.stop_id.in_(stop_ids)).all()}
-    coords = []
-    for sid, seq in sts:
-        s = stops_map.get(sid)
-        if s and s.stop_lat is not None and s.stop_lon is not None:
-            coords.append((s.stop_lon, s.stop_lat, s.stop_name, s.stop_id, seq))
-    return coords
+    rows = (_gtfs_db(agency_key).query(Stop.stop_lon, Stop.stop_lat, Stop.stop_name, Stop.stop_id, StopTime.stop_sequence)
+            .join(Stop, Stop.id == StopTime.stop_pk)
+            .filter(StopTime.trip_pk == trip_pk)
+            .order_by(StopTime.stop_sequence.asc())
+            .all())
+    return [tuple(r) for r in rows if r.stop_lat is not None and r.stop_lon is not None]
+
+def _map_response(data: bytes, fmt: str):
+    if fmt == "csv":
+        resp = make_response(data)
+        resp.headers["Content-Type"] = "text/csv; charset=utf-8"
+        resp.headers["Content-Disposition"] = "inline; filename=favourites.csv"
+        return resp
+    return send_file(io.BytesIO(data), mimetype="image/png", as_attachment=False)
 
 @viz_ns.route("/map")
 class FavouriteMap(Resource):
-    @require_auth(roles=('admin','planner','commuter'))
+    @require_auth(roles=('admin','planner','commuter'), limit="render")
     @viz_ns.doc(
         summary="Generate a map for my favorite routes",
         description=(
@@ -905,6 +4229,7 @@ class FavouriteMap(Resource):
     @viz_ns.produces(['image/png', 'text/csv'])
     @viz_ns.response(200, 'OK (PNG or CSV)')
     @viz_ns.response(204, 'No content (user has no favorites)')
+    @viz_ns.response(429, 'Render rate limit or concurrency cap reached (see Retry-After)', error_model)
     def get(self):
         u = _current_user()
         fmt = (request.args.get("format") or "png").lower()
@@ -922,17 +4247,24 @@ class FavouriteMap(Resource):
                 return {"error": "no favourites found; add some via /favorites"}, 400
             pairs = [(f.agency_key, f.route_id) for f in favs]
 
+        # keyed by what is drawn, not by who asked: users with the same favourites share renders
+        size = [] if fmt == "csv" else [request.args.get(k) or "" for k in ("width", "height", "dpi", "lw")]
+        key = _cache_key("viz", sorted({ak for ak, _ in pairs}), [fmt, sorted(pairs), size])
+        data = _cache_get("viz", key)
+        if data is not None:
+            return _map_response(data, fmt)
+
         series = []
         titles = []
         for ak, rid in pairs:
             if not _ensure_imported(ak):
                 continue
-            trip_id = _pick_one_trip_for_route(ak, rid)
-            if not trip_id:
+            trip_pk = _pick_one_trip_for_route(ak, rid)
+            if not trip_pk:
                 continue
-            coords = _coords_for_trip(ak, trip_id)
+            coords = _coords_for_trip(ak, trip_pk)
             if coords:
-                rinfo = g.db.query(Route).filter(Route.agency_key == ak, Route.route_id == rid).first()
+                rinfo = _gtfs_db(ak).query(Route).filter(Route.agency_pk == _agency_pks_by_key[ak], Route.route_id == rid).first()
                 title = (rinfo.route_short_name or rid) if rinfo else rid
                 series.append((ak, rid, coords, title))
                 titles.append(title)
@@ -948,10 +4280,9 @@ class FavouriteMap(Resource):
             for ak, rid, coords, _ in series:
                 for lon, lat, name, sid, seq in coords:
                     writer.writerow([ak.split(":",1)[1], rid, seq, sid, name or "", f"{lon:.6f}", f"{lat:.6f}"])
-            resp = make_response(out.getvalue())
-            resp.headers["Content-Type"] = "text/csv; charset=utf-8"
-            resp.headers["Content-Disposition"] = "inline; filename=favourites.csv"
-            return resp
+            data = out.getvalue().encode()
+            _cache_set("viz", key, data)
+            return _map_response(data, fmt)
 
         # PNG drawing
                 # PNG drawing —— white background, fast; draw polyline + start/end only
@@ -965,6 +4296,8 @@ class FavouriteMap(Resource):
 
         # inches for matplotlib
         figsize = (width / dpi, height / dpi)
+        render_t0 = time.perf_counter()
+        plt, Transformer = _plotting()
 
         fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
         fig.patch.set_facecolor("white")
@@ -1022,14 +4355,646 @@ class FavouriteMap(Resource):
         fig.subplots_adjust(left=0, right=1, top=1, bottom=0)
         fig.savefig(buf, format="png")
         plt.close(fig)
-        buf.seek(0)
-        return send_file(buf, mimetype="image/png", as_attachment=False)
+        _add_span("render", time.perf_counter() - render_t0)
+        _cache_set("viz", key, buf.getvalue())
+        return _map_response(buf.getvalue(), fmt)
+
+
+# -----------------------------
+# Planner analytics: headways, service span, stop coverage
+# -----------------------------
+analytics_ns = Namespace('analytics', description='Planner analytics (headways, service span, stop coverage)')
+api.add_namespace(analytics_ns, path='/analytics')
+
+ANALYTICS_REPORTS = ("headways", "service-span", "stops")
+ANALYTICS_FORMATS = {"json": "application/json", "csv": "text/csv; charset=utf-8",
+                     "parquet": "application/vnd.apache.parquet"}
+ANALYTICS_MEMO_ENTRIES = int(os.getenv("ANALYTICS_MEMO_ENTRIES", "8"))   # agencies' analyses kept per process
+
+_analytics_memo = OrderedDict()   # (agency key, import marker) -> {report: DataFrame}
+_analytics_lock = threading.Lock()   # guards _analytics_memo and _analyses, never held while analyzing
+_analyses = {}                       # (agency key, import marker) -> lock of an analysis in progress
+
+analytics_parser = RequestParser(bundle_errors=True)
+analytics_parser.add_argument("agency", type=str, required=True, help="Agency id, e.g. GSBC001 (one agency).")
+analytics_parser.add_argument("format", type=str, choices=tuple(ANALYTICS_FORMATS), default="json",
+                              help="json (default), csv or parquet (needs pyarrow).")
+analytics_parser.add_argument("route_id", type=str, help="Only this route (headways, service-span).")
+analytics_parser.add_argument("service_id", type=str, help="Only this service (headways, service-span).")
+
+def _import_marker(agency_key: str) -> str:
+    """Changes whenever the agency's data does: the snapshot version, or its last import time."""
+    if snapshot is not None:
+        return snapshot["version"]
+    mode, agency_id = agency_key.split(":", 1)
+    imported_at = (g.db.query(Agency.imported_at)
+                   .filter(Agency.mode == mode, Agency.agency_id == agency_id).scalar())
+    return imported_at.isoformat() if imported_at else ""
+
+def _extract(db, stmt, columns, numeric: bool = False):
+    """One SELECT as a DataFrame, read through the DBAPI cursor: no ORM entities or Row objects
+    per row (about 3x faster for stop_times). `numeric` columns become one float array at once."""
+    import numpy as np, pandas as pd
+    compiled = stmt.compile(dialect=db.get_bind().dialect)
+    params = [compiled.params[k] for k in compiled.positiontup] if compiled.positiontup else compiled.params
+    cur = db.connection().connection.cursor()
+    try:
+        cur.execute(str(compiled), params)
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    if numeric:
+        return pd.DataFrame(np.array(rows, dtype=float).reshape(-1, len(columns)), columns=columns)
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+def _hhmmss(secs):
+    """A Series of seconds after midnight as 'HH:MM:SS' (None where missing)."""
+    return secs.map(lambda v: None if v != v else _gtfs_time(int(v)))
+
+def _analyze_agency(agency_key: str) -> dict:
+    """All reports of one agency as DataFrames, from columnar extracts of trips/stop_times/stops.
+
+    Every step is a vectorized pandas/NumPy operation over whole columns: trip start = first
+    departure, headway = gap to the previous start of the same route, direction and service,
+    hour = start // 3600 (may pass 23 for after-midnight service).
+    """
+    import numpy as np, pandas as pd
+    db, pk = _gtfs_db(agency_key), _agency_pks_by_key[agency_key]
+    with span("extract"):
+        trips = _extract(db, select(Trip.id, Trip.route_id, Trip.direction_id, Trip.service_id)
+                         .where(Trip.agency_pk == pk), ["trip_pk", "route_id", "direction_id", "service_id"])
+        st = _extract(db, select(StopTime.trip_pk, StopTime.stop_pk, StopTime.departure_secs)
+                      .where(StopTime.trip_pk.in_(select(Trip.id).where(Trip.agency_pk == pk))),
+                      ["trip_pk", "stop_pk", "departure"], numeric=True)
+        stops = _extract(db, select(Stop.id, Stop.stop_id, Stop.stop_name, Stop.stop_lat, Stop.stop_lon)
+                         .where(Stop.agency_pk == pk), ["stop_pk", "stop_id", "stop_name", "stop_lat", "stop_lon"])
+    with span("analyze"):
+        trips["direction_id"] = trips["direction_id"].fillna(0).astype("int64")
+        st = st.astype({"trip_pk": "int64", "stop_pk": "int64"})
+        trips = trips.join(st.groupby("trip_pk")["departure"].min().rename("start"), on="trip_pk")
+        trips = trips.dropna(subset=["start"]).sort_values(["route_id", "direction_id", "service_id", "start"])
+        group = ["route_id", "direction_id", "service_id"]
+        same = (trips[group] == trips[group].shift()).all(axis=1)
+        trips["headway"] = trips["start"].diff().where(same) / 60
+        trips["hour"] = (trips["start"] // 3600).astype("int64")
+
+        headways = (trips.groupby(group + ["hour"])
+                    .agg(trips=("trip_pk", "size"), median_headway_mins=("headway", "median"),
+                         min_headway_mins=("headway", "min"), max_headway_mins=("headway", "max"))
+                    .reset_index())
+
+        per_hour = trips.groupby(group + ["hour"]).size().groupby(group).max().rename("peak_trips_per_hour")
+        span_ = trips.groupby(group).agg(trips=("trip_pk", "size"), first=("start", "min"), last=("start", "max"),
+                                         median_headway_mins=("headway", "median")).join(per_hour)
+        span_["span_hours"] = (span_["last"] - span_["first"]) / 3600
+        span_["first_departure"], span_["last_departure"] = _hhmmss(span_["first"]), _hhmmss(span_["last"])
+        service_span = span_.reset_index()[group + ["trips", "first_departure", "last_departure", "span_hours",
+                                                    "peak_trips_per_hour", "median_headway_mins"]]
+
+        calls = st.dropna(subset=["departure"]).merge(trips[["trip_pk", "route_id"]], on="trip_pk")
+        calls["hour"] = (calls["departure"] // 3600).astype("int64")
+        by_stop = calls.groupby("stop_pk").agg(trips=("trip_pk", "nunique"), routes=("route_id", "nunique"),
+                                               first=("departure", "min"), last=("departure", "max"))
+        busiest = (calls.groupby(["stop_pk", "hour"]).size().rename("peak_hour_trips").reset_index()
+                   .sort_values(["stop_pk", "peak_hour_trips", "hour"], ascending=[True, False, True])
+                   .drop_duplicates("stop_pk").set_index("stop_pk").rename(columns={"hour": "peak_hour"}))
+        coverage = stops.join(by_stop, on="stop_pk").join(busiest, on="stop_pk")
+        for col in ("trips", "routes", "peak_hour_trips"):
+            coverage[col] = coverage[col].fillna(0).astype("int64")
+        coverage["peak_hour"] = coverage["peak_hour"].astype("Int64")
+        coverage["first_departure"], coverage["last_departure"] = _hhmmss(coverage["first"]), _hhmmss(coverage["last"])
+        coverage = coverage.sort_values("stop_id")[["stop_id", "stop_name", "stop_lat", "stop_lon", "trips", "routes",
+                                                    "first_departure", "last_departure", "peak_hour", "peak_hour_trips"]]
+        for frame in (headways, service_span):
+            for col in frame.columns:
+                if col.endswith("_mins") or col == "span_hours":
+                    frame[col] = frame[col].round(2)
+    return {"headways": headways, "service-span": service_span, "stops": coverage.reset_index(drop=True)}
+
+def _agency_analysis(agency_key: str) -> dict:
+    """_analyze_agency() memoized per import: every report and format of one import shares one pass."""
+    memo_key = (agency_key, _import_marker(agency_key))
+
+    def memoized():
+        with _analytics_lock:
+            reports = _analytics_memo.get(memo_key)
+            if reports is not None:
+                _analytics_memo.move_to_end(memo_key)
+            return reports
+    reports = memoized()
+    if reports is None:
+        # a second request for this import waits and reuses the analysis; other agencies run alongside
+        with _keyed_lock(_analyses, _analytics_lock, memo_key):
+            reports = memoized()
+            if reports is None:
+                reports = _analyze_agency(agency_key)
+                with _analytics_lock:
+                    for key in [k for k in _analytics_memo if k[0] == agency_key]:
+                        del _analytics_memo[key]   # an older import of the same agency
+                    _analytics_memo[memo_key] = reports
+                    while len(_analytics_memo) > ANALYTICS_MEMO_ENTRIES:
+                        _analytics_memo.popitem(last=False)
+    return reports
+
+def _report_summary(report: str, frame) -> dict:
+    if report == "stops":
+        served = int((frame["trips"] > 0).sum())
+        return {"stops": len(frame), "served": served, "unserved": len(frame) - served,
+                "served_pct": round(100 * served / len(frame), 1) if len(frame) else None}
+    return {"routes": int(frame["route_id"].nunique()), "trips": int(frame["trips"].sum())}
+
+def _export_report(agency_key: str, report: str, frame, fmt: str) -> bytes:
+    if fmt == "csv":
+        return frame.to_csv(index=False).encode()
+    if fmt == "parquet":
+        buf = io.BytesIO()
+        frame.to_parquet(buf, index=False)
+        return buf.getvalue()
+    rows = frame.astype(object).where(frame.notna(), None).to_dict("records")
+    return _json_dumps({"agency": agency_key, "report": report, "summary": _report_summary(report, frame),
+                        "columns": list(frame.columns), "rows": rows})
+
+def _report_response(agency_key: str, report: str, data: bytes, fmt: str):
+    resp = current_app.response_class(data, content_type=ANALYTICS_FORMATS[fmt])
+    if fmt != "json":
+        name = f"{agency_key.split(':', 1)[1]}_{report}.{fmt}"
+        resp.headers["Content-Disposition"] = f"attachment; filename={name}"
+    return resp
+
+@analytics_ns.route('/<string:report>')
+@analytics_ns.param("report", "headways | service-span | stops")
+class AnalyticsReport(Resource):
+    @require_auth(roles=('admin', 'planner'), limit="analytics")
+    @analytics_ns.expect(analytics_parser)
+    @analytics_ns.produces(list(ANALYTICS_FORMATS.values()))
+    @analytics_ns.response(200, "OK (JSON, CSV or Parquet)")
+    @analytics_ns.response(400, "Invalid query", error_model)
+    @analytics_ns.response(404, "Unknown report / agency not imported", error_model)
+    @analytics_ns.response(429, "Analytics concurrency cap reached (see Retry-After)", error_model)
+    @analytics_ns.response(501, "format=parquet without pyarrow", error_model)
+    @analytics_ns.doc(
+        summary="Agency-wide service analytics",
+        description=(
+            "**Role:** Admin, Planner. Query: `agency` (one id), `format=json|csv|parquet`, and for "
+            "`headways`/`service-span` optionally `route_id`, `service_id`.\n\n"
+            "- `headways`: trips and median/min/max headway per route, direction, service and hour.\n"
+            "- `service-span`: first/last departure, span, peak trips per hour per route, direction, service.\n"
+            "- `stops`: per stop trips, routes, first/last departure and busiest hour; the summary counts "
+            "served and unserved stops.\n\n"
+            "Computed over the whole agency at once and kept until its next import."
+        ),
+    )
+    def get(self, report):
+        if report not in ANALYTICS_REPORTS:
+            return {"error": f"Unknown report; use one of: {', '.join(ANALYTICS_REPORTS)}"}, 404
+        fmt = (request.args.get("format") or "json").lower()
+        if fmt not in ANALYTICS_FORMATS:
+            return {"error": f"format must be one of: {', '.join(ANALYTICS_FORMATS)}"}, 400
+        agency_keys, err = _agency_keys_from_query()
+        if err:
+            code, body = err
+            return body, code
+        if len(agency_keys) != 1:
+            return {"error": "query parameter 'agency' must name one agency"}, 400
+        agency_key = agency_keys[0]
+        key = _cache_key("analytics", agency_keys, [report, _request_parts("agency")])
+        data = _cache_get("analytics", key)
+        if data is not None:
+            return _report_response(agency_key, report, data, fmt)
+        frame = _agency_analysis(agency_key)[report]
+        if report != "stops":
+            for col in ("route_id", "service_id"):
+                if request.args.get(col):
+                    frame = frame[frame[col] == request.args[col]]
+        with span("export"):
+            try:
+                data = _export_report(agency_key, report, frame, fmt)
+            except ImportError:
+                return {"error": "format=parquet needs pyarrow (pip install pyarrow)"}, 501
+        _cache_set("analytics", key, data)
+        return _report_response(agency_key, report, data, fmt)
+
+
+# -----------------------------
+# Reachability: stops reachable from a stop within a time budget
+# -----------------------------
+REACH_BUCKET_MINS = int(os.getenv("REACH_BUCKET_MINS", "15"))      # departures sharing one profile search
+REACH_MAX_MINUTES = int(os.getenv("REACH_MAX_MINUTES", "120"))     # largest max_minutes; every profile covers it
+REACH_TIMETABLES = int(os.getenv("REACH_TIMETABLES", "4"))         # agencies' timetables kept per process
+REACH_PROFILE_ENTRIES = int(os.getenv("REACH_PROFILE_ENTRIES", "512"))
+REACH_FORMATS = {"json": "application/json", "geojson": "application/geo+json", "png": "image/png"}
+REACH_PNG_PX = (100, 4000)    # format=png: allowed width and height in pixels
+REACH_PNG_DPI = (50, 300)
+
+_timetables = OrderedDict()       # (agency key, import marker) -> _Timetable
+_reach_profiles = OrderedDict()   # (agency key, import marker, stop, service, bucket) -> profile
+_timetable_lock = threading.Lock()   # guards _timetables and _timetable_loads, never held while loading
+_timetable_loads = {}                # (agency key, import marker) -> lock of a load in progress
+_profile_lock = threading.Lock()
+
+reach_parser = RequestParser(bundle_errors=True)
+reach_parser.add_argument("agency", type=str, help="Agency id, e.g. GSBC001 (optional, as for /gtfs/stops/<id>).")
+reach_parser.add_argument("depart", type=str, default="08:00:00", help="Departure time HH:MM[:SS] (default 08:00:00).")
+reach_parser.add_argument("max_minutes", type=int, default=30,
+                          help=f"Travel time budget in minutes, 1-{REACH_MAX_MINUTES} (default 30).")
+reach_parser.add_argument("service_id", type=str, help="Service to travel on (default: the one with the most trips).")
+reach_parser.add_argument("format", type=str, choices=tuple(REACH_FORMATS), default="json",
+                          help="json (default), geojson, or png rendered like /viz/map.")
+reach_parser.add_argument("width", type=int, help="PNG width in pixels, 100-4000 (default 1000)")
+reach_parser.add_argument("height", type=int, help="PNG height in pixels, 100-4000 (default 600)")
+reach_parser.add_argument("dpi", type=int, help="PNG DPI, 50-300 (default 120)")
+
+@contextmanager
+def _keyed_lock(locks: dict, guard, key):
+    """Hold the lock for `key` in `locks` (made on first use, dropped when nobody holds or waits
+    for it), so concurrent callers for one key run one at a time and other keys are not held up.
+    `guard` protects `locks` and is only held briefly."""
+    with guard:
+        entry = locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del locks[key]
+
+def _remember_timetable(memo_key: tuple, timetable: "_Timetable"):
+    with _timetable_lock:
+        for key in [k for k in _timetables if k[0] == memo_key[0] and k != memo_key]:
+            del _timetables[key]   # an older import of the same agency
+        _timetables[memo_key] = timetable
+        _timetables.move_to_end(memo_key)
+        while len(_timetables) > REACH_TIMETABLES:
+            _timetables.popitem(last=False)
+
+def _agency_timetable(agency_key: str, marker: str) -> "_Timetable":
+    """The agency's _Timetable for this import: built by the import in this process, else loaded once."""
+    memo_key = (agency_key, marker)
+
+    def memoized():
+        with _timetable_lock:
+            timetable = _timetables.get(memo_key)
+            if timetable is not None:
+                _timetables.move_to_end(memo_key)
+            return timetable
+    timetable = memoized()
+    if timetable is None:
+        # concurrent first requests for this import wait for one load; other agencies are not held up
+        with _keyed_lock(_timetable_loads, _timetable_lock, memo_key):
+            timetable = memoized()
+            if timetable is None:
+                with span("timetable"):
+                    timetable = _Timetable.load(agency_key)
+                _remember_timetable(memo_key, timetable)
+    return timetable
+
+def _reach_profile(memo_key: tuple, timetable: "_Timetable", stop: int, service: str, bucket: int) -> dict:
+    """The profile of departures from `stop` in one REACH_BUCKET_MINS bucket, memoized: it answers
+    every departure time in the bucket and every budget up to REACH_MAX_MINUTES."""
+    key = memo_key + (stop, service, bucket)
+    with _profile_lock:
+        labels = _reach_profiles.get(key)
+        if labels is not None:
+            _reach_profiles.move_to_end(key)
+            return labels
+    start = bucket * REACH_BUCKET_MINS * 60
+    with span("scan"):   # outside the lock: searches for different stops run side by side
+        labels = timetable.profile(service, stop, start, start + (REACH_BUCKET_MINS + REACH_MAX_MINUTES) * 60)
+    with _profile_lock:
+        _reach_profiles[key] = labels
+        while len(_reach_profiles) > REACH_PROFILE_ENTRIES:
+            _reach_profiles.popitem(last=False)
+    return labels
+
+def _parse_depart(raw: str) -> Optional[int]:
+    parts = raw.strip().split(":")
+    if len(parts) == 2:
+        parts.append("0")
+    try:
+        h, m, sec = (int(p) for p in parts)
+    except ValueError:
+        return None
+    if len(parts) != 3 or h < 0 or not 0 <= m < 60 or not 0 <= sec < 60:
+        return None
+    return h * 3600 + m * 60 + sec
+
+def _reach_limit() -> str:
+    return "render" if (request.args.get("format") or "").lower() == "png" else "read"
+
+def _reach_features(timetable: "_Timetable", hits) -> list:
+    """Reached stops as dicts, soonest first; `hits` is [(stop, source departure, arrival, minutes)]."""
+    import numpy as np
+    out = []
+    for stop, departure, arrival, minutes in sorted(hits, key=lambda h: (h[2], timetable.stop_ids[h[0]] or "")):
+        lat, lon = timetable.stop_lats[stop], timetable.stop_lons[stop]
+        out.append({"stop_id": timetable.stop_ids[stop], "stop_name": timetable.stop_names[stop],
+                    "stop_lat": None if np.isnan(lat) else float(lat), "stop_lon": None if np.isnan(lon) else float(lon),
+                    "departure": _gtfs_time(departure), "arrival": _gtfs_time(arrival), "minutes": minutes})
+    return out
+
+def _reach_geojson(body: dict) -> dict:
+    features = [{"type": "Feature", "geometry": {"type": "Point", "coordinates": [s["stop_lon"], s["stop_lat"]]},
+                 "properties": {k: v for k, v in s.items() if k not in ("stop_lat", "stop_lon")}}
+                for s in body["stops"] if s["stop_lat"] is not None and s["stop_lon"] is not None]
+    meta = {k: v for k, v in body.items() if k != "stops"}
+    return {"type": "FeatureCollection", "properties": meta, "features": features}
+
+def _reach_png(timetable: "_Timetable", body: dict, width: int, height: int, dpi: int) -> bytes:
+    """Reached stops coloured by minutes over every stop of the agency in grey, like /viz/map."""
+    import numpy as np
+    plt, Transformer = _plotting()
+    to3857 = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+    fig, ax = plt.subplots(figsize=(width / dpi, height / dpi), dpi=dpi)
+    fig.patch.set_facecolor("white")
+    ax.set_facecolor("white")
+    known = ~np.isnan(timetable.stop_lats) & ~np.isnan(timetable.stop_lons)
+    gx, gy = to3857.transform(timetable.stop_lons[known], timetable.stop_lats[known])
+    ax.scatter(gx, gy, s=4, color="#d0d0d0", zorder=1)
+    reached = [s for s in body["stops"] if s["stop_lat"] is not None and s["stop_lon"] is not None]
+    if reached:
+        xs, ys = to3857.transform([s["stop_lon"] for s in reached], [s["stop_lat"] for s in reached])
+        points = ax.scatter(xs, ys, s=14, c=[s["minutes"] for s in reached], cmap="viridis_r",
+                            vmin=0, vmax=body["max_minutes"], zorder=2)
+        fig.colorbar(points, ax=ax, fraction=0.03, pad=0.01, label="minutes")
+        origin = body["stop"]
+        if origin["stop_lat"] is not None and origin["stop_lon"] is not None:
+            ox, oy = to3857.transform(origin["stop_lon"], origin["stop_lat"])
+            ax.scatter([ox], [oy], s=120, marker="*", color="crimson", zorder=3)
+            ax.annotate(origin["stop_name"] or origin["stop_id"], (ox, oy), xytext=(4, 4),
+                        textcoords="offset points", fontsize=8, zorder=4)
+    ax.set_axis_off()
+    ax.set_title(f"Reachable in {body['max_minutes']} min from {body['stop']['stop_id']} "
+                 f"at {body['depart']} ({body['service_id']})", fontsize=9)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+@gtfs_ns.route('/stops/<string:stop_id>/reachable')
+class StopReachable(Resource):
+    @require_auth(roles=('admin', 'planner', 'commuter'), limit=_reach_limit)
+    @gtfs_ns.expect(reach_parser)
+    @gtfs_ns.produces(list(REACH_FORMATS.values()))
+    @gtfs_ns.response(200, "OK (JSON, GeoJSON or PNG)")
+    @gtfs_ns.response(400, "Invalid query", error_model)
+    @gtfs_ns.response(404, "Agency not imported / stop not found", error_model)
+    @gtfs_ns.response(409, "Stop id exists in several agencies", error_model)
+    @gtfs_ns.response(429, "Render rate limit reached for format=png (see Retry-After)", error_model)
+    @gtfs_ns.doc(
+        summary="Stops reachable from a stop within a time budget",
+        description=(
+            "**Role:** All users. Query: `depart` (HH:MM[:SS], default 08:00:00), `max_minutes` "
+            f"(1-{REACH_MAX_MINUTES}, default 30), `service_id` (default: the service with the most trips), "
+            "`agency` (optional), `format=json|geojson|png` (PNG counts against the render limit).\n\n"
+            "Each reached stop has the earliest `arrival`, the latest `departure` from this stop that "
+            "still makes it, and `minutes` from `depart`. Transfers are between trips at the same stop, "
+            "with no walking between stops."
+        ),
+    )
+    def get(self, stop_id):
+        fmt = (request.args.get("format") or "json").lower()
+        if fmt not in REACH_FORMATS:
+            return {"error": f"format must be one of: {', '.join(REACH_FORMATS)}"}, 400
+        depart = _parse_depart(request.args.get("depart") or "08:00:00")
+        if depart is None:
+            return {"error": "depart must be HH:MM or HH:MM:SS"}, 400
+        try:
+            max_minutes = int(request.args.get("max_minutes") or 30)
+            size = [int(request.args.get(k) or d) for k, d in (("width", 1000), ("height", 600), ("dpi", 120))]
+        except ValueError:
+            return {"error": "max_minutes, width, height and dpi must be integers"}, 400
+        if not 1 <= max_minutes <= REACH_MAX_MINUTES:
+            return {"error": f"max_minutes must be between 1 and {REACH_MAX_MINUTES}"}, 400
+        (lo, hi), (dpi_lo, dpi_hi) = REACH_PNG_PX, REACH_PNG_DPI
+        if not (lo <= size[0] <= hi and lo <= size[1] <= hi):
+            return {"error": f"width and height must be between {lo} and {hi}"}, 400
+        if not dpi_lo <= size[2] <= dpi_hi:
+            return {"error": f"dpi must be between {dpi_lo} and {dpi_hi}"}, 400
+        found, err = _lookup_item("stops", stop_id)
+        if err:
+            code, body = err
+            return body, code
+        agency_key, _, row = found
+        key = _cache_key("reachable", [agency_key], [stop_id, _request_parts("agency")])
+        data = _cache_get("reachable", key)
+        if data is not None:
+            return current_app.response_class(data, content_type=REACH_FORMATS[fmt])
+
+        memo_key = (agency_key, _import_marker(agency_key))
+        timetable = _agency_timetable(agency_key, memo_key[1])
+        service = request.args.get("service_id") or timetable.default_service
+        if service is None:
+            return {"error": "Agency has no timetabled trips"}, 404
+        if service not in timetable.services:
+            return {"error": f"Unknown service_id; use one of: {', '.join(sorted(timetable.services))}"}, 400
+        stop = timetable.stop_index(row.id)
+        labels = _reach_profile(memo_key, timetable, stop, service, depart // (REACH_BUCKET_MINS * 60))
+        hits = [(s, sd, arr, round((arr - depart) / 60, 1))
+                for s, sd, arr in timetable.reachable(labels, depart, max_minutes * 60)]
+        origin = _reach_features(timetable, [(stop, depart, depart, 0.0)])[0]
+        body = {"agency": agency_key, "stop": {k: origin[k] for k in ("stop_id", "stop_name", "stop_lat", "stop_lon")},
+                "depart": _gtfs_time(depart), "max_minutes": max_minutes, "service_id": service,
+                "count": len(hits), "stops": _reach_features(timetable, hits)}
+        if fmt == "png":
+            render_t0 = time.perf_counter()
+            data = _reach_png(timetable, body, *size)
+            _add_span("render", time.perf_counter() - render_t0)
+        else:
+            with span("encode"):
+                data = _json_dumps(_reach_geojson(body) if fmt == "geojson" else body)
+        _cache_set("reachable", key, data)
+        return current_app.response_class(data, content_type=REACH_FORMATS[fmt])
 
 
 api.add_namespace(fav_ns, path="/favorites")
 
 
+# -----------------------------------------------------------------------------
+# CLI
+# -----------------------------------------------------------------------------
+@core.cli.command("init-db")
+@click.option("--reset-gtfs", is_flag=True,
+              help="Drop GTFS tables built for an older schema (agencies must then be re-imported).")
+def init_db_command(reset_gtfs):
+    """Create or upgrade the schema and seed the default users (idempotent)."""
+    t0 = time.perf_counter()
+    try:
+        init_db(reset_gtfs)
+    except SchemaOutdated as e:
+        raise click.ClickException(str(e))
+    click.echo(f"database ready ({engine.url.render_as_string(hide_password=True)}) in {time.perf_counter() - t0:.2f}s")
+
+@core.cli.command("db-stats")
+def db_stats_command():
+    """Print the on-disk size of every table and index (SQLite, via the dbstat table), and of each
+    agency's shard file when GTFS_SHARD_DIR is set."""
+    if engine.dialect.name != "sqlite":
+        raise click.ClickException("db-stats reads SQLite's dbstat table")
+    if snapshot_dir is not None:
+        _sync_snapshot()
+    with engine.connect() as conn:
+        try:
+            sizes = conn.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC")).all()
+        except Exception as e:
+            raise click.ClickException(f"dbstat unavailable in this SQLite build: {e}")
+        kinds = dict(conn.execute(text("SELECT name, type FROM sqlite_master")).all())
+    total = sum(n for _, n in sizes)
+    for name, n in sizes:
+        click.echo(f"{name:<36} {kinds.get(name, 'table'):<6} {n / 1024:>10.0f} KB")
+    click.echo(f"{'total':<43} {total / 1024:>10.0f} KB")
+    if shard_dir is not None:
+        shards = [(key, _shard_path(key).stat().st_size) for key in _shard_keys()]
+        for key, n in shards:
+            click.echo(f"{key:<36} {'shard':<6} {n / 1024:>10.0f} KB")
+        click.echo(f"{f'shards ({shard_dir})':<43} {sum(n for _, n in shards) / 1024:>10.0f} KB")
+
+@core.cli.command("drop-agency")
+@click.argument("agency_ids", nargs=-1, required=True)
+def drop_agency_command(agency_ids):
+    """Delete the imported GTFS data of bus agencies (with shards, just their files)."""
+    unknown = [a for a in agency_ids if a not in GTFS_VALID.get('buses', [])]
+    if unknown:
+        raise click.BadParameter(f"unknown agency: {', '.join(unknown)}", param_hint="AGENCY_IDS")
+    if _read_only_error():
+        raise click.ClickException(_read_only_error()[1]["error"])
+    ensure_db()
+    with SessionLocal() as db:
+        for agency_id in agency_ids:
+            n = _drop_agency_data(db, f"buses:{agency_id}")
+            click.echo(f"buses:{agency_id} dropped" + ("" if shard_dir is not None else f" ({n} rows)"))
+
+@core.cli.command("snapshot-export")
+@click.option("--out", "out_dir", type=click.Path(file_okay=False), default="snapshots", show_default=True,
+              help="Directory for the archive.")
+def snapshot_export_command(out_dir):
+    """Package every imported agency into a versioned, compressed, read-only snapshot archive."""
+    ensure_db()
+    t0 = time.perf_counter()
+    with SessionLocal() as db:
+        try:
+            path, manifest = _export_snapshot(db, out_dir)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    data = sum(a["bytes"] for a in manifest["agencies"].values())
+    click.echo(f"{path}  version={manifest['version']} agencies={len(manifest['agencies'])} "
+               f"db={data / 1e6:.1f} MB archive={path.stat().st_size / 1e6:.1f} MB in {time.perf_counter() - t0:.1f}s")
+
+@core.cli.command("snapshot-pull")
+@click.argument("source")
+@click.option("--activate", is_flag=True, help="Serve the new version right away.")
+def snapshot_pull_command(source, activate):
+    """Fetch a snapshot archive (URL or path) into GTFS_SNAPSHOT_DIR and verify it."""
+    if snapshot_dir is None:
+        raise click.ClickException("set GTFS_SNAPSHOT_DIR to pull snapshots")
+    t0 = time.perf_counter()
+    try:
+        manifest = _pull_snapshot(source)
+        if activate:
+            _activate_snapshot(manifest["version"])
+    except (ValueError, RuntimeError, OSError) as e:
+        raise click.ClickException(str(e))
+    dropped = _prune_snapshots()
+    click.echo(f"snapshot {manifest['version']} ready in {time.perf_counter() - t0:.1f}s"
+               + (" (active)" if activate else "") + (f"; pruned {', '.join(dropped)}" if dropped else ""))
+
+@core.cli.command("snapshot-activate")
+@click.argument("version")
+def snapshot_activate_command(version):
+    """Switch this node's workers to an unpacked snapshot version (no restart needed)."""
+    if snapshot_dir is None:
+        raise click.ClickException("set GTFS_SNAPSHOT_DIR to serve snapshots")
+    try:
+        _activate_snapshot(version)
+    except (FileNotFoundError, ValueError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"serving snapshot {version}")
+
+@core.cli.command("import-bulk")
+@click.option("--agency", "agencies", multiple=True, help="Agency id (repeatable); default: every bus agency.")
+@click.option("--source-dir", type=click.Path(exists=True, file_okay=False), default=None,
+              help="Read <agency_id>.zip from this directory instead of downloading from TfNSW.")
+@click.option("--synthetic", type=float, default=None, metavar="SCALE",
+              help="Generate synthetic feeds of this scale instead of downloading (see gtfs_synth.py).")
+@click.option("--seed", default=0, show_default=True, help="Seed for --synthetic.")
+@click.option("--fetchers", default=4, show_default=True, help="Concurrent downloads.")
+@click.option("--parsers", default=None, type=int, help="Parser processes (default: CPU count).")
+@click.option("--json", "as_json", is_flag=True, help="Print the full report as JSON.")
+def import_bulk_command(agencies, source_dir, synthetic, seed, fetchers, parsers, as_json):
+    """Import several GTFS agencies concurrently and print a timing report."""
+    try:
+        agency_ids = _bulk_agency_ids('buses', agencies)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--agency")
+    if _read_only_error():
+        raise click.ClickException(_read_only_error()[1]["error"])
+    ensure_db()
+    with SessionLocal() as db:
+        report = _bulk_import(db, agency_ids, source_dir=source_dir, fetchers=fetchers, parsers=parsers,
+                              synthetic=synthetic, seed=seed)
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    for r in report["agencies"]:
+        click.echo(f"{r['agency']:<16} {r['status']:<6} bytes={r.get('bytes', 0):>10} "
+                   f"rows={sum((r.get('rows') or {}).values()):>9} fetch={r.get('fetch_s', 0):>7.2f}s "
+                   f"parse={r.get('parse_s', 0):>7.2f}s write={r.get('write_s', 0):>7.2f}s"
+                   + (f"  {r['error']}" if r.get('error') else ""))
+    click.echo(f"{report['ok']} ok, {report['failed']} failed in {report['wall_s']:.2f}s")
+
+
+
+
+# -----------------------------------------------------------------------------
+# App factory
+# -----------------------------------------------------------------------------
+def create_app(config: Optional[dict] = None) -> Flask:
+    """Build the Flask app; `config` overrides the environment-derived defaults.
+
+    The database engine is per process (see configure_database), so every app built in one
+    process shares it; forked workers get fresh connections automatically.
+    """
+    app = Flask(__name__)
+    app.config.update(
+        RESTX_MASK_SWAGGER=False,
+        JWT_SECRET_KEY=os.getenv("JWT_SECRET_KEY", "dev_change_me"),
+        JWT_HEADER_TYPE=None,
+        DATABASE_URL=os.getenv("DATABASE_URL", "sqlite:///app.sqlite"),
+        AUTO_INIT_DB=os.getenv("AUTO_INIT_DB", "1") != "0",  # False when `flask init-db` runs at deploy
+        FAST_JSON=os.getenv("FAST_JSON", "1") != "0",        # list endpoints: column tuples + orjson
+        GTFS_SHARD_DIR=os.getenv("GTFS_SHARD_DIR") or None,  # one SQLite file per agency (see _shard_engine)
+        GTFS_SNAPSHOT_DIR=os.getenv("GTFS_SNAPSHOT_DIR") or None,  # read node: serve snapshots (see _sync_snapshot)
+        CACHE_URL=os.getenv("CACHE_URL") or None,  # memory:// or redis://host:6379/0; unset: no caching
+        RATE_LIMIT_URL=os.getenv("RATE_LIMIT_URL") or None,  # redis://...: limits shared by all workers/nodes
+        ALLOW_SYNTHETIC_IMPORT=os.getenv("ALLOW_SYNTHETIC_IMPORT", "0") == "1",  # ?synthetic= / source=synthetic
+    )
+    app.config.update(config or {})
+    shards, snapshots = (Path(app.config[k]) if app.config[k] else None for k in ("GTFS_SHARD_DIR", "GTFS_SNAPSHOT_DIR"))
+    if (engine is None or engine.url.render_as_string(hide_password=False) != app.config["DATABASE_URL"]
+            or snapshot_dir != snapshots or (snapshots is None and shard_dir != shards)):
+        configure_database(app.config["DATABASE_URL"], shards, snapshots)
+    if app.config["CACHE_URL"] != cache_url:
+        configure_cache(app.config["CACHE_URL"])
+    if limiter is None or app.config["RATE_LIMIT_URL"] != limiter_url:
+        configure_limiter(app.config["RATE_LIMIT_URL"])
+    CORS(app)
+    jwt.init_app(app)
+    api.init_app(app)
+    app.register_blueprint(core)
+    return app
+
+
+def __getattr__(name):
+    # `api.app` (flask --app api, gunicorn api:app, bench.py) builds the default app on first access
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == '__main__':
+    app = create_app()
+    init_db()
     app.run(debug=True, port=5000)
@@ -0,0 +1,389 @@
+"""ASGI entry point: the I/O-bound GTFS endpoints on an event loop, everything else through Flask.
+
+    pip install uvicorn asgiref aiosqlite httpx
+    uvicorn asgi:app --workers 4 --port 8000
+
+Served natively (async DB access via SQLAlchemy asyncio + aiosqlite, async downloads via httpx):
+
+  GET  /gtfs/routes, /gtfs/stops, /gtfs/trips   same query parameters and JSON as the Flask handlers
+  POST /gtfs/import/<mode>/<agency_id>          imports from the TfNSW feed or `?url=`; the download
+                                                streams to the spool dir without blocking the loop and
+                                                parsing runs in a worker thread (which itself uses the
+                                                parser process pool). With `?async=1` or
+                                                `Prefer: respond-async` it answers 202 at once and the
+                                                import's progress is at /admin/imports/<mode>/<agency_id>.
+
+Every other request - and any import with a body, `path` or `synthetic`, `?profile=1`, and the list
+endpoints when GTFS_SHARD_DIR, GTFS_SNAPSHOT_DIR or CACHE_URL is set (shards and the cache are
+read in api.py) - goes to the Flask app (create_app) through asgiref's WsgiToAsgi, so the routes,
+Swagger docs (/docs, /swagger.json), auth and error bodies are those of api.py. Metrics are per
+worker process as with serve.py.
+"""
+import os, sys, time, asyncio, zipfile
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlsplit
+
+from werkzeug.datastructures import MultiDict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import api
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")  # default: DATABASE_URL with the async driver
+IMPORT_TIMEOUT_S = float(os.getenv("GTFS_IMPORT_TIMEOUT_S", "60"))
+
+_NATIVE_LISTS = {f"/gtfs/{name}": name for name in api.GTFS_LISTS}
+_IMPORT_PREFIX = "/gtfs/import/"
+
+
+@contextmanager
+def _span(spans: dict, name: str):
+    """api.span() for the async handlers, which have no Flask `g`."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        acc = spans.setdefault(name, [0, 0.0])
+        acc[0] += 1
+        acc[1] += time.perf_counter() - t0
+
+
+def _async_url(url: str) -> str:
+    from sqlalchemy.engine import make_url
+    u = make_url(url)
+    if u.drivername == "sqlite":
+        u = u.set(drivername="sqlite+aiosqlite")
+    elif u.drivername in ("postgresql", "postgresql+psycopg2"):
+        u = u.set(drivername="postgresql+asyncpg")
+    return u.render_as_string(hide_password=False)
+
+
+class GtfsAsgi:
+    def __init__(self, flask_app=None):
+        from asgiref.wsgi import WsgiToAsgi
+        self.flask_app = flask_app or api.create_app()
+        self.wsgi = WsgiToAsgi(self.flask_app)
+        self._engine = None
+        self._sessions = None
+        self._http = None
+        self._tasks = set()   # background imports (?async=1); kept referenced until done
+
+    # -- ASGI ---------------------------------------------------------------
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] == "http":
+            handler = self._native_handler(scope)
+            if handler is not None:
+                return await self._timed(handler, scope, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    if self.flask_app.config["AUTO_INIT_DB"]:
+                        await asyncio.to_thread(api.ensure_db)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._tasks:
+                    await asyncio.wait(self._tasks, timeout=IMPORT_TIMEOUT_S)
+                if self._http is not None:
+                    await self._http.aclose()
+                if self._engine is not None:
+                    await self._engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _native_handler(self, scope):
+        args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+        if args.get("profile") == "1":
+            return None
+        path, method = scope["path"], scope["method"]
+        if (method == "GET" and path in _NATIVE_LISTS and api.shard_dir is None and api.snapshot_dir is None
+                and api.cache is None):
+            name = _NATIVE_LISTS[path]
+            return lambda request: self.list_gtfs(name, args, request)
+        if method == "POST" and path.startswith(_IMPORT_PREFIX):
+            parts = path[len(_IMPORT_PREFIX):].split("/")
+            raw = dict(scope["headers"])
+            has_body = int(raw.get(b"content-length", b"0") or 0) > 0 or b"transfer-encoding" in raw
+            if len(parts) == 2 and all(parts) and not has_body and not args.get("path") and not args.get("synthetic"):
+                return lambda request: self.start_import(parts[0], parts[1], args, request)
+        return None
+
+    async def _timed(self, handler, scope, send):
+        t0 = time.perf_counter()
+        spans = {}
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        status, body = await handler((headers, spans))
+        with _span(spans, "encode"):
+            payload = api._json_dumps(body)
+        out = [(b"content-type", b"application/json")]
+        if api.COMPRESS and status == 200:  # same negotiation and variant cache as api._compress_response
+            out.append((b"vary", b"Accept-Encoding"))
+            encoding = api._negotiate_encoding(headers.get("accept-encoding", ""))
+            if encoding and len(payload) >= api.COMPRESS_MIN_BYTES:
+                with _span(spans, "compress"):
+                    compressed = api._compress(payload, encoding)
+                if len(compressed) < len(payload):
+                    payload = compressed
+                    out.append((b"content-encoding", encoding.encode()))
+        out.append((b"content-length", str(len(payload)).encode()))
+        total = time.perf_counter() - t0
+        api._observe(api._metrics_namespace(scope["path"]), status, total, [0, 0.0], spans)
+        if api.SERVER_TIMING:
+            out.append((b"server-timing", api._server_timing(spans, [0, 0.0], total).encode()))
+        if status == 202:
+            out.append((b"location", body["progress"].encode()))
+        elif status == 429:
+            out.append((b"retry-after", str(body["retry_after"]).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": out})
+        await send({"type": "http.response.body", "body": payload})
+
+    # -- shared resources -----------------------------------------------------
+
+    def sessions(self):
+        if self._sessions is None:
+            from sqlalchemy import event
+            from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+            url = ASYNC_DATABASE_URL or _async_url(self.flask_app.config["DATABASE_URL"])
+            sqlite = url.startswith("sqlite")
+            self._engine = create_async_engine(
+                url, connect_args={"timeout": api.SQLITE_BUSY_TIMEOUT_S} if sqlite else {})
+            if sqlite:
+                event.listen(self._engine.sync_engine, "connect", api._sqlite_on_connect)
+            self._sessions = async_sessionmaker(self._engine, expire_on_commit=False)
+        return self._sessions
+
+    def http(self):
+        if self._http is None:
+            import httpx
+            self._http = httpx.AsyncClient(timeout=60, follow_redirects=True)
+        return self._http
+
+    # -- auth -------------------------------------------------------------------
+
+    async def _authorize(self, headers, spans, roles, endpoint_class):
+        """api.require_auth for the native handlers: the JWT is decoded here, then api._authenticate
+        (auth cache, active/role checks, admission) runs in a thread.
+
+        Returns (user, release, None) - run release() (in a thread) once done - or (None, None, (status, body)).
+        """
+        from flask_jwt_extended import decode_token
+        token = headers.get("authorization", "").strip()
+        if not token:
+            return None, None, (401, {"error": "Missing Authorization Header"})
+        try:
+            with _span(spans, "jwt"), self.flask_app.app_context():
+                identity = decode_token(token)[self.flask_app.config["JWT_IDENTITY_CLAIM"]]
+        except Exception:
+            return None, None, (401, {"error": "Invalid token"})
+        with _span(spans, "user"):
+            return await asyncio.to_thread(self._authenticate, identity, roles, endpoint_class)
+
+    @staticmethod
+    def _authenticate(identity, roles, endpoint_class):
+        # own session: the scoped SessionLocal is per thread and this runs on the loop's executor
+        with api.SessionLocal.session_factory() as db:
+            return api._authenticate(identity, roles, endpoint_class, db)
+
+    @staticmethod
+    async def _load_agencies(db):
+        """Async counterpart of api._agency_pks: refresh the agency pk <-> key caches."""
+        from sqlalchemy import select
+        api._cache_agencies((await db.execute(select(api.Agency.id, api.Agency.mode, api.Agency.agency_id))).all())
+
+    # -- GET /gtfs/routes|stops|trips ----------------------------------------------
+
+    async def list_gtfs(self, name, args, request):
+        headers, spans = request
+        # "read": require_auth's default endpoint class, as on the Flask handlers
+        _, release, err = await self._authorize(headers, spans, ("admin", "planner", "commuter"), "read")
+        if err:
+            return err
+        try:
+            return await self._list(name, args, spans)
+        finally:
+            await asyncio.to_thread(release)
+
+    async def _list(self, name, args, spans):
+        from sqlalchemy import select, func
+        agency_keys, err = api._requested_agencies(args)
+        if err:
+            return err
+        model, filters, id_column, columns, _ = api.GTFS_LISTS[name]
+        async with self.sessions()() as db:
+            with _span(spans, "imported"):
+                if agency_keys == "*":
+                    pks = list((await db.execute(select(api.Route.agency_pk).distinct())).scalars())
+                    if any(pk not in api._agency_keys_by_pk for pk in pks):
+                        await self._load_agencies(db)
+                    agency_keys = sorted(api._agency_keys_by_pk[pk] for pk in pks)
+                    if not agency_keys:
+                        return 404, {"error": "No agency imported"}
+                else:
+                    if any(k not in api._agency_pks_by_key for k in agency_keys):
+                        await self._load_agencies(db)
+                    wanted = [api._agency_pks_by_key.get(k) for k in agency_keys]
+                    present = set((await db.execute(
+                        select(api.Route.agency_pk).where(api.Route.agency_pk.in_([pk for pk in wanted if pk]))
+                        .distinct())).scalars())
+                    missing = [k for k, pk in zip(agency_keys, wanted) if pk not in present]
+                    if missing:
+                        return 404, {"error": "Agency not imported" if len(agency_keys) == 1
+                                     else f"Agency not imported: {', '.join(missing)}"}
+            agency_pks = [api._agency_pks_by_key[k] for k in agency_keys]
+            clauses, err = filters(args, agency_pks)
+            if err:
+                return err
+            page, page_size = api._pagination(args)
+            stmt = select(*columns.values()).where(model.agency_pk.in_(agency_pks), *clauses)
+            with _span(spans, "count"):
+                total = (await db.execute(select(func.count()).select_from(stmt.subquery()))).scalar_one()
+            with _span(spans, "page"):
+                rows = (await db.execute(
+                    stmt.order_by(id_column, *api._agency_order(model, agency_keys))
+                    .offset((page - 1) * page_size).limit(page_size))).all()
+            keys = api._agency_keys_by_pk
+            items = [dict(zip(columns, r), agency=keys[r.agency_pk]) for r in rows]
+            if name == "routes":
+                with _span(spans, "summaries"):
+                    for agency_key, group in api._items_by_agency(items).items():
+                        stmt = api._route_summaries_stmt(api._agency_pks_by_key[agency_key],
+                                                         [it["route_id"] for it in group])
+                        api._fill_route_summaries(group, (await db.execute(stmt)).all())
+        return 200, {
+            "agency": ",".join(agency_keys),
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "items": items,
+        }
+
+    # -- POST /gtfs/import/<mode>/<agency_id> ------------------------------------------
+
+    async def start_import(self, mode, agency_id, args, request):
+        headers, spans = request
+        # same limits as the Flask handler; a background import holds its slot until it finishes
+        _, release, err = await self._authorize(headers, spans, ("admin", "planner"), "import")
+        if err:
+            return err
+        url, address = args.get("url"), None
+        err = api._import_target_error(mode, agency_id)
+        if not err and url:
+            address, err = await self._vet_url(url)
+        if err:
+            await asyncio.to_thread(release)
+            return err
+        agency_key = f"{mode}:{agency_id}"
+        tel = api.ImportTelemetry(agency_key)
+        tel.source = "url" if url else "tfnsw"
+        api._imports_running[agency_key] = tel
+        job = self._import(mode, agency_id, agency_key, url, address, tel, release)
+        if args.get("async") == "1" or "respond-async" in headers.get("prefer", ""):
+            task = asyncio.create_task(job)
+            self._tasks.add(task)
+            task.add_done_callback(self._import_done)
+            return 202, {"status": "accepted", "agency": agency_key,
+                         "progress": f"/admin/imports/{mode}/{agency_id}"}
+        return await job
+
+    @staticmethod
+    async def _vet_url(url):
+        """(address to fetch `url` from, None) or (None, error); see api._check_feed_url."""
+        try:
+            return await asyncio.to_thread(api._check_feed_url, url), None
+        except api.SOURCE_ERRORS as e:
+            return None, api._source_error(e)
+
+    def _import_done(self, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.flask_app.logger.error("background import failed", exc_info=task.exception())
+            return
+        status, body = task.result()
+        if status != 200:
+            self.flask_app.logger.warning("background import failed (%s): %s", status, body["error"])
+
+    async def _import(self, mode, agency_id, agency_key, url, address, tel, release):
+        try:
+            # Fetch first so a failed download leaves the old data in place
+            try:
+                with tel.phase("download") as ph:
+                    path = await self._download(url or f"{api.GTFS_BASE_URL}/{mode}/{agency_id}",
+                                                None if url else {"Authorization": f"apikey {api._tfnsw_api_key()}"},
+                                                not_found=bool(url), address=address)
+                    ph["bytes"] = api._zip_size(path)
+            except api.SOURCE_ERRORS as e:
+                return api._source_error(e)
+            except RuntimeError as e:
+                return 502, {"error": str(e)}
+            try:
+                rows = await asyncio.to_thread(self._store, mode, agency_id, agency_key, path, tel)
+            except zipfile.BadZipFile as e:
+                return api._source_error(e)
+            return 200, {"status": "ok", "agency": agency_key, "rows": rows, "total_s": tel.as_dict()["total_s"]}
+        finally:
+            api._imports_running.pop(agency_key, None)
+            await asyncio.to_thread(release)
+
+    async def _download(self, url, headers, not_found: bool, address=None):
+        """Stream `url` into the spool dir (same size limit and zip check as api._spool_zip).
+
+        With `address`, connect there rather than resolving the host again (see api._pin_url); TLS
+        still sends and verifies the url's host name.
+        """
+        import httpx
+        extensions = None
+        if address is not None:
+            extensions = {"sni_hostname": urlsplit(url).hostname}
+            url, host = api._pin_url(url, address)
+            headers = {**(headers or {}), "Host": host}
+        spool = api._ZipSpool()
+        try:
+            # a client-supplied url was vetted by api._check_feed_url; do not let it redirect elsewhere
+            async with self.http().stream("GET", url, headers=headers, follow_redirects=not not_found,
+                                          extensions=extensions) as r:
+                if r.status_code != 200:
+                    raise RuntimeError(f"GTFS fetch failed: {r.status_code}")
+                async for chunk in r.aiter_bytes(api.SPOOL_CHUNK):
+                    spool.write(chunk)
+            return spool.finish()
+        except (httpx.HTTPError, RuntimeError) as e:
+            spool.abort()
+            if not_found:   # a client-supplied url that cannot be fetched is a 404, as in api.py
+                raise FileNotFoundError(str(e))
+            raise RuntimeError(str(e))
+        except BaseException:
+            spool.abort()
+            raise
+
+    @staticmethod
+    def _store(mode, agency_id, agency_key, path, tel):
+        # own session: the scoped SessionLocal is per thread and this runs on the loop's executor
+        with api.SessionLocal.session_factory() as db:
+            try:
+                stored = api._parse_and_store(db, agency_key, path, telemetry=tel)
+            except zipfile.BadZipFile:
+                db.rollback()
+                raise
+            finally:
+                api._discard_spooled(path)
+            api._record_import(db, mode, agency_id, telemetry=tel, timetable=stored["timetable"])
+        return stored["rows"]
+
+
+def __getattr__(name):
+    # `uvicorn asgi:app` builds the app on first access, like api.app
+    if name == "app":
+        globals()["app"] = GtfsAsgi()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
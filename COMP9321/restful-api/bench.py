@@ -0,0 +1,432 @@
+"""Load benchmarks for the GTFS API.
+
+Runs the Flask app against a synthetic GTFS feed (see gtfs_synth.py) in a throw-away database,
+through the in-process test client and/or a real threaded WSGI server, and records
+p50/p95/p99 latency and throughput per scenario and concurrency level.
+
+    python bench.py                                         # both drivers, default scale
+    python bench.py --driver wsgi --concurrency 1,8,32 --scale 4
+    python bench.py --out bench_results.json --save-baseline bench_baseline.json
+    python bench.py --compare bench_baseline.json           # exit code 1 on regression
+    python bench.py --sweep 0.25,1,4 --driver client        # import + list latency vs feed size
+    python bench.py --workers 1,2,4 --concurrency 16        # serve.py throughput vs worker processes
+    python bench.py --json --driver client                  # column tuples + orjson vs flask-restx marshal
+"""
+import os, sys, json, math, time, argparse, tempfile, threading, platform, socket, subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from gtfs_synth import build_feed, STREETS
+
+AGENCY = "GSBC001"
+SWEEP_AGENCIES = ["GSBC002", "GSBC003", "GSBC004", "SBSC006", "GSBC007", "GSBC008", "GSBC009", "GSBC010", "GSBC014"]
+SWEEP_SCENARIOS = ["routes_page", "stops_deep_page", "stops_search", "trips_by_route"]
+JSON_SCENARIOS = ["routes_page", "stops_page200", "trips_page200"]  # --json: serialization-bound pages
+BENCH_USERS = 32  # commuter accounts, one per concurrent favourites worker
+
+
+# ----------------- stats -----------------
+
+def percentile(sorted_vals, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(p / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+
+def summarize(latencies, wall_s: float, errors: int) -> dict:
+    lat = sorted(latencies)
+    ms = lambda v: round(v * 1000.0, 3)
+    return {
+        "requests": len(lat),
+        "errors": errors,
+        "wall_s": round(wall_s, 4),
+        "rps": round(len(lat) / wall_s, 2) if wall_s > 0 else 0.0,
+        "mean_ms": ms(sum(lat) / len(lat)) if lat else 0.0,
+        "p50_ms": ms(percentile(lat, 50)),
+        "p95_ms": ms(percentile(lat, 95)),
+        "p99_ms": ms(percentile(lat, 99)),
+        "max_ms": ms(lat[-1]) if lat else 0.0,
+    }
+
+
+# ----------------- drivers -----------------
+# A driver is call(method, path, headers=None, json=None, data=None) -> (status, body bytes).
+
+def client_driver(app):
+    local = threading.local()
+
+    def call(method, path, headers=None, json=None, data=None):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        r = client.open(path, method=method, headers=headers, json=json, data=data)
+        return r.status_code, r.get_data()
+    return call, (lambda: None)
+
+
+def wsgi_driver(app):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def close():
+        server.shutdown()
+        thread.join()
+    return _http_call(f"http://127.0.0.1:{server.server_port}"), close
+
+
+def prefork_driver(workers: int):
+    """Start serve.py with `workers` processes on the bench database (inherited via DATABASE_URL)."""
+    import requests
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "serve.py"), "--server", "builtin",
+                             "--workers", str(workers), "--port", str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while True:
+        try:
+            if requests.get(base + "/metrics", timeout=2).status_code == 200:
+                break
+        except requests.ConnectionError:
+            pass
+        if proc.poll() is not None or time.time() > deadline:
+            proc.kill()
+            raise RuntimeError(f"serve.py --workers {workers} did not come up")
+        time.sleep(0.2)
+
+    def close():
+        proc.terminate()
+        proc.wait(timeout=30)
+    return _http_call(base), close
+
+
+def _http_call(base: str):
+    import requests
+    local = threading.local()
+
+    def call(method, path, headers=None, json=None, data=None):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        r = session.request(method, base + path, headers=headers, json=json, data=data, timeout=300)
+        return r.status_code, r.content
+    return call
+
+
+DRIVERS = {"client": client_driver, "wsgi": wsgi_driver}
+
+
+# ----------------- fixture -----------------
+
+def setup_app(scale: float, seed: int):
+    """Import api against a fresh database and load the synthetic feed; return (app, ctx)."""
+    tmp = tempfile.mkdtemp(prefix="gtfs-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}"
+    os.environ.setdefault("JWT_SECRET_KEY", "bench-secret-" + "x" * 32)
+    os.environ.setdefault("ADMISSION", "0")  # time the handlers, not the per-user rate limits
+    import api
+
+    app = api.app
+    client = app.test_client()
+
+    def login(username, password):
+        r = client.post("/auth/login", json={"username": username, "password": password})
+        return {"Authorization": r.get_json()["token"]}
+
+    h_admin, h_planner = login("admin", "admin"), login("planner", "planner")
+    users = []
+    for i in range(BENCH_USERS):
+        client.post("/admin/users", headers=h_admin,
+                    json={"username": f"bench{i}", "password": "bench", "role": "commuter"})
+        users.append(login(f"bench{i}", "bench"))
+    ctx = {"h_admin": h_admin, "h_planner": h_planner, "users": users, "tmp": tmp}
+    return app, load_feed(client, ctx, AGENCY, scale, seed)
+
+
+def load_feed(client, ctx: dict, agency: str, scale: float, seed: int) -> dict:
+    """Import a synthetic feed as `agency`; return a copy of ctx pointing at it."""
+    feed = build_feed(scale=scale, seed=seed)
+    t0 = time.perf_counter()
+    r = client.post(f"/gtfs/import/buses/{agency}", data=feed,
+                    headers={**ctx["h_planner"], "Content-Type": "application/zip"})
+    import_s = time.perf_counter() - t0
+    assert r.status_code == 200, r.get_data(as_text=True)
+
+    h = ctx["h_admin"]
+    routes = client.get(f"/gtfs/routes?agency={agency}&page_size=200", headers=h).get_json()
+    totals = {"routes": routes["total"]}
+    for kind in ("stops", "trips"):
+        totals[kind] = client.get(f"/gtfs/{kind}?agency={agency}&page_size=1", headers=h).get_json()["total"]
+    return {**ctx, "agency": agency, "scale": scale, "feed": feed, "feed_bytes": len(feed),
+            "import_s": import_s, "route_ids": [it["route_id"] for it in routes["items"]], "totals": totals}
+
+
+# ----------------- scenarios -----------------
+# A scenario op is op(call, ctx, worker, i) -> status of its (last) request.
+
+def _route(ctx, i):
+    return ctx["route_ids"][i % len(ctx["route_ids"])]
+
+
+def op_routes_page(call, ctx, w, i):
+    return call("GET", f"/gtfs/routes?agency={ctx['agency']}&page=1&page_size=50", headers=ctx["users"][w])[0]
+
+
+def op_stops_deep_page(call, ctx, w, i):
+    last = max(1, ctx["totals"]["stops"] // 50)
+    return call("GET", f"/gtfs/stops?agency={ctx['agency']}&page={last}&page_size=50", headers=ctx["users"][w])[0]
+
+
+def op_stops_search(call, ctx, w, i):
+    return call("GET", f"/gtfs/stops?agency={ctx['agency']}&q=near {STREETS[i % len(STREETS)]}&page_size=20", headers=ctx["users"][w])[0]
+
+
+def op_trips_by_route(call, ctx, w, i):
+    return call("GET", f"/gtfs/trips?agency={ctx['agency']}&route_id={_route(ctx, i)}&page_size=50",
+                headers=ctx["users"][w])[0]
+
+
+def op_stops_page200(call, ctx, w, i):
+    return call("GET", f"/gtfs/stops?agency={ctx['agency']}&page={1 + i % 5}&page_size=200", headers=ctx["users"][w])[0]
+
+
+def op_trips_page200(call, ctx, w, i):
+    return call("GET", f"/gtfs/trips?agency={ctx['agency']}&page={1 + i % 5}&page_size=200", headers=ctx["users"][w])[0]
+
+
+def op_favourites(call, ctx, w, i):
+    h = ctx["users"][w]
+    status, body = call("POST", "/favorites", headers=h, json={"agency": ctx["agency"], "route_id": _route(ctx, i)})
+    if status != 201:
+        return status
+    fav_id = json.loads(body)["id"]
+    call("GET", "/favorites", headers=h)
+    return call("DELETE", f"/favorites/{fav_id}", headers=h)[0]
+
+
+def op_viz_png(call, ctx, w, i):
+    return call("GET", f"/viz/map?agency={ctx['agency']}&route_id={_route(ctx, i)}&width=600&height=400",
+                headers=ctx["users"][w])[0]
+
+
+def op_viz_csv(call, ctx, w, i):
+    return call("GET", f"/viz/map?agency={ctx['agency']}&route_id={_route(ctx, i)}&format=csv",
+                headers=ctx["users"][w])[0]
+
+
+SCENARIOS = {
+    "routes_page": op_routes_page,
+    "stops_deep_page": op_stops_deep_page,
+    "stops_search": op_stops_search,
+    "trips_by_route": op_trips_by_route,
+    "stops_page200": op_stops_page200,
+    "trips_page200": op_trips_page200,
+    "favourites_cycle": op_favourites,
+    "viz_map_png": op_viz_png,
+    "viz_map_csv": op_viz_csv,
+}
+OK = {200, 201}
+
+
+def run_scenario(call, ctx, op, concurrency: int, n: int, warmup: int = 3) -> dict:
+    for i in range(warmup):
+        op(call, ctx, 0, i)
+    per_worker = max(1, n // concurrency)
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def worker(w):
+        local_lat, local_err = [], 0
+        for i in range(per_worker):
+            t0 = time.perf_counter()
+            status = op(call, ctx, w, w * per_worker + i)
+            local_lat.append(time.perf_counter() - t0)
+            local_err += status not in OK
+        with lock:
+            latencies.extend(local_lat)
+            errors[0] += local_err
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return summarize(latencies, time.perf_counter() - t0, errors[0])
+
+
+def run_import(call, ctx, runs: int) -> dict:
+    headers = {**ctx["h_planner"], "Content-Type": "application/zip"}
+    latencies, errors = [], 0
+    t_all = time.perf_counter()
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        status, _ = call("POST", f"/gtfs/import/buses/{ctx['agency']}", headers=headers, data=ctx["feed"])
+        latencies.append(time.perf_counter() - t0)
+        errors += status != 200
+    return summarize(latencies, time.perf_counter() - t_all, errors)
+
+
+# ----------------- baseline comparison -----------------
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return rows (key, metric, base, new, change, regressed) for keys present in both runs."""
+    rows = []
+    for key, new in results["results"].items():
+        base = baseline.get("results", {}).get(key)
+        if not base:
+            continue
+        for metric, higher_is_worse in (("p95_ms", True), ("rps", False)):
+            b, v = base.get(metric, 0.0), new.get(metric, 0.0)
+            if not b:
+                continue
+            change = (v - b) / b
+            regressed = change > tolerance if higher_is_worse else change < -tolerance
+            rows.append((key, metric, b, v, change, regressed))
+    return rows
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--driver", choices=["client", "wsgi", "both"], default="both")
+    ap.add_argument("--scale", type=float, default=0.25, help="synthetic feed scale (1.0 ~ 450k stop_times)")
+    ap.add_argument("--sweep", default="", help="comma-separated scales: import each as its own agency and "
+                                                "time the list endpoints on it (concurrency 1)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--concurrency", default="1,4,16", help="comma-separated client counts")
+    ap.add_argument("--workers", default="", help="comma-separated serve.py process counts to benchmark "
+                                                  "(pre-forked, over HTTP), e.g. 1,2,4")
+    ap.add_argument("--json", action="store_true", help="compare the list endpoints' fast JSON path against "
+                                                        "flask-restx marshalling (FAST_JSON=0), concurrency 1")
+    ap.add_argument("--requests", type=int, default=200, help="operations per scenario and concurrency")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset")
+    ap.add_argument("--import-runs", type=int, default=3, help="timed re-imports of the feed (0 to skip)")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--save-baseline", metavar="PATH", help="also write the results as a baseline")
+    ap.add_argument("--compare", metavar="PATH", help="compare against a baseline JSON")
+    ap.add_argument("--tolerance", type=float, default=0.20, help="allowed relative change before flagging")
+    args = ap.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    if max(levels) > BENCH_USERS:
+        ap.error(f"concurrency is capped at {BENCH_USERS}")
+    sweep = [float(x) for x in args.sweep.split(",") if x.strip()]
+    if len(sweep) > len(SWEEP_AGENCIES):
+        ap.error(f"at most {len(SWEEP_AGENCIES)} sweep scales")
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        ap.error(f"unknown scenario(s): {', '.join(unknown)}")
+    drivers = ["client", "wsgi"] if args.driver == "both" else [args.driver]
+    worker_counts = [int(w) for w in args.workers.split(",") if w.strip()]
+
+    app, ctx = setup_app(args.scale, args.seed)
+    out = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "scale": args.scale, "seed": args.seed,
+            "feed_bytes": ctx["feed_bytes"], "totals": ctx["totals"], "requests": args.requests,
+        },
+        "results": {},
+    }
+    if sweep:
+        out["meta"]["sweep"] = {}
+        client = app.test_client()
+        call, _ = client_driver(app)
+        for agency, scale in zip(SWEEP_AGENCIES, sweep):
+            sctx = load_feed(client, ctx, agency, scale, args.seed)
+            out["meta"]["sweep"][str(scale)] = {"agency": agency, "feed_bytes": sctx["feed_bytes"],
+                                                "totals": sctx["totals"]}
+            out["results"][f"sweep/scale{scale}/import/c1"] = summarize([sctx["import_s"]], sctx["import_s"], 0)
+            print(f"sweep scale {scale:<6} {sctx['totals']}  import {sctx['import_s']:.2f}s")
+            for scenario in SWEEP_SCENARIOS:
+                key = f"sweep/scale{scale}/{scenario}/c1"
+                res = out["results"][key] = run_scenario(call, sctx, SCENARIOS[scenario], 1, args.requests)
+                print(f"{key:<44} p50 {res['p50_ms']:>8.2f}  p95 {res['p95_ms']:>8.2f} ms")
+    for name in drivers:
+        call, close = DRIVERS[name](app)
+        try:
+            if args.import_runs:
+                key = f"{name}/import/c1"
+                out["results"][key] = run_import(call, ctx, args.import_runs)
+                print(f"{key:<36} {out['results'][key]['p50_ms']:>10.1f} ms p50")
+            for scenario in scenarios:
+                for c in levels:
+                    key = f"{name}/{scenario}/c{c}"
+                    res = out["results"][key] = run_scenario(call, ctx, SCENARIOS[scenario], c, args.requests)
+                    print(f"{key:<36} p50 {res['p50_ms']:>8.2f}  p95 {res['p95_ms']:>8.2f}  "
+                          f"p99 {res['p99_ms']:>8.2f} ms  {res['rps']:>8.1f} req/s  errors {res['errors']}")
+        finally:
+            close()
+    if args.json:
+        import api
+        paths = {"fast": app, "marshal": api.create_app({"FAST_JSON": False})}
+        speedup = out["json"] = {}
+        for scenario in JSON_SCENARIOS:
+            for mode, mode_app in paths.items():
+                call, close = client_driver(mode_app)
+                try:
+                    key = f"json-{mode}/{scenario}/c1"
+                    res = out["results"][key] = run_scenario(call, ctx, SCENARIOS[scenario], 1, args.requests)
+                finally:
+                    close()
+                print(f"{key:<36} p50 {res['p50_ms']:>8.2f}  p95 {res['p95_ms']:>8.2f} ms  {res['rps']:>8.1f} req/s")
+            fast, slow = (out["results"][f"json-{m}/{scenario}/c1"]["p50_ms"] for m in paths)
+            speedup[scenario] = round(slow / fast, 2) if fast else None
+        print("\nfast JSON path vs marshal (p50): " +
+              "  ".join(f"{s} x{v}" for s, v in speedup.items()))
+    if worker_counts:
+        # read-only scenarios: writers in several processes would only measure SQLite's write lock
+        read_scenarios = [s for s in scenarios if s != "favourites_cycle"]
+        scaling = out["scaling"] = {}
+        for n in worker_counts:
+            call, close = prefork_driver(n)
+            try:
+                for scenario in read_scenarios:
+                    for c in levels:
+                        key = f"prefork{n}/{scenario}/c{c}"
+                        res = out["results"][key] = run_scenario(call, ctx, SCENARIOS[scenario], c, args.requests)
+                        scaling.setdefault(f"{scenario}/c{c}", {})[str(n)] = res["rps"]
+                        print(f"{key:<36} p50 {res['p50_ms']:>8.2f}  p95 {res['p95_ms']:>8.2f}  "
+                              f"p99 {res['p99_ms']:>8.2f} ms  {res['rps']:>8.1f} req/s  errors {res['errors']}")
+            finally:
+                close()
+        base_n = str(worker_counts[0])
+        print(f"\nthroughput vs {base_n} worker(s) ({os.cpu_count()} CPUs):")
+        for key, by_n in scaling.items():
+            print(f"  {key:<28} " + "  ".join(f"{n}w {rps:>7.1f} req/s (x{rps / by_n[base_n]:.2f})"
+                                               for n, rps in by_n.items() if by_n[base_n]))
+
+    with open(args.out, "w") as f:
+        json.dump(out, f, indent=2)
+    print(f"results -> {args.out}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(out, f, indent=2)
+        print(f"baseline -> {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(out, baseline, args.tolerance)
+        regressions = [r for r in rows if r[5]]
+        for key, metric, b, v, change, regressed in rows:
+            print(f"{'REGRESSION' if regressed else 'ok':<10} {key:<36} {metric:<6} {b:>10.2f} -> {v:>10.2f} ({change:+.0%})")
+        print(f"{len(regressions)} regression(s) beyond ±{args.tolerance:.0%} vs {args.compare}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
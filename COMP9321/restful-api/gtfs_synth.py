@@ -0,0 +1,250 @@
+"""Deterministic synthetic GTFS feeds for scale testing, benchmarks and offline imports.
+
+The same (scale, seed, options) always yields a byte-identical zip. Feeds look like a bus network:
+- stops are placed along route polylines between clustered town centres, and routes share stops
+  where they cross (stops within ~120 m are merged);
+- routes are trunk (frequent, long) or local (infrequent, short), with hour-by-hour headways,
+  a weekday/Saturday/Sunday service pattern and peak-hour congestion on run times;
+- services can run past midnight (times like 24:35:00), as in real GTFS.
+
+At scale=1 a feed has ~40 routes, ~2k stops, ~8k trips and ~450k stop_times; counts scale
+roughly linearly with `scale`.
+
+    from gtfs_synth import build_feed, write_feed
+    zip_bytes = build_feed(scale=1.0, seed=0)
+    write_feed("feeds/GSBC001.zip", scale=10, seed=1)
+
+    python gtfs_synth.py --scale 10 --out feeds/GSBC001.zip
+    python gtfs_synth.py --scale 2 --out-dir feeds --agencies GSBC001,GSBC002   # one zip per agency
+"""
+import io, csv, math, zlib, random, zipfile, argparse
+
+SYDNEY = (-33.87, 151.21)
+BBOX = (0.30, 0.40)            # half-height / half-width in degrees around SYDNEY
+KM_PER_DEG_LAT = 111.0
+SNAP_M = 120                   # stops closer than this are shared between routes
+ZIP_DATE = (2026, 1, 1, 0, 0, 0)
+
+STREETS = ["George", "Pitt", "Church", "Victoria", "Parramatta", "Great Western", "King", "Oxford",
+           "Railway", "Station", "Macquarie", "Elizabeth", "Anzac", "Military", "Pacific", "Princes",
+           "Canterbury", "Liverpool", "Hume", "Windsor", "Old Northern", "Epping", "Pennant Hills",
+           "Forest", "Beach", "Park", "Bridge", "High", "Smith", "Wentworth"]
+SUFFIXES = ["Rd", "St", "Ave", "Hwy", "Pde", "Dr"]
+
+# service_id -> (days Mon..Sun, headway factor, first hour, last hour)
+SERVICES = {
+    "WEEKDAY": ((1, 1, 1, 1, 1, 0, 0), 1.0, 5.0, 24.5),
+    "SAT": ((0, 0, 0, 0, 0, 1, 0), 1.6, 6.0, 24.0),
+    "SUN": ((0, 0, 0, 0, 0, 0, 1), 2.0, 7.0, 23.0),
+}
+
+
+def _hms(secs: int) -> str:
+    return f"{secs // 3600:02d}:{secs % 3600 // 60:02d}:{secs % 60:02d}"
+
+
+def _csv(rows, header) -> str:
+    out = io.StringIO()
+    w = csv.writer(out, lineterminator="\n")
+    w.writerow(header)
+    w.writerows(rows)
+    return out.getvalue()
+
+
+def _dist_m(a, b) -> float:
+    dlat = (a[0] - b[0]) * KM_PER_DEG_LAT
+    dlon = (a[1] - b[1]) * KM_PER_DEG_LAT * math.cos(math.radians(a[0]))
+    return math.hypot(dlat, dlon) * 1000.0
+
+
+def _headway_min(hour: float, trunk: bool, rnd) -> float:
+    peak = 7 <= hour < 9.5 or 16 <= hour < 18.5
+    night = hour < 6 or hour >= 21
+    if trunk:
+        base = 8 if peak else (20 if night else 12)
+    else:
+        base = 15 if peak else (60 if night else 30)
+    return base * rnd.uniform(0.9, 1.1)
+
+
+def _congestion(hour: float) -> float:
+    return 1.3 if (7 <= hour < 9.5 or 16 <= hour < 18.5) else (0.85 if hour < 6 or hour >= 21 else 1.0)
+
+
+class _StopIndex:
+    """Grid of stops so new stops within SNAP_M of an existing one reuse it."""
+
+    CELL = 0.002  # degrees (~200 m)
+
+    def __init__(self):
+        self.stops = []   # (lat, lon, name)
+        self.grid = {}
+
+    def _cell(self, lat, lon):
+        return int(lat // self.CELL), int(lon // self.CELL)
+
+    def snap(self, lat, lon, name) -> int:
+        ci, cj = self._cell(lat, lon)
+        best, best_d = None, SNAP_M
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                for idx in self.grid.get((ci + di, cj + dj), ()):
+                    d = _dist_m((lat, lon), self.stops[idx][:2])
+                    if d < best_d:
+                        best, best_d = idx, d
+        if best is not None:
+            return best
+        self.stops.append((lat, lon, name))
+        self.grid.setdefault((ci, cj), []).append(len(self.stops) - 1)
+        return len(self.stops) - 1
+
+
+def generate(scale: float = 1.0, seed: int = 0, routes: int = 40, calendar: bool = True,
+             shapes: bool = True) -> dict:
+    """Generate feed tables as {filename: (header, rows)}."""
+    rnd = random.Random(seed)
+    n_routes = max(1, int(round(routes * scale)))
+    lat0, lon0 = SYDNEY
+    dlat, dlon = BBOX
+    n_centres = max(4, int(6 * math.sqrt(scale)) + 2)
+    centres = [(lat0 + rnd.uniform(-dlat, dlat), lon0 + rnd.uniform(-dlon, dlon)) for _ in range(n_centres)]
+
+    index = _StopIndex()
+    route_rows, trip_rows, st_rows, shape_rows = [], [], [], []
+    for r in range(n_routes):
+        trunk = rnd.random() < 0.2
+        a, b = rnd.sample(centres, 2)
+        # a bowed polyline between two centres, through a jittered midpoint
+        mid = ((a[0] + b[0]) / 2 + rnd.gauss(0, 0.03), (a[1] + b[1]) / 2 + rnd.gauss(0, 0.03))
+        spacing = rnd.uniform(350, 550) if not trunk else rnd.uniform(450, 800)
+        spacing = max(spacing, (_dist_m(a, mid) + _dist_m(mid, b)) / 70)  # at most ~70 stops
+        street = f"{rnd.choice(STREETS)} {rnd.choice(SUFFIXES)}"
+        pattern, poly = [], []
+        for p0, p1 in ((a, mid), (mid, b)):
+            steps = max(1, int(_dist_m(p0, p1) / spacing))
+            for k in range(steps):
+                t = k / steps
+                lat = p0[0] + (p1[0] - p0[0]) * t + rnd.gauss(0, 0.0008)
+                lon = p0[1] + (p1[1] - p0[1]) * t + rnd.gauss(0, 0.0008)
+                poly.append((lat, lon))
+                cross = f"{rnd.choice(STREETS)} {rnd.choice(SUFFIXES)}"
+                idx = index.snap(lat, lon, f"{street} near {cross}")
+                if not pattern or pattern[-1] != idx:
+                    pattern.append(idx)
+        poly.append(b)
+        if len(pattern) < 2:
+            continue
+
+        route_id = f"{2000 + r}"
+        short = f"M{r}" if trunk else f"{100 + r * 7 % 900}"
+        route_rows.append((route_id, "SYN", short,
+                           f"{street} - {'Trunk' if trunk else 'Local'} {r}", 700))
+        hops = [_dist_m(index.stops[pattern[k]][:2], index.stops[pattern[k + 1]][:2])
+                for k in range(len(pattern) - 1)]
+        speed = rnd.uniform(20, 28) if trunk else rnd.uniform(16, 22)  # km/h
+        for direction in (0, 1):
+            seq_stops = pattern if direction == 0 else pattern[::-1]
+            seq_hops = hops if direction == 0 else hops[::-1]
+            shape_id = f"{route_id}.{direction}"
+            if shapes:
+                pts = poly if direction == 0 else poly[::-1]
+                travelled = 0.0
+                for k, (lat, lon) in enumerate(pts, start=1):
+                    if k > 1:
+                        travelled += _dist_m(pts[k - 2], (lat, lon))
+                    shape_rows.append((shape_id, f"{lat:.6f}", f"{lon:.6f}", k, f"{travelled:.1f}"))
+            headsign = f"To {index.stops[seq_stops[-1]][2].split(' near ')[-1]}"
+            for service, (_, factor, first_h, last_h) in SERVICES.items():
+                if not calendar and service != "WEEKDAY":
+                    continue
+                t = first_h * 3600 + rnd.randint(0, 900)
+                n = 0
+                while t < last_h * 3600:
+                    hour = (t / 3600.0) % 24
+                    trip_id = f"{route_id}.{service}.{direction}.{n}"
+                    trip_rows.append((route_id, service, trip_id, headsign, direction,
+                                      shape_id if shapes else ""))
+                    clock, mult = int(t), _congestion(hour)
+                    for seq, stop_idx in enumerate(seq_stops, start=1):
+                        dwell = 30 if trunk and seq % 5 == 0 else 0
+                        st_rows.append((trip_id, _hms(clock), _hms(clock + dwell), f"{200000 + stop_idx}", seq))
+                        if seq <= len(seq_hops):
+                            clock += dwell + int(seq_hops[seq - 1] / (speed / 3.6) * mult) + 15
+                    t += _headway_min(hour, trunk, rnd) * 60 * factor
+                    n += 1
+
+    tables = {
+        "agency.txt": (["agency_id", "agency_name", "agency_url", "agency_timezone"],
+                       [("SYN", "Synthetic Buses", "https://example.org", "Australia/Sydney")]),
+        "routes.txt": (["route_id", "agency_id", "route_short_name", "route_long_name", "route_type"],
+                       route_rows),
+        "stops.txt": (["stop_id", "stop_name", "stop_lat", "stop_lon"],
+                      [(f"{200000 + i}", name, f"{lat:.6f}", f"{lon:.6f}")
+                       for i, (lat, lon, name) in enumerate(index.stops)]),
+        "trips.txt": (["route_id", "service_id", "trip_id", "trip_headsign", "direction_id", "shape_id"],
+                      trip_rows),
+        "stop_times.txt": (["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"],
+                           st_rows),
+    }
+    if calendar:
+        tables["calendar.txt"] = (
+            ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+             "start_date", "end_date"],
+            [(sid, *days, "20260101", "20261231") for sid, (days, _, _, _) in SERVICES.items()])
+    if shapes:
+        tables["shapes.txt"] = (["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence",
+                                 "shape_dist_traveled"], shape_rows)
+    return tables
+
+
+def write_feed(fp, scale: float = 1.0, seed: int = 0, **options) -> dict:
+    """Write a feed zip to a path or binary file object; return row counts per file."""
+    tables = generate(scale=scale, seed=seed, **options)
+    with zipfile.ZipFile(fp, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, (header, rows) in tables.items():
+            info = zipfile.ZipInfo(name, date_time=ZIP_DATE)   # fixed timestamp: byte-identical output
+            info.compress_type = zipfile.ZIP_DEFLATED
+            z.writestr(info, _csv(rows, header))
+    return {name: len(rows) for name, (_, rows) in tables.items()}
+
+
+def build_feed(scale: float = 1.0, seed: int = 0, **options) -> bytes:
+    """Return a feed as zip bytes; see generate() for the options."""
+    buf = io.BytesIO()
+    write_feed(buf, scale=scale, seed=seed, **options)
+    return buf.getvalue()
+
+
+def agency_seed(seed: int, agency_id: str) -> int:
+    """Per-agency seed, so several agencies generated from one seed get different networks."""
+    return (seed * 1000003) ^ zlib.crc32(agency_id.encode())
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Generate deterministic synthetic GTFS zips.")
+    ap.add_argument("--scale", type=float, default=1.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--routes", type=int, default=40, help="routes at scale=1")
+    ap.add_argument("--no-calendar", action="store_true", help="weekday service only, no calendar.txt")
+    ap.add_argument("--no-shapes", action="store_true", help="omit shapes.txt")
+    out = ap.add_mutually_exclusive_group(required=True)
+    out.add_argument("--out", help="zip path for a single feed")
+    out.add_argument("--out-dir", help="directory for one <agency_id>.zip per --agencies entry")
+    ap.add_argument("--agencies", default="GSBC001", help="comma-separated agency ids for --out-dir")
+    args = ap.parse_args(argv)
+    opts = dict(routes=args.routes, calendar=not args.no_calendar, shapes=not args.no_shapes)
+
+    if args.out:
+        targets = [(args.out, args.seed)]
+    else:
+        import os
+        os.makedirs(args.out_dir, exist_ok=True)
+        targets = [(os.path.join(args.out_dir, f"{a}.zip"), agency_seed(args.seed, a))
+                   for a in args.agencies.split(",") if a.strip()]
+    for path, seed in targets:
+        counts = write_feed(path, scale=args.scale, seed=seed, **opts)
+        print(path, " ".join(f"{k.split('.')[0]}={v}" for k, v in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
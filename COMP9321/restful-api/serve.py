@@ -0,0 +1,143 @@
+"""Production entry point: N pre-forked worker processes sharing one listening socket.
+
+    python serve.py --workers 4 --port 8000
+    python serve.py --workers 4 --server gunicorn          # same app under gunicorn, if installed
+    DATABASE_URL=sqlite:////srv/gtfs.sqlite python serve.py --workers 8 --threads 4
+
+The master builds the app and runs init_db() once, so workers never race on CREATE TABLE,
+then forks the workers. Each worker gets its own database connections: the parent's pooled
+connections are discarded in the child (see api._reset_engine_after_fork). Workers that die are
+restarted; SIGTERM/SIGINT stops them all.
+
+Metrics (/metrics, /admin/slow-queries, import progress) are kept per worker process.
+"""
+import os, sys, signal, socket, argparse, logging
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _builtin_worker(app, sock, threads: int):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class Handler(WSGIRequestHandler):
+        # keep-alive only with a thread per connection: a single-threaded worker holding an idle
+        # connection open would stop accepting others (gunicorn's sync worker closes them too)
+        protocol_version = "HTTP/1.1" if threads > 1 else "HTTP/1.0"
+
+    srv = make_server(*sock.getsockname()[:2], app, threaded=threads > 1, request_handler=Handler,
+                      fd=sock.fileno())
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C goes to the whole group; the master handles it
+    srv.serve_forever()
+
+
+def serve_builtin(app, host: str, port: int, workers: int, threads: int, backlog: int = 2048):
+    """Pre-fork `workers` werkzeug servers on one socket; restart any that exit."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    print(f"[serve] http://{host}:{sock.getsockname()[1]}  workers={workers} threads={threads}", flush=True)
+
+    if not hasattr(os, "fork"):  # Windows: no pre-forking, one threaded process
+        _builtin_worker(app, sock, max(threads, 4))
+        return
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _builtin_worker(app, sock, threads)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"[serve] worker {pid} exited ({status}); restarting", flush=True)
+            spawn()
+    sock.close()
+
+
+def serve_gunicorn(app, host: str, port: int, workers: int, threads: int):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in {"bind": f"{host}:{port}", "workers": workers, "threads": threads,
+                               "preload_app": True}.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    ap.add_argument("--threads", type=int, default=1,
+                    help="threads per worker (builtin: any value > 1 means one thread per connection)")
+    ap.add_argument("--server", choices=["auto", "builtin", "gunicorn"], default="auto",
+                    help="auto uses gunicorn when installed")
+    ap.add_argument("--access-log", action="store_true", help="log every request (builtin server)")
+    args = ap.parse_args(argv)
+    if args.workers < 1 or args.threads < 1:
+        ap.error("--workers and --threads must be >= 1")
+
+    import api
+    app = api.create_app({"AUTO_INIT_DB": False})
+    if isinstance(api.cache, api._MemoryCache) and args.workers > 1:
+        print("[serve] CACHE_URL=memory:// is per worker: imports in one worker leave the others' "
+              "pages stale until CACHE_TTL_S; use redis://", flush=True)
+    try:
+        api.init_db()
+    except api.SchemaOutdated as e:
+        sys.exit(f"[serve] {e}")
+    # the master only forks; drop its connections so none are inherited
+    api.engine.dispose()
+
+    server = args.server
+    if server == "auto":
+        try:
+            import gunicorn  # noqa: F401
+            server = "gunicorn"
+        except ImportError:
+            server = "builtin"
+    if server == "gunicorn":
+        serve_gunicorn(app, args.host, args.port, args.workers, args.threads)
+    else:
+        if not args.access_log:
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        serve_builtin(app, args.host, args.port, args.workers, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
-import os, time, sqlite3, requests
+import os, sys, json, time, sqlite3, subprocess, tempfile, contextlib, requests
 
 BASE = os.getenv("API_BASE", "http://127.0.0.1:5000")
 DB   = f"app.sqlite"
 RUN_SLOW = os.getenv("RUN_SLOW", "0") == "1"  # turn on heavier checks when set
+STARTUP_BUDGET_S = float(os.getenv("STARTUP_BUDGET_S", "1.0"))  # max seconds for `import api`
+ASGI_BASE = os.getenv("ASGI_BASE")  # e.g. http://127.0.0.1:8001 (`uvicorn asgi:app` on the same database)
 
 AGENCY = os.getenv("TEST_AGENCY", "GSBC001")  # default target agency
 CANDIDATES = ["GSBC001","GSBC002","GSBC003","GSBC004","SBSC006","GSBC007","GSBC008","GSBC009","GSBC010","GSBC014"]
@@ -27,13 +29,36 @@ def get(url, headers=None, **params):
 def post(url, headers=None, **params):
     return requests.post(f"{BASE}{url}", headers=headers, timeout=180, **params)
 
+def _run_probe(probe: str, *args, tmp=None, **env) -> dict:
+    """Run `probe` in a fresh interpreter against a throw-away database; return the JSON it prints last.
+
+    The child runs with one parse worker, synthetic imports allowed, and DATABASE_URL under `tmp`
+    (a new temporary directory unless given). It drops the shard, snapshot, cache, limiter and
+    admission settings of this shell. `env` adds settings; a None value removes one.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    with (tempfile.TemporaryDirectory() if tmp is None else contextlib.nullcontext(tmp)) as tmp:
+        child = {k: v for k, v in os.environ.items() if k not in _PROBE_ENV_DROP}
+        child.update(GTFS_PARSE_WORKERS="1", ALLOW_SYNTHETIC_IMPORT="1", DATABASE_URL=f"sqlite:///{tmp}/app.sqlite")
+        for k, v in env.items():
+            if v is None:
+                child.pop(k, None)
+            else:
+                child[k] = str(v)
+        r = subprocess.run([sys.executable, "-c", probe, *args], cwd=here, env=child, capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr[-2000:]
+    return json.loads(r.stdout.strip().splitlines()[-1])
+
+_PROBE_ENV_DROP = ("GTFS_SHARD_DIR", "GTFS_SNAPSHOT_DIR", "CACHE_URL", "RATE_LIMIT_URL", "ADMISSION")
+
 # DB sanity helpers (optional checks)
 
 def _count(table, agency):
-    key = f"buses:{agency}"
+    # GTFS rows reference their agency by gtfs_agencies.id
     with sqlite3.connect(DB) as conn:
         cur = conn.cursor()
-        cur.execute(f"SELECT COUNT(*) FROM {table} WHERE agency_key=?", (key,))
+        cur.execute(f"SELECT COUNT(*) FROM {table} t JOIN gtfs_agencies a ON a.id = t.agency_pk "
+                    "WHERE a.mode = 'buses' AND a.agency_id = ?", (agency,))
         return cur.fetchone()[0]
 
 # ----------------- tests -----------------
@@ -46,7 +71,7 @@ def test_set1_user_management_and_roles():
     r = get("/admin/users", headers=h_admin)
     assert r.status_code == 200, f"admin list users failed: {r.status_code} {r.text}"
     ok("Admin can list users (200)")
-    users = r.json()
+    users = r.json()["items"]
 
     # Admin can create planner/commuter; duplicate username should fail
     import time as _t
@@ -396,6 +421,1222 @@ def test_set6_visual_and_export():
     print("Set 6 checks passed ✅")
 
 
+def test_set7_batch_lookup():
+    print("\n===== Set 7 – Batch Lookups =====")
+    h_commuter = login("commuter", "commuter")
+    h_planner  = login("planner",  "planner")
+    _ensure_imported(AGENCY, h_commuter, h_planner)
+
+    r = get("/gtfs/routes", headers=h_commuter, agency=AGENCY, page=1, page_size=3)
+    jr = r.json(); assert r.status_code == 200 and jr["items"], jr
+    route_ids = [it["route_id"] for it in jr["items"]]
+
+    r = post("/gtfs/batch", headers=h_commuter, json={
+        "agency": AGENCY, "route_ids": route_ids + ["__nope__"], "trips_for_routes": route_ids[:1]})
+    jb = r.json(); assert r.status_code == 200, (r.status_code, r.text)
+    assert [it["route_id"] for it in jb["routes"]] == route_ids, jb["routes"]
+    assert jb["missing"]["route_ids"] == ["__nope__"], jb["missing"]
+    ok("Batch resolves routes by id and reports missing ids (200)")
+
+    trips = jb["trips_by_route"][route_ids[0]]
+    if trips:
+        seed_trip = trips[0]["trip_id"]
+        r = post("/gtfs/batch", headers=h_commuter, json={"agency": AGENCY, "stops_for_trips": [seed_trip]})
+        stops = r.json()["stops_by_trip"][seed_trip]
+        seqs = [s["stop_sequence"] for s in stops]
+        assert r.status_code == 200 and stops and seqs == sorted(seqs), stops
+        ok("Batch lists ordered stops for a trip (200)")
+
+    r = post("/gtfs/batch", headers=h_commuter, json={"agency": AGENCY, "route_ids": "not-a-list"})
+    assert r.status_code == 400, r.status_code
+    r = post("/gtfs/batch", headers=h_commuter, json=[{"agency": AGENCY}])
+    assert r.status_code == 400 and r.json()["error"] == "body must be a JSON object", r.text
+    assert post("/gtfs/batch", headers=h_commuter, json={"agency": 7}).status_code == 400
+    ok("Malformed batch payload returns 400")
+    print("Set 7 checks passed ✅")
+
+
+def test_set8_multi_agency():
+    print("\n===== Set 8 – Multi-agency Queries =====")
+    h_commuter = login("commuter", "commuter")
+    h_planner  = login("planner",  "planner")
+    _ensure_imported(AGENCY, h_commuter, h_planner)
+
+    r = get("/gtfs/routes", headers=h_commuter, agency="*", page=1, page_size=5)
+    ja = r.json(); assert r.status_code == 200 and ja["items"], ja
+    assert f"buses:{AGENCY}" in ja["agency"].split(","), ja["agency"]
+    assert all(it["agency"] for it in ja["items"]), ja["items"]
+    ok("agency=* lists routes across imported agencies (200)")
+
+    r = get("/gtfs/routes", headers=h_commuter, agency=AGENCY)
+    single_total = r.json()["total"]
+    assert ja["total"] >= single_total, (ja["total"], single_total)
+    keys = [(it["route_id"], it["agency"]) for it in ja["items"]]
+    assert keys == sorted(keys), keys
+    ok("Merged listing is globally ordered and totals cover every agency")
+
+    r = get("/gtfs/stops", headers=h_commuter, agency=f"{AGENCY},NOPE001")
+    assert r.status_code == 404, r.status_code
+    ok("Unknown agency inside a list returns 404")
+    print("Set 8 checks passed ✅")
+
+
+def test_set9_instrumentation():
+    print("\n===== Set 9 – Instrumentation =====")
+    h_commuter = login("commuter", "commuter")
+    h_planner  = login("planner",  "planner")
+    _ensure_imported(AGENCY, h_commuter, h_planner)
+
+    r = get("/gtfs/stops", headers=h_commuter, agency=AGENCY, page=1, page_size=5)
+    timing = r.headers.get("Server-Timing", "")
+    assert r.status_code == 200 and "total;dur=" in timing, timing
+    for phase in ("jwt", "user", "count", "page", "db"):
+        assert f"{phase};dur=" in timing, (phase, timing)
+    ok("Server-Timing lists auth, query and SQL phases")
+
+    r = get("/metrics")
+    assert r.status_code == 200 and "text/plain" in r.headers.get("Content-Type", ""), r.status_code
+    for ns in ("auth", "admin", "gtfs", "favorites", "viz"):
+        assert f'api_request_duration_seconds_count{{namespace="{ns}"}}' in r.text, ns
+    assert 'api_sql_statements_total{namespace="gtfs"}' in r.text
+    ok("/metrics exposes per-namespace latency histograms and SQL counters")
+
+    h_admin = login("admin", "admin")
+    r = get("/gtfs/trips", headers=h_admin, agency=AGENCY, profile=1, profile_limit=5)
+    assert r.status_code == 200 and "text/plain" in r.headers.get("Content-Type", ""), r.status_code
+    assert "function calls" in r.text and r.headers.get("X-Profiled-Status") == "200", r.text[:200]
+    r = get("/gtfs/trips", headers=h_commuter, agency=AGENCY, profile=1)
+    assert r.status_code == 403, r.status_code
+    r = post(f"/gtfs/import/buses/{AGENCY}?profile=1", headers=h_admin)
+    assert r.status_code == 400 and "GET" in r.json()["error"], r.status_code
+    r = get("/admin/slow-queries", headers=h_admin)
+    assert r.status_code == 200 and "threshold_ms" in r.json(), r.status_code
+    ok("Admin-only ?profile=1 (GET only) and slow-query log")
+
+    r = get("/admin/imports", headers=h_admin)
+    assert r.status_code == 200 and any(it["agency"] == f"buses:{AGENCY}" for it in r.json()["items"]), r.text[:300]
+    r = get(f"/admin/imports/buses/{AGENCY}", headers=h_admin, limit=1)
+    assert r.status_code == 200, r.status_code
+    for run in r.json()["history"]:
+        phases = {p["phase"] for p in run["phases"]}
+        assert {"download", "unzip", "delete", "commit", "insert:gtfs_stop_times"} <= phases, phases
+    ok("Import telemetry lists phases per run")
+
+    # the documented-model path (FAST_JSON off) times its own marshalling; flask-restx is left as shipped
+    probe = """if True:
+        import json, api, flask_restx.marshalling
+        c = api.create_app({"FAST_JSON": False}).test_client()
+        h = {"Authorization": c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]}
+        assert c.post("/gtfs/import/buses/GSBC001?synthetic=0.05", headers=h).status_code == 200
+        r = c.get("/gtfs/stops", query_string={"agency": "GSBC001", "page_size": 5}, headers=h)
+        print(json.dumps({"status": r.status_code, "items": len(r.json["items"]),
+                          "phases": [p.split(";")[0] for p in r.headers["Server-Timing"].split(", ")],
+                          "patched": flask_restx.marshalling.marshal is not flask_restx.marshal}))
+    """
+    res = _run_probe(probe)
+    assert res["status"] == 200 and res["items"] == 5 and "marshal" in res["phases"], res
+    assert not res["patched"], res
+    ok("Marshalled listings report a marshal phase without patching flask-restx")
+    print("Set 9 checks passed ✅")
+
+
+def test_set10_cold_start():
+    print("\n===== Set 10 – Cold Start =====")
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = ("import sys, time; t0 = time.perf_counter(); import api; "
+             "print(time.perf_counter() - t0, *[m for m in ('matplotlib', 'pyproj', 'requests', 'redis') if m in sys.modules])")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "cold.sqlite")
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+        runs = []
+        for _ in range(3):  # best of three: the first run also warms the OS file cache
+            out = subprocess.run([sys.executable, "-c", probe], cwd=here, env=env,
+                                 capture_output=True, text=True, check=True).stdout.split()
+            runs.append(float(out[0]))
+            assert out[1:] == [], f"heavy modules imported at startup: {out[1:]}"
+        assert not os.path.exists(db_path), "importing api must not create or touch the database"
+    best = min(runs)
+    assert best <= STARTUP_BUDGET_S, f"import api took {best:.2f}s (budget {STARTUP_BUDGET_S}s)"
+    ok(f"import api in {best:.2f}s (budget {STARTUP_BUDGET_S}s), no DB work, plotting/HTTP stacks deferred")
+    print("Set 10 checks passed ✅")
+
+
+def test_set11_asgi_parity():
+    print("\n===== Set 11 – ASGI Mode =====")
+    if not ASGI_BASE:
+        info("ASGI_BASE not set; skipping (run `uvicorn asgi:app --port 8001` and set ASGI_BASE)")
+        return
+    h = login("commuter", "commuter")
+    cases = [("/gtfs/routes", {"agency": AGENCY, "page_size": 5}),
+             ("/gtfs/routes", {"agency": "*", "route_type": "x"}),
+             ("/gtfs/stops", {"agency": AGENCY, "q": "1", "page": 2}),
+             ("/gtfs/trips", {"agency": AGENCY, "direction_id": 0, "page_size": 3}),
+             ("/gtfs/trips", {"agency": "NOPE001"})]
+    for path, params in cases:
+        a = get(path, headers=h, **params)
+        b = requests.get(f"{ASGI_BASE}{path}", params=params, headers=h, timeout=60)
+        assert (a.status_code, a.json()) == (b.status_code, b.json()), (path, params, a.text, b.text)
+    ok("Async list endpoints return the same status and JSON as the Flask handlers")
+    r = requests.get(f"{ASGI_BASE}/swagger.json", timeout=30)
+    assert r.status_code == 200 and "/gtfs/routes" in r.json()["paths"], r.status_code
+    ok("Swagger docs are served in ASGI mode")
+    print("Set 11 checks passed ✅")
+
+
+def test_set12_list_serialization():
+    print("\n===== Set 12 – List Serialization =====")
+    h = login("commuter", "commuter")
+    expected = {"routes": {"agency", "route_id", "route_short_name", "route_long_name", "route_type", "summary"},
+                "stops": {"agency", "stop_id", "stop_name", "stop_lat", "stop_lon"},
+                "trips": {"agency", "trip_id", "route_id", "service_id", "trip_headsign", "direction_id"}}
+    for kind, keys in expected.items():
+        r = get(f"/gtfs/{kind}", headers=h, agency=AGENCY, page_size=200)
+        assert r.status_code == 200 and r.headers["Content-Type"].startswith("application/json"), r.status_code
+        j = r.json()
+        assert set(j) == {"agency", "total", "page", "page_size", "items"}, set(j)
+        assert j["items"] and all(set(it) == keys for it in j["items"]), j["items"][:1]
+    ok("Large list pages keep the documented item fields")
+    r = get("/gtfs/routes", headers=h, agency=AGENCY, route_type="x")
+    assert r.status_code == 400 and r.json() == {"error": "route_type must be int"}, r.text
+    ok("List errors return their error body (not a nulled page)")
+    print("Set 12 checks passed ✅")
+
+
+def test_set13_compression():
+    print("\n===== Set 13 – Response Compression =====")
+    r = get("/swagger.json", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200 and r.headers.get("Content-Encoding") == "gzip", r.headers
+    assert "Accept-Encoding" in r.headers.get("Vary", "") and r.json()["paths"], r.headers
+    ok("swagger.json is gzip-encoded when the client accepts it")
+    r = get("/swagger.json", headers={"Accept-Encoding": "identity"})
+    assert r.status_code == 200 and "Content-Encoding" not in r.headers, r.headers
+    r = get("/swagger.json", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in r.headers, r.headers
+    ok("identity and q=0 are honoured")
+    h = login("commuter", "commuter")
+    r = get("/gtfs/stops", headers={**h, "Accept-Encoding": "gzip"}, agency=AGENCY, page_size=1)
+    assert r.status_code == 200 and "Content-Encoding" not in r.headers, r.headers
+    r = get("/gtfs/stops", headers={**h, "Accept-Encoding": "gzip"}, agency=AGENCY, page_size=200)
+    assert r.headers.get("Content-Encoding") == "gzip" and len(r.json()["items"]) > 1, r.headers
+    ok("Small bodies go uncompressed; large list pages are compressed")
+    print("Set 13 checks passed ✅")
+
+
+def test_set14_agency_shards():
+    print("\n===== Set 14 – Per-agency Shards =====")
+    # imports two small synthetic agencies (re-importing one) into a fresh database, then prints list pages
+    probe = """if True:
+        import json, api
+        app = api.create_app({"AUTO_INIT_DB": True})
+        c = app.test_client()
+        h = {"Authorization": c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]}
+        for agency, seed in (("GSBC001", 1), ("GSBC002", 2), ("GSBC001", 3)):
+            r = c.post(f"/gtfs/import/buses/{agency}?synthetic=0.05&seed={seed}", headers=h)
+            assert r.status_code == 200, r.json
+        cases = [("/gtfs/routes", {"agency": "*", "page_size": 3, "page": 2}),
+                 ("/gtfs/stops", {"agency": "GSBC001,GSBC002", "q": "St", "page_size": 50}),
+                 ("/gtfs/trips", {"agency": "GSBC002", "direction_id": 1, "page_size": 5}),
+                 ("/gtfs/trips", {"agency": "GSBC003"})]
+        out = [(r.status_code, r.json) for r in (c.get(p, query_string=q, headers=h) for p, q in cases)]
+        trip = out[2][1]["items"][0]["trip_id"]
+        r = c.post("/gtfs/batch", json={"agency": "GSBC002", "stops_for_trips": [trip]}, headers=h)
+        print(json.dumps(out + [r.json]))
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {mode: _run_probe(probe, tmp=tmp, DATABASE_URL=f"sqlite:///{tmp}/{mode}.sqlite",
+                                    GTFS_SHARD_DIR=os.path.join(tmp, "shards") if mode == "shards" else None)
+                   for mode in ("shared", "shards")}
+        files = sorted(os.listdir(os.path.join(tmp, "shards")))
+    assert files == ["buses_GSBC001.sqlite", "buses_GSBC002.sqlite"], files
+    ok("Each imported agency has one shard file; a re-import replaced it without leftovers")
+    assert results["shards"] == results["shared"], "sharded and single-file responses differ"
+    ok("Merged multi-agency pages, filters, 404s and batch lookups match the single-file layout")
+
+    # shard queries run in _fan_out worker threads still count towards the request and are
+    # slow-logged, with their plan taken from the shard that ran them
+    probe = """if True:
+        import json, api
+        c = api.create_app().test_client()
+        h = {"Authorization": c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]}
+        for agency in ("GSBC001", "GSBC002"):
+            assert c.post(f"/gtfs/import/buses/{agency}?synthetic=0.05", headers=h).status_code == 200
+        explained, explain = [], api._explain
+        api._explain = lambda bind, *a: explained.append(str(bind.url)) or explain(bind, *a)
+        api.SLOW_QUERY_MS = 1e-6
+        api._slow_queries.clear()
+        r = c.get("/gtfs/stops", query_string={"agency": "GSBC001,GSBC002", "page_size": 5}, headers=h)
+        db = [p for p in r.headers["Server-Timing"].split(", ") if p.startswith("db;")][0]
+        slow = [q for q in api._slow_queries if q["request"].startswith("GET /gtfs/stops")]
+
+        def dropped():
+            # an agency dropped (its shard deleted) after the request checked it was imported
+            check = api._ensure_imported
+            def check_then_drop(agency_key):
+                imported = check(agency_key)
+                if agency_key == "buses:GSBC002":
+                    api._shard_path(agency_key).unlink()
+                return imported
+            api._ensure_imported = check_then_drop
+            out = []
+            for request in (lambda: c.get("/gtfs/trips", query_string={"agency": "GSBC002"}, headers=h),
+                            lambda: c.get("/gtfs/stops", query_string={"agency": "GSBC001,GSBC002"}, headers=h),
+                            lambda: c.post("/gtfs/batch", json={"agency": "GSBC002", "trip_ids": ["x"]}, headers=h)):
+                assert c.post("/gtfs/import/buses/GSBC002?synthetic=0.05", headers=h).status_code == 200
+                r = request()
+                out.append((r.status_code, r.json))
+            api._ensure_imported = check
+            return out
+        print(json.dumps({"status": r.status_code, "queries": int(db.split('desc="')[1].split()[0]),
+                          "slow": len(slow), "plans": all(q["plan"] and "failed" not in q["plan"][0] for q in slow),
+                          "shards": sorted({u.rsplit("/", 1)[-1].split("?")[0] for u in explained if "shards" in u}),
+                          "dropped": dropped()}))
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        res = _run_probe(probe, tmp=tmp, GTFS_SHARD_DIR=os.path.join(tmp, "shards"), GTFS_SHARD_THREADS="4")
+    assert res["status"] == 200 and res["queries"] >= 4 and res["slow"] >= 4 and res["plans"], res
+    assert res["shards"] == ["buses_GSBC001.sqlite", "buses_GSBC002.sqlite"], res
+    ok("Fan-out shard queries are counted in Server-Timing and slow-logged with the shard's own query plan")
+    assert res["dropped"] == [[404, {"error": "Agency not imported"}]] * 3, res["dropped"]
+    ok("An agency dropped between the import check and its query is a 404, not a 500")
+    print("Set 14 checks passed ✅")
+
+
+def test_set15_snapshots():
+    print("\n===== Set 15 – Read-only Snapshots =====")
+    # a writer imports and exports two snapshot versions; a read node pulls and serves them
+    probe = """if True:
+        import json, sys, api
+        tmp = sys.argv[1]
+        writer = {"DATABASE_URL": f"sqlite:///{tmp}/writer.sqlite"}
+        reader = {"DATABASE_URL": f"sqlite:///{tmp}/reader.sqlite", "GTFS_SNAPSHOT_DIR": f"{tmp}/snapshots"}
+        cases = [("/gtfs/routes", {"agency": "*", "page_size": 3, "page": 2}),
+                 ("/gtfs/stops", {"agency": "GSBC001,GSBC002", "q": "St", "page_size": 20}),
+                 ("/gtfs/trips", {"agency": "GSBC001", "page_size": 1})]
+
+        def client(config):
+            c = api.create_app(config).test_client()
+            token = c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]
+            return c, {"Authorization": token}
+
+        def export(imports):
+            c, h = client(writer)
+            for agency, seed in imports:
+                assert c.post(f"/gtfs/import/buses/{agency}?synthetic=0.05&seed={seed}", headers=h).status_code == 200
+            pages = [c.get(p, query_string=q, headers=h).json for p, q in cases]
+            out = api.create_app(writer).test_cli_runner().invoke(args=["snapshot-export", "--out", f"{tmp}/out"])
+            assert out.exit_code == 0, out.output
+            return pages, out.output.split()[0]
+
+        pages1, archive1 = export([("GSBC001", 1), ("GSBC002", 2)])
+        runner = api.create_app(reader).test_cli_runner()
+        out = runner.invoke(args=["snapshot-pull", archive1, "--activate"])
+        assert out.exit_code == 0, out.output
+        c, h = client(reader)
+        served1 = [c.get(p, query_string=q, headers=h).json for p, q in cases]
+        refused = c.post("/gtfs/import/buses/GSBC001?synthetic=0.05", headers=h).status_code
+
+        pages2, archive2 = export([("GSBC001", 3)])
+        runner = api.create_app(reader).test_cli_runner()
+        assert runner.invoke(args=["snapshot-pull", archive2]).exit_code == 0
+        c, h = client(reader)
+        still1 = c.get(cases[2][0], query_string=cases[2][1], headers=h).json
+        versions = [v["version"] for v in c.get("/admin/snapshots", headers=h).json["versions"]]
+        switched = c.post(f"/admin/snapshots/{versions[0]}/activate", headers=h).status_code
+        served2 = [c.get(p, query_string=q, headers=h).json for p, q in cases]
+        bogus = []
+        for version in (".", "..", versions[0] + "/..", versions[0].upper()):
+            try:
+                api._activate_snapshot(version)
+            except FileNotFoundError:
+                bogus.append(version)
+        print(json.dumps({"match1": served1 == pages1, "refused": refused, "still1": still1 == pages1[2],
+                          "versions": len(versions), "switched": switched, "match2": served2 == pages2,
+                          "changed": pages2[2]["total"] != pages1[2]["total"], "bogus": len(bogus)}))
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        res = _run_probe(probe, tmp, tmp=tmp)
+    assert res["match1"] and res["refused"] == 409, res
+    ok("A read node serves a pulled snapshot with the writer's responses and refuses imports (409)")
+    assert res["still1"] and res["versions"] == 2 and res["switched"] == 200, res
+    assert res["match2"] and res["changed"], res
+    ok("A newer version is unpacked alongside and activated without a restart")
+    assert res["bogus"] == 4, res
+    ok("Only exporter-shaped version names are activated ('.', '..' and paths are refused)")
+    print("Set 15 checks passed ✅")
+
+
+def test_set16_shared_cache():
+    print("\n===== Set 16 – Shared Cache =====")
+    try:
+        import threading
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        info("fakeredis not installed; skipping (pip install redis fakeredis)")
+        return
+    # node B keeps serving from one process while node A (another process, same database and
+    # cache server) re-imports and deactivates a user; versions are only re-read every 300s, so
+    # node B must learn about both from the broadcast / the shared auth entry
+    node_a = """if True:
+        import api
+        c = api.create_app().test_client()
+        h = {"Authorization": c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]}
+        assert c.post("/gtfs/import/buses/GSBC001?synthetic=0.05&seed=3", headers=h).status_code == 200
+        planner = next(u for u in c.get("/admin/users?role=planner", headers=h).json["items"] if u["username"] == "planner")
+        assert c.patch(f"/admin/users/{planner['id']}", json={"active": False}, headers=h).status_code == 200
+    """
+    node_b = """if True:
+        import json, subprocess, sys, time, api
+        app = api.create_app()
+        c = app.test_client()
+        token = lambda u: {"Authorization": c.post("/auth/login", json={"username": u, "password": u}).json["token"]}
+        h, hp = token("admin"), token("planner")
+        assert c.post("/gtfs/import/buses/GSBC001?synthetic=0.05&seed=1", headers=h).status_code == 200
+        page = lambda: c.get("/gtfs/trips", query_string={"agency": "GSBC001", "page_size": 2}, headers=h).json
+        csv = lambda: c.get("/viz/map", query_string={"agency": "GSBC001", "route_id": page()["items"][0]["route_id"],
+                                                       "format": "csv"}, headers=h).data
+        stats = lambda: dict(api._cache_stats)
+        before, map_before = page(), csv()
+        served = [page(), csv(), c.get("/gtfs/routes", query_string={"agency": "GSBC001"}, headers=hp).status_code]
+        hits = stats()
+        subprocess.run([sys.executable, "-c", sys.argv[1]], check=True)
+        for _ in range(40):   # the broadcast arrives on the subscriber thread
+            if api._cache_versions.get("buses:GSBC001", (1,))[0] > 1:
+                break
+            time.sleep(0.05)
+        after = page()
+        fresh = api.create_app().test_client().get("/gtfs/trips", query_string={"agency": "GSBC001", "page_size": 2},
+                                                   headers=h).json
+        planner = c.get("/gtfs/routes", query_string={"agency": "GSBC001"}, headers=hp).status_code
+        api.create_app({"CACHE_URL": "redis://127.0.0.1:1/0"})   # nothing listening: requests still work
+        down = c.get("/gtfs/trips", query_string={"agency": "GSBC001", "page_size": 2}, headers=h).json == after
+        print(json.dumps({"cached": served[:2] == [before, map_before] and served[2] == 200,
+                          "hits": [hits.get((k, "hit"), 0) for k in ("gtfs", "viz", "auth")],
+                          "changed": after != before and after == fresh, "planner": planner, "down": down}))
+    """
+    server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        res = _run_probe(node_b, node_a, CACHE_URL="redis://%s:%d/0" % server.server_address, CACHE_VERSION_TTL_S="300")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert res["cached"] and all(n > 0 for n in res["hits"]), res
+    ok("Repeated list pages, map renders and auth lookups are served from the shared cache")
+    assert res["changed"], res
+    ok("A re-import on another node invalidates cached pages at once (import-version broadcast)")
+    assert res["planner"] == 403, res
+    ok("Deactivating a user on another node takes effect through the shared auth state")
+    assert res["down"], res
+    ok("An unreachable cache server is treated as a miss")
+
+    # a resubscribe (which forgets every version) landing while versions are being re-read
+    probe = """if True:
+        import json, api
+        api.create_app({"CACHE_URL": "memory://"})
+        mget = api.cache.mget
+        def racing_mget(keys):
+            api._on_invalidation(None)
+            return mget(keys)
+        api.cache.mget = racing_mget
+        print(json.dumps({"versions": api._import_versions(["buses:GSBC001", "buses:GSBC002"])}))
+    """
+    assert _run_probe(probe)["versions"] == [0, 0]
+    ok("Import versions survive the subscriber clearing them mid-read")
+    print("Set 16 checks passed ✅")
+
+
+def test_set17_admission_control():
+    print("\n===== Set 17 – Rate Limits & Concurrency Caps =====")
+    # commuters may render 6 maps a minute with a burst of 2; one render at a time per user
+    probe = """if True:
+        import json, sys, api
+        c = api.create_app().test_client()
+        token = lambda u: {"Authorization": c.post("/auth/login", json={"username": u, "password": u}).json["token"]}
+        if sys.argv[1] == "import":
+            assert c.post("/gtfs/import/buses/GSBC001?synthetic=0.05&seed=1", headers=token("admin")).status_code == 200
+        h = token("commuter")
+        route = c.get("/gtfs/routes", query_string={"agency": "GSBC001"}, headers=h).json["items"][0]["route_id"]
+        render = lambda h: c.get("/viz/map", query_string={"agency": "GSBC001", "route_id": route, "format": "csv"}, headers=h)
+        out = {"renders": [], "retry_after": None}
+        for _ in range(int(sys.argv[2])):
+            r = render(h)
+            out["renders"].append(r.status_code)
+            out["retry_after"] = r.headers.get("Retry-After", out["retry_after"])
+        hp = token("planner")
+        release, _ = api._admit("planner", "planner", "render")   # a render of theirs still in flight
+        out["busy"] = [render(hp).status_code, render(token("admin")).status_code]
+        release()
+        out["busy"].append(render(hp).status_code)
+        out["lists"] = c.get("/gtfs/routes", query_string={"agency": "GSBC001"}, headers=h).status_code
+        print(json.dumps(out))
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(RATE_LIMITS="commuter:render=6/2", CONCURRENCY_LIMITS="render=1/4")
+        local = _run_probe(probe, "import", "3", tmp=tmp, **env)
+        shared = None
+        try:
+            import threading
+            from fakeredis import TcpFakeServer
+            import lupa  # noqa: F401  (fakeredis runs the limiter's Lua scripts with it)
+        except ImportError:
+            info("fakeredis/lupa not installed; skipping the shared limiter (pip install redis fakeredis lupa)")
+        else:
+            server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                env["RATE_LIMIT_URL"] = "redis://%s:%d/0" % server.server_address
+                # two nodes, one after the other
+                shared = [_run_probe(probe, "-", "1", tmp=tmp, **env), _run_probe(probe, "-", "2", tmp=tmp, **env)]
+            finally:
+                server.shutdown()
+                server.server_close()
+    assert local["renders"] == [200, 200, 429] and 1 <= int(local["retry_after"]) <= 10, local
+    assert local["lists"] == 200, local
+    ok("A commuter past their render burst gets 429 with Retry-After; other endpoints are unaffected")
+    assert local["busy"] == [429, 200, 200], local
+    ok("A second concurrent render by the same user is refused until the first finishes")
+    if shared is not None:
+        assert shared[0]["renders"] == [200] and shared[1]["renders"] == [200, 429], shared
+        assert shared[1]["busy"] == [429, 200, 200], shared
+        ok("With RATE_LIMIT_URL, buckets and in-flight caps are shared across nodes")
+
+    # asgi.py serves the list endpoints itself; they must be admitted like the Flask handlers
+    probe = """if True:
+        import asyncio, json, api, asgi, httpx
+        flask_app = api.create_app()
+        c = flask_app.test_client()
+        token = lambda u: {"Authorization": c.post("/auth/login", json={"username": u, "password": u}).json["token"]}
+        assert c.post("/gtfs/import/buses/GSBC001?synthetic=0.05&seed=1", headers=token("admin")).status_code == 200
+        hp, hc = token("planner"), token("commuter")
+        async def run():
+            transport = httpx.ASGITransport(app=asgi.GtfsAsgi(flask_app))
+            async with httpx.AsyncClient(transport=transport, base_url="http://asgi") as ac:
+                lst = lambda h: ac.get("/gtfs/routes", params={"agency": "GSBC001"}, headers=h)
+                rated = [await lst(hp) for _ in range(4)]
+                release, _ = api._admit("commuter", "commuter", "read")   # a read of theirs still in flight
+                busy = (await lst(hc)).status_code
+                release()
+                return {"rated": [r.status_code for r in rated], "retry_after": rated[-1].headers.get("retry-after"),
+                        "busy": [busy, (await lst(hc)).status_code]}
+        print(json.dumps(asyncio.run(run())))
+    """
+    res = _run_probe(probe, RATE_LIMITS="planner:read=60/3", CONCURRENCY_LIMITS="read=1/4")
+    assert res["rated"] == [200, 200, 200, 429] and res["retry_after"], res
+    assert res["busy"] == [429, 200], res
+    ok("ASGI list endpoints apply the same read rate limit and concurrency cap")
+
+    # bulk user provisioning and GTFS imports have separate buckets and caps (default limits)
+    probe = """if True:
+        import json, api
+        c = api.create_app().test_client()
+        h = {"Authorization": c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]}
+        bulk = lambda: c.post("/admin/users/bulk", json={"action": "activate", "users": ["planner"]}, headers=h).status_code
+        imp = lambda: c.post("/gtfs/import/buses/GSBC001?synthetic=0.02", headers=h).status_code
+        held = [api._admit("admin", "admin", "import")[0] for _ in range(2)]   # imports in flight
+        out = {"bulk_during_imports": bulk(), "import_full": imp()}
+        for release in held:
+            release()
+        release, _ = api._admit("admin", "admin", "users")                   # a bulk run in flight
+        out.update(import_during_bulk=imp(), bulk_full=bulk())
+        release()
+        print(json.dumps(out))
+    """
+    res = _run_probe(probe)
+    assert res == {"bulk_during_imports": 200, "import_full": 429, "import_during_bulk": 200, "bulk_full": 429}, res
+    ok("Bulk user provisioning and GTFS imports are admitted independently")
+    print("Set 17 checks passed ✅")
+
+
+def test_set18_route_stats():
+    print("\n===== Set 18 – Route Summaries & Service Statistics =====")
+    probe = """if True:
+        import json, api
+        from sqlalchemy import func
+        c = api.create_app().test_client()
+        h = {"Authorization": c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]}
+        assert c.post("/gtfs/import/buses/GSBC001?synthetic=0.05&seed=1", headers=h).status_code == 200
+        items = c.get("/gtfs/routes", query_string={"agency": "GSBC001", "page_size": 200}, headers=h).json["items"]
+        route = items[0]["route_id"]
+        stats = c.get(f"/gtfs/routes/{route}/stats", query_string={"agency": "GSBC001"}, headers=h).json
+        db, pk = api.SessionLocal(), api._agency_pks_by_key["buses:GSBC001"]
+        trips = db.query(api.Trip.id).filter(api.Trip.agency_pk == pk, api.Trip.route_id == route)
+        starts = (db.query(func.min(api.StopTime.departure_secs)).filter(api.StopTime.trip_pk.in_(trips))
+                  .group_by(api.StopTime.trip_pk).all())
+        expect = {"trips": trips.count(), "first": api._gtfs_time(min(s for s, in starts)),
+                  "stops": db.query(func.count(api.StopTime.stop_pk.distinct()))
+                             .filter(api.StopTime.trip_pk.in_(trips)).scalar()}
+        print(json.dumps({"summaries": [it["summary"] is not None for it in items], "stats": stats, "expect": expect,
+                          "missing": c.get("/gtfs/routes/__nope__/stats", query_string={"agency": "GSBC001"},
+                                           headers=h).status_code}))
+    """
+    res = _run_probe(probe, ADMISSION="0")
+    assert res["summaries"] and all(res["summaries"]), res["summaries"]
+    ok("Every route in /gtfs/routes carries a precomputed summary")
+    s, e = res["stats"]["summary"], res["expect"]
+    assert (s["trip_count"], s["stop_count"], s["first_departure"]) == (e["trips"], e["stops"], e["first"]), res
+    assert sum(d["trip_count"] for d in res["stats"]["directions"]) == s["trip_count"], res["stats"]
+    ok("Route statistics match aggregates over trips and stop_times; directions add up to the route")
+    assert res["missing"] == 404, res["missing"]
+    ok("Statistics of an unknown route return 404")
+    print("Set 18 checks passed ✅")
+
+
+def test_set19_reverse_indexes():
+    print("\n===== Set 19 – Relational Filters & Item Lookups =====")
+    probe = """if True:
+        import json, api
+        c = api.create_app().test_client()
+        h = {"Authorization": c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]}
+        for agency in ("GSBC001", "GSBC002"):
+            assert c.post(f"/gtfs/import/buses/{agency}?synthetic=0.05&seed=1", headers=h).status_code == 200
+        get = lambda path, **q: c.get(path, query_string=q, headers=h)
+        trip = get("/gtfs/trips", agency="GSBC001", page_size=1).json["items"][0]
+        db, pk = api.SessionLocal(), api._agency_pks_by_key["buses:GSBC001"]
+        trip_pk = db.query(api.Trip.id).filter(api.Trip.agency_pk == pk, api.Trip.trip_id == trip["trip_id"]).scalar()
+        calls = (db.query(api.Stop.stop_id, api.Stop.id).join(api.StopTime, api.StopTime.stop_pk == api.Stop.id)
+                 .filter(api.StopTime.trip_pk == trip_pk).order_by(api.StopTime.stop_sequence).all())
+        stop_id, stop_pk = calls[0]
+        serving = (db.query(api.Trip.route_id).join(api.StopTime, api.StopTime.trip_pk == api.Trip.id)
+                   .filter(api.StopTime.stop_pk == stop_pk).distinct())
+        out = {
+            "trip_stops": [[s["stop_id"] for s in get("/gtfs/stops", agency="GSBC001", trip_id=trip["trip_id"],
+                                                       page_size=200).json["items"]], sorted(s for s, _ in calls)],
+            "stop_routes": [[r["route_id"] for r in get("/gtfs/routes", agency="GSBC001", stop_id=stop_id).json["items"]],
+                            sorted(r for (r,) in serving)],
+            "route_stops": get("/gtfs/stops", agency="GSBC001", route_id=trip["route_id"], page_size=200).json["total"],
+            "exact": [get("/gtfs/trips", agency="GSBC001", trip_id=trip["trip_id"]).json["total"],
+                      get("/gtfs/routes", agency="GSBC001", route_id=trip["route_id"]).json["total"],
+                      get("/gtfs/stops", agency="GSBC001", stop_id=stop_id).json["total"]],
+            "trip_item": [get(f"/gtfs/trips/{trip['trip_id']}", agency="GSBC001").json["stops"], [s for s, _ in calls]],
+            "stop_item": get(f"/gtfs/stops/{stop_id}", agency="GSBC001").json["routes"],
+            "route_item": get(f"/gtfs/routes/{trip['route_id']}", agency="GSBC001").json["patterns"],
+            "both": get("/gtfs/routes", agency="GSBC001,GSBC002", stop_id=stop_id).json["items"],
+            "codes": [get(f"/gtfs/trips/{trip['trip_id']}").status_code, get("/gtfs/stops/__nope__").status_code],
+        }
+        print(json.dumps(out))
+    """
+    res = _run_probe(probe, ADMISSION="0")
+    got, want = res["trip_stops"]
+    assert got == want and got, res["trip_stops"]
+    got, want = res["stop_routes"]
+    assert got == want and got, res["stop_routes"]
+    assert res["route_stops"] >= len(res["trip_stops"][1]) and res["exact"] == [1, 1, 1], res
+    ok("stop/route/trip filters agree with stop_times (stops?trip_id, routes?stop_id, exact ids)")
+    assert res["trip_item"][0] == res["trip_item"][1], res["trip_item"]
+    assert res["stop_routes"][1] == res["stop_item"], res["stop_item"]
+    assert sum(p["trip_count"] for p in res["route_item"]) >= 1 and all(p["stops"] for p in res["route_item"]), res
+    ok("Item lookups return a trip's stops in order, a stop's routes and a route's stop patterns")
+    assert {it["agency"] for it in res["both"]} == {"buses:GSBC001", "buses:GSBC002"}, res["both"]
+    assert res["codes"] == [409, 404], res["codes"]
+    ok("Ids are matched per agency; an id found in several agencies without `agency` returns 409")
+    print("Set 19 checks passed ✅")
+
+
+def test_set20_planner_analytics():
+    print("\n===== Set 20 – Planner Analytics =====")
+    probe = """if True:
+        import io, json, api
+        from sqlalchemy import func
+        c = api.create_app().test_client()
+        token = lambda u: {"Authorization": c.post("/auth/login", json={"username": u, "password": u}).json["token"]}
+        h = token("planner")
+        imp = lambda: c.post("/gtfs/import/buses/GSBC001?synthetic=0.05&seed=1", headers=h).status_code
+        assert imp() == 200
+        get = lambda report, **q: c.get(f"/analytics/{report}", query_string=dict(agency="GSBC001", **q), headers=h)
+        timing = lambda r: [p.split(";")[0] for p in r.headers["Server-Timing"].split(", ")]
+        first = get("service-span")
+        span = first.json
+        db, pk = api.SessionLocal(), api._agency_pks_by_key["buses:GSBC001"]
+        row = span["rows"][0]
+        starts = (db.query(func.min(api.StopTime.departure_secs)).join(api.Trip, api.Trip.id == api.StopTime.trip_pk)
+                  .filter(api.Trip.agency_pk == pk, api.Trip.route_id == row["route_id"],
+                          api.Trip.direction_id == row["direction_id"], api.Trip.service_id == row["service_id"])
+                  .group_by(api.StopTime.trip_pk).all())
+        served = db.query(func.count(api.StopTime.stop_pk.distinct())).scalar()
+        out = {"span": [row["trips"], row["first_departure"], len(starts), api._gtfs_time(min(s for s, in starts))],
+               "trips": [span["summary"]["trips"], db.query(api.Trip).count()],
+               "stops": [get("stops").json["summary"]["served"], served],
+               "headways": get("headways", route_id=row["route_id"]).json["summary"]["routes"],
+               "csv": get("stops", format="csv").data.decode().splitlines()[0],
+               "parquet": None,
+               "timing": [timing(first), timing(get("headways", format="csv"))],
+               "commuter": c.get("/analytics/stops", query_string={"agency": "GSBC001"}, headers=token("commuter")).status_code,
+               "unknown": get("nope").status_code}
+        try:
+            import pandas as pd, pyarrow  # noqa: F401
+            out["parquet"] = len(pd.read_parquet(io.BytesIO(get("stops", format="parquet").data)))
+        except ImportError:
+            pass
+        assert imp() == 200
+        out["timing"].append(timing(get("stops")))
+        print(json.dumps(out))
+    """
+    res = _run_probe(probe, ADMISSION="0")
+    trips, first, n, earliest = res["span"]
+    assert (trips, first) == (n, earliest), res["span"]
+    assert res["trips"][0] == res["trips"][1] and res["stops"][0] == res["stops"][1], res
+    assert res["headways"] == 1, res["headways"]
+    ok("Service span, headways and stop coverage agree with SQL over trips/stop_times")
+    assert res["csv"].startswith("stop_id,stop_name,stop_lat,stop_lon,trips,routes"), res["csv"]
+    if res["parquet"] is None:
+        info("pyarrow not installed; skipping the Parquet export check")
+    else:
+        assert res["parquet"] == res["stops"][1], res["parquet"]
+        ok("Reports export as CSV and Parquet")
+    cold, warm, after_import = res["timing"]
+    assert "extract" in cold and "extract" not in warm and "extract" in after_import, res["timing"]
+    ok("One pass serves every report and format until the agency is re-imported")
+    assert res["commuter"] == 403 and res["unknown"] == 404, res
+    ok("Analytics are planner/admin only; unknown reports return 404")
+
+    # an analysis blocks only requests for that agency's import, and runs once for all of them
+    probe = """if True:
+        import json, threading, time, api
+        started, gate, runs = threading.Event(), threading.Event(), []
+        def slow_analysis(agency_key):
+            runs.append(agency_key)
+            started.set()
+            gate.wait(10)
+            return {"report": agency_key}
+        api._analyze_agency, api._import_marker = slow_analysis, lambda agency_key: "m"
+        api._analytics_memo[("buses:GSBC002", "m")] = {"report": "buses:GSBC002"}
+        got = []
+        waiting = [threading.Thread(target=lambda: got.append(api._agency_analysis("buses:GSBC001")))
+                   for _ in range(3)]
+        for t in waiting:
+            t.start()
+        started.wait(10)
+        t0 = time.perf_counter()
+        other = api._agency_analysis("buses:GSBC002")
+        other_s = time.perf_counter() - t0
+        blocked = not gate.is_set() and not got
+        gate.set()
+        for t in waiting:
+            t.join()
+        print(json.dumps({"other": other, "other_s": other_s, "blocked": blocked, "runs": runs, "got": got,
+                          "locks": len(api._analyses)}))
+    """
+    res = _run_probe(probe)
+    assert res["other"] == {"report": "buses:GSBC002"} and res["other_s"] < 1 and res["blocked"], res
+    assert res["runs"] == ["buses:GSBC001"] and res["got"] == [{"report": "buses:GSBC001"}] * 3, res
+    assert res["locks"] == 0, res
+    ok("A running analysis does not hold up memo hits or other agencies; concurrent requests share one pass")
+    print("Set 20 checks passed ✅")
+
+
+def test_set21_reachability():
+    print("\n===== Set 21 – Reachability =====")
+    probe = """if True:
+        import json, api
+        c = api.create_app().test_client()
+        token = lambda u: {"Authorization": c.post("/auth/login", json={"username": u, "password": u}).json["token"]}
+        h = token("commuter")
+        assert c.post("/gtfs/import/buses/GSBC001?synthetic=0.05&seed=1", headers=token("planner")).status_code == 200
+        db = api.SessionLocal()
+        pk = api._agency_pks(db, ["buses:GSBC001"])["buses:GSBC001"]
+        # reference: a plain earliest-arrival scan over the WEEKDAY stop_times rows, in SQL order
+        rows = (db.query(api.StopTime.trip_pk, api.Stop.stop_id, api.StopTime.arrival_secs, api.StopTime.departure_secs)
+                .join(api.Trip, api.Trip.id == api.StopTime.trip_pk).join(api.Stop, api.Stop.id == api.StopTime.stop_pk)
+                .filter(api.Trip.agency_pk == pk, api.Trip.service_id == "WEEKDAY")
+                .order_by(api.StopTime.trip_pk, api.StopTime.stop_sequence).all())
+        hops = sorted((d, a, u, v, t) for (t, u, _, d), (t2, v, a, _) in zip(rows, rows[1:]) if t == t2)
+        source = max({u for _, _, u, _, _ in hops}, key=lambda s: sum(u == s for _, _, u, _, _ in hops))
+        depart, budget = 8 * 3600, 90 * 60
+        best, boarded = {source: depart}, set()
+        for d, a, u, v, t in hops:
+            if depart <= d <= depart + budget and (t in boarded or best.get(u, 1e9) <= d):
+                boarded.add(t)
+                best[v] = min(best.get(v, 1e9), a)
+        expected = {s: api._gtfs_time(a) for s, a in best.items() if s != source and a - depart <= budget}
+        get = lambda **q: c.get(f"/gtfs/stops/{source}/reachable", query_string={"max_minutes": 90, **q}, headers=h)
+        timing = lambda r: [p.split(";")[0] for p in r.headers["Server-Timing"].split(", ")]
+        first = get(depart="08:00")
+        out = {"got": {s["stop_id"]: s["arrival"] for s in first.json["stops"]}, "expected": expected,
+               "service": first.json["service_id"],
+               "timing": [timing(first), timing(get(depart="08:05:30")), timing(get(depart="09:00"))],
+               "geojson": [get(format="geojson").json["type"], get(format="geojson").content_type],
+               "png": get(format="png").content_type,
+               "bad": [get(depart="8am").status_code, get(max_minutes=0).status_code, get(service_id="NOPE").status_code,
+                       c.get("/gtfs/stops/NOPE/reachable", headers=h).status_code],
+               "bad_png": [get(format="png", **{k: v}).status_code
+                           for k, v in (("dpi", 0), ("width", -5), ("height", 99999), ("dpi", 301), ("width", "wide"))]}
+        print(json.dumps(out))
+    """
+    res = _run_probe(probe, ADMISSION="0")
+    assert res["service"] == "WEEKDAY" and res["got"] and res["got"] == res["expected"], res
+    ok(f"{len(res['got'])} stops reachable in 90 min, with the same arrivals as a plain scan of stop_times")
+    first, same_bucket, next_bucket = res["timing"]
+    assert "timetable" not in first and "scan" in first, first
+    assert "scan" not in same_bucket and "scan" in next_bucket, res["timing"]
+    ok("Timetable built by the import; one profile search answers every departure in its time bucket")
+    assert res["geojson"] == ["FeatureCollection", "application/geo+json"] and res["png"] == "image/png", res
+    ok("Results render as GeoJSON and PNG")
+    assert res["bad"] == [400, 400, 400, 404], res["bad"]
+    assert res["bad_png"] == [400] * 5, res["bad_png"]
+    ok("Invalid depart/max_minutes/service_id and PNG sizes outside 100-4000 px / 50-300 dpi return 400; unknown stops 404")
+
+    # a timetable load blocks only requests for that agency's import, and runs once for all of them
+    probe = """if True:
+        import json, threading, time, api
+        started, gate, loads = threading.Event(), threading.Event(), []
+        def slow_load(cls, agency_key):
+            loads.append(agency_key)
+            started.set()
+            gate.wait(10)
+            return f"timetable of {agency_key}"
+        api._Timetable.load = classmethod(slow_load)
+        api._remember_timetable(("buses:GSBC002", "m2"), "timetable of buses:GSBC002")
+        got = []
+        waiting = [threading.Thread(target=lambda: got.append(api._agency_timetable("buses:GSBC001", "m1")))
+                   for _ in range(3)]
+        for t in waiting:
+            t.start()
+        started.wait(10)
+        t0 = time.perf_counter()
+        other = api._agency_timetable("buses:GSBC002", "m2")
+        other_s = time.perf_counter() - t0
+        blocked = not gate.is_set() and not got
+        gate.set()
+        for t in waiting:
+            t.join()
+        print(json.dumps({"other": other, "other_s": other_s, "blocked": blocked, "loads": loads, "got": got,
+                          "locks": len(api._timetable_loads)}))
+    """
+    res = _run_probe(probe)
+    assert res["other"] == "timetable of buses:GSBC002" and res["other_s"] < 1 and res["blocked"], res
+    assert res["loads"] == ["buses:GSBC001"] and res["got"] == ["timetable of buses:GSBC001"] * 3, res
+    assert res["locks"] == 0, res
+    ok("Loading one agency's timetable does not hold up others; concurrent first requests share one load")
+    print("Set 21 checks passed ✅")
+
+
+def test_set22_user_bulk_provisioning():
+    print("\n===== Set 22 – User Listing & Bulk Provisioning =====")
+    h_admin = login("admin", "admin")
+    stamp = int(time.time() * 1000) % 10**8
+    names = [f"bulk{stamp}_{i}" for i in range(6)]
+    users = [{"username": n, "password": "pw", "role": "commuter"} for n in names]
+    users += [{"username": names[0], "password": "pw", "role": "commuter"},   # repeated in the request
+              {"username": "planner", "password": "pw", "role": "planner"},   # exists already
+              {"username": f"bulk{stamp}_admin", "password": "pw", "role": "admin"}]
+    r = post("/admin/users/bulk", headers=h_admin, json={"action": "create", "users": users})
+    assert r.status_code == 200, f"bulk create failed: {r.status_code} {r.text}"
+    rep = r.json()
+    assert (rep["total"], rep["ok"], rep["failed"]) == (9, 6, 3), {k: v for k, v in rep.items() if k != "results"}
+    assert [x["status"] for x in rep["results"]] == ["created"] * 6 + ["error"] * 3, rep["results"]
+    assert all(x["id"] for x in rep["results"][:6]), rep["results"]
+    ok(f"Bulk create: 6 created, 3 rejected with per-user reasons (hashing {rep['hash_s']}s, writes {rep['write_s']}s)")
+    assert post("/auth/login", json={"username": names[5], "password": "pw"}).status_code == 200
+    ok("Bulk-created user can log in")
+
+    h_user = login(names[1], "pw")
+    r = post("/admin/users/bulk", headers=h_admin, json={"action": "deactivate", "users": names[:3] + ["admin", f"ghost{stamp}"]})
+    assert r.status_code == 200, r.text
+    assert [x["status"] for x in r.json()["results"]] == ["deactivated"] * 3 + ["error", "error"], r.json()["results"]
+    assert get("/gtfs/routes", headers=h_user, agency="GSBC001").status_code == 403
+    ok("Bulk deactivate takes effect at once; the Admin account and unknown names are refused")
+
+    r = get("/admin/users", headers=h_admin, role="commuter", active="false", page_size=200)
+    assert r.status_code == 200, r.text
+    page = r.json()
+    inactive = {u["username"] for u in page["items"]}
+    assert set(names[:3]) <= inactive and not inactive & set(names[3:]), inactive
+    assert all(u["role"] == "commuter" and not u["active"] for u in page["items"]) and page["page_size"] == 200
+    r = get("/admin/users", headers=h_admin, page_size=2, page=2)
+    assert r.status_code == 200 and len(r.json()["items"]) == 2 and r.json()["total"] >= 9, r.text
+    assert get("/admin/users", headers=h_admin, active="maybe").status_code == 400
+    ok("User list pages and filters by role and active")
+
+    r = post("/admin/users/bulk", headers=h_admin, json={"action": "activate", "users": names[:2]})
+    assert [x["status"] for x in r.json()["results"]] == ["activated"] * 2, r.text
+    assert post("/admin/users/bulk", headers=h_admin, json={"action": "promote", "users": names}).status_code == 400
+    r = post("/admin/users/bulk", headers=h_admin, json=[{"action": "activate", "users": names}])
+    assert r.status_code == 400 and r.json()["error"] == "body must be a JSON object", r.text
+    assert post("/admin/users/bulk", headers=login("planner", "planner"),
+                json={"action": "activate", "users": names}).status_code == 403
+    ok("Bulk activate works; unknown actions and non-object bodies 400, non-admins 403")
+    for u in get("/admin/users", headers=h_admin, role="commuter", page_size=200).json()["items"]:
+        if u["username"] in names:
+            requests.delete(f"{BASE}/admin/users/{u['id']}", headers=h_admin, timeout=30)
+    print("Set 22 checks passed ✅")
+
+
+def test_set23_import_sources():
+    print("\n===== Set 23 – Import Sources =====")
+    # one synthetic feed imported as a raw body, a multipart upload, a `path` and a `url` (Flask and ASGI);
+    # a small local HTTP server stands in for a feed mirror
+    probe = """if True:
+        import asyncio, io, json, os, socket, sys, threading, zipfile, api, asgi, gtfs_synth, httpx
+        from http.server import HTTPServer, SimpleHTTPRequestHandler
+        feeds = sys.argv[1]
+        with open(os.path.join(feeds, "feed.zip"), "wb") as f:
+            gtfs_synth.write_feed(f, scale=0.02, seed=3)
+        body = open(os.path.join(feeds, "feed.zip"), "rb").read()
+        # the same feed with one malformed arrival time (HH:MM instead of HH:MM:SS)
+        bad_time = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(body)) as src, zipfile.ZipFile(bad_time, "w") as dst:
+            for name in src.namelist():
+                data = src.read(name).decode()
+                if name == "stop_times.txt":
+                    lines = data.splitlines(keepends=True)
+                    cols = lines[1].split(",")
+                    cols[lines[0].split(",").index("arrival_time")] = "8:05"
+                    lines[1] = ",".join(cols)
+                    data = "".join(lines)
+                dst.writestr(name, data)
+        bad_time = bad_time.getvalue()
+
+        class Mirror(SimpleHTTPRequestHandler):
+            def __init__(self, *a, **kw):
+                super().__init__(*a, directory=feeds, **kw)
+            def do_GET(self):
+                hosts.append(self.headers["Host"])
+                if self.path == "/moved":
+                    self.send_response(302)
+                    self.send_header("Location", "/feed.zip")
+                    self.end_headers()
+                    return
+                super().do_GET()
+            def log_message(self, *a):
+                pass
+        hosts = []
+        server = HTTPServer(("127.0.0.1", 0), Mirror)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+
+        flask_app = api.create_app()
+        c = flask_app.test_client()
+        h = {"Authorization": c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]}
+        target = "/gtfs/import/buses/GSBC001"
+        def status(r):
+            return r.status_code, r.json.get("rows", r.json.get("error"))
+        out = {
+            "raw": status(c.post(target, data=body, headers=h, content_type="application/zip")),
+            "multipart": status(c.post(target, data={"file": (io.BytesIO(body), "feed.zip")}, headers=h)),
+            "path": status(c.post(target, query_string={"path": "feed.zip"}, headers=h)),
+            "url": status(c.post(target, query_string={"url": f"http://127.0.0.1:{port}/feed.zip"}, headers=h)),
+            "traversal": c.post(target, query_string={"path": "../app.sqlite"}, headers=h).status_code,
+            "missing": c.post(target, query_string={"path": "nope.zip"}, headers=h).status_code,
+            "too_large": c.post(target, data=bytes(1024 * 1024 + 1), headers=h, content_type="application/zip").status_code,
+            "not_zip": c.post(target, data=b"PK-not-a-zip", headers=h, content_type="application/zip").status_code,
+            "bad_time": status(c.post(target, data=bad_time, headers=h, content_type="application/zip")),
+            "scheme": c.post(target, query_string={"url": "file:///etc/passwd"}, headers=h).status_code,
+            "redirect": c.post(target, query_string={"url": f"http://127.0.0.1:{port}/moved"}, headers=h).status_code,
+            "rejected": {u: c.post(target, query_string={"url": u}, headers=h).status_code
+                         for u in (f"http://localhost:{port}/feed.zip", "http://169.254.169.254/latest/meta-data/",
+                                   "http://10.1.2.3/feed.zip", "http://[::1]/feed.zip")},
+        }
+
+        async def via_asgi():
+            transport = httpx.ASGITransport(app=asgi.GtfsAsgi(flask_app))
+            async with httpx.AsyncClient(transport=transport, base_url="http://asgi") as ac:
+                codes = {}
+                for name, u in (("url", f"http://127.0.0.1:{port}/feed.zip"),
+                                ("rejected", f"http://localhost:{port}/feed.zip"),
+                                ("metadata", "http://169.254.169.254/latest/meta-data/")):
+                    r = await ac.post(target, params={"url": u}, headers=h)
+                    codes[name] = r.status_code
+                r = await ac.post(target, content=bad_time, headers={**h, "Content-Type": "application/zip"})
+                codes["bad_time"] = r.status_code
+                return codes
+        out["asgi"] = asyncio.run(via_asgi())
+
+        # a vetted url is fetched from the address that was checked: the host is not looked up again
+        # (a rebinding DNS server could answer that lookup with a private address), yet it is still
+        # named in the Host header
+        lookups, resolve = [], socket.getaddrinfo
+        socket.getaddrinfo = lambda host, *a, **kw: lookups.append(host) or resolve(host, *a, **kw)
+        pinned = f"http://rebind.test:{port}/feed.zip"
+        del hosts[:]
+        flask_path = api._download_zip(pinned, redirects=False, address="127.0.0.1")
+        asgi_path = asyncio.run(asgi.GtfsAsgi(flask_app)._download(pinned, None, True, address="127.0.0.1"))
+        socket.getaddrinfo = resolve
+        out["pinned"] = {"same": [open(p, "rb").read() == body for p in (flask_path, asgi_path)],
+                         "hosts": hosts, "port": port, "lookups": "rebind.test" in lookups}
+        server.shutdown()
+        print(json.dumps(out))
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        feeds = os.path.join(tmp, "feeds")
+        os.mkdir(feeds)
+        res = _run_probe(probe, feeds, tmp=tmp, ADMISSION="0", GTFS_LOCAL_DIR=feeds, GTFS_MAX_ZIP_MB="1",
+                         GTFS_URL_ALLOWLIST="127.0.0.1")
+    sources = [res[k] for k in ("raw", "multipart", "path", "url")]
+    assert all(code == 200 for code, _ in sources) and len({json.dumps(rows) for _, rows in sources}) == 1, sources
+    ok("Raw body, multipart upload, `path` and allow-listed `url` import the same feed with the same row counts")
+    assert (res["traversal"], res["missing"]) == (403, 404), res
+    assert (res["too_large"], res["not_zip"]) == (413, 400), res
+    ok("`path` outside GTFS_LOCAL_DIR is 403, unknown feeds 404; oversized uploads 413, non-zips 400")
+    assert res["bad_time"] == res["raw"], (res["bad_time"], res["raw"])
+    ok("A malformed stop time imports as a blank time instead of failing the feed")
+    assert res["scheme"] == 400 and res["redirect"] == 404, res
+    assert set(res["rejected"].values()) == {403}, res["rejected"]
+    assert res["asgi"] == {"url": 200, "rejected": 403, "metadata": 403, "bad_time": 200}, res["asgi"]
+    ok("`url` hosts resolving to loopback/private/link-local addresses are refused (Flask and ASGI); redirects are not followed")
+    pinned = res["pinned"]
+    assert pinned["same"] == [True, True] and not pinned["lookups"], pinned
+    assert pinned["hosts"] == [f"rebind.test:{pinned['port']}"] * 2, pinned
+    ok("Vetted urls are fetched from the checked address with the original Host header (no second DNS lookup)")
+    print("Set 23 checks passed ✅")
+
+
+def test_set24_synthetic_feeds():
+    print("\n===== Set 24 – Synthetic Feeds =====")
+    import gtfs_synth
+    a, b = gtfs_synth.build_feed(scale=0.05, seed=7), gtfs_synth.build_feed(scale=0.05, seed=7)
+    assert a == b and a != gtfs_synth.build_feed(scale=0.05, seed=8), "same scale and seed must give the same bytes"
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "gtfs_synth.py"),
+                        "--scale", "0.05", "--seed", "7", "--out-dir", tmp, "--agencies", "GSBC001,GSBC002"],
+                       check=True, capture_output=True)
+        cli = [open(os.path.join(tmp, f"{ag}.zip"), "rb").read() for ag in ("GSBC001", "GSBC002")]
+    assert cli[0] == gtfs_synth.build_feed(scale=0.05, seed=gtfs_synth.agency_seed(7, "GSBC001")), "CLI and library differ"
+    assert cli[0] != cli[1], "agencies generated from one seed must differ"
+    ok("Feeds are byte-identical for the same scale and seed; per-agency seeds give different networks")
+
+    probe = """if True:
+        import io, json, api, gtfs_synth
+        def client(allow):
+            c = api.create_app({"ALLOW_SYNTHETIC_IMPORT": allow}).test_client()
+            return c, {"Authorization": c.post("/auth/login", json={"username": "admin", "password": "admin"}).json["token"]}
+        off, h = client(False)
+        on, h = client(True)
+        expect = gtfs_synth.write_feed(io.BytesIO(), scale=0.05, seed=gtfs_synth.agency_seed(4, "GSBC001"))
+        print(json.dumps({
+            "off": off.post("/gtfs/import/buses/GSBC001?synthetic=0.05", headers=h).status_code,
+            "off_bulk": off.post("/admin/import/bulk", json={"source": "synthetic", "scale": 0.05}, headers=h).status_code,
+            "too_big": on.post("/gtfs/import/buses/GSBC001?synthetic=2", headers=h).status_code,
+            "on": on.post("/gtfs/import/buses/GSBC001?synthetic=0.05&seed=4", headers=h).json["rows"],
+            "expect": {f"gtfs_{name[:-4]}": n for name, n in expect.items()},
+        }))
+    """
+    res = _run_probe(probe, ADMISSION="0")
+    assert (res["off"], res["off_bulk"], res["too_big"]) == (403, 403, 400), res
+    ok("Synthetic imports over HTTP are off without ALLOW_SYNTHETIC_IMPORT; scale is capped at SYNTHETIC_MAX_SCALE")
+    assert all(res["expect"][table] == n for table, n in res["on"].items()), res
+    ok(f"An imported synthetic feed has exactly the generated rows ({res['on']['gtfs_stop_times']} stop_times)")
+    print("Set 24 checks passed ✅")
+
+
+def test_set25_bulk_import():
+    print("\n===== Set 25 – Bulk Import =====")
+    # GTFS_LOCAL_DIR holds two good feeds, one that is not a zip, and none for GSBC004
+    probe = """if True:
+        import json, os, sys, api, gtfs_synth
+        feeds = sys.argv[1]
+        for agency, seed in (("GSBC001", 1), ("GSBC002", 2)):
+            gtfs_synth.write_feed(os.path.join(feeds, f"{agency}.zip"), scale=0.03, seed=seed)
+        with open(os.path.join(feeds, "GSBC003.zip"), "wb") as f:
+            f.write(b"not a zip")
+        c = api.create_app().test_client()
+        token = lambda u: {"Authorization": c.post("/auth/login", json={"username": u, "password": u}).json["token"]}
+        h = token("admin")
+        bulk = lambda body, headers=h: c.post("/admin/import/bulk", json=body, headers=headers)
+        r = bulk({"source": "local", "agencies": ["GSBC001", "GSBC002", "GSBC003", "GSBC004"], "fetchers": 2})
+        single = c.post("/gtfs/import/buses/GSBC009", query_string={"path": "GSBC002.zip"}, headers=h).json["rows"]
+        listed = c.get("/gtfs/routes", query_string={"agency": "GSBC001,GSBC002", "page_size": 1}, headers=h).json
+        print(json.dumps({
+            "status": r.status_code, "report": r.json, "single": single, "routes": listed["total"],
+            "history": c.get("/admin/imports/buses/GSBC001", headers=h).status_code,
+            "string": [a["agency"] for a in bulk({"source": "local", "agencies": "GSBC001, GSBC002"}).json["agencies"]],
+            "bad": [bulk(body).status_code for body in ({"agencies": 5}, {"agencies": [1]}, {"agencies": ["NOPE001"]},
+                                                          {"source": "ftp"}, {"mode": "trains"})],
+            "array": c.post("/admin/import/bulk", json=[1], headers=h).status_code,
+            "planner": bulk({"source": "local", "agencies": ["GSBC001"]}, token("planner")).status_code,
+        }))
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        feeds = os.path.join(tmp, "feeds")
+        os.mkdir(feeds)
+        res = _run_probe(probe, feeds, tmp=tmp, ADMISSION="0", GTFS_LOCAL_DIR=feeds)
+    assert res["status"] == 200, res
+    rep = res["report"]
+    by = {a["agency"]: a for a in rep["agencies"]}
+    assert (rep["ok"], rep["failed"]) == (2, 2) and list(by) == [f"buses:GSBC00{i}" for i in range(1, 5)], rep
+    for key in ("buses:GSBC001", "buses:GSBC002"):
+        assert by[key]["status"] == "ok" and by[key]["bytes"] > 0 and by[key]["rows"]["gtfs_stop_times"] > 0, by[key]
+        assert all(by[key][k] >= 0 for k in ("fetch_s", "parse_s", "write_s", "import_s")), by[key]
+    assert by["buses:GSBC002"]["rows"] == res["single"], (by["buses:GSBC002"]["rows"], res["single"])
+    assert res["routes"] > 0 and res["history"] == 200, res
+    ok(f"Report lists bytes, rows and fetch/parse/write seconds per agency ({rep['wall_s']}s wall)")
+    assert by["buses:GSBC003"]["status"] == "error" and by["buses:GSBC003"]["error"].startswith("import:"), by
+    assert by["buses:GSBC004"]["status"] == "error" and by["buses:GSBC004"]["error"].startswith("fetch:"), by
+    ok("A bad feed or a missing one fails only that agency; the others are imported")
+    assert res["string"] == ["buses:GSBC001", "buses:GSBC002"], res["string"]
+    assert res["bad"] == [400] * 5 and res["array"] == 400 and res["planner"] == 403, res
+    ok("`agencies` may be a comma-separated string; other bad bodies 400, non-admins 403")
+    print("Set 25 checks passed ✅")
+
+
+def test_set26_parallel_import():
+    print("\n===== Set 26 – Parallel Import & Schema Upgrades =====")
+    # a GTFS table left from an older schema: the app refuses it until `init-db --reset-gtfs`
+    probe = """if True:
+        import json, sqlite3, sys, api
+        con = sqlite3.connect(sys.argv[1])
+        con.execute("CREATE TABLE gtfs_stop_times (id INTEGER PRIMARY KEY, trip_id TEXT, stop_id TEXT)")
+        con.commit()
+        con.close()
+        app = api.create_app()
+        first = app.test_client().get("/gtfs/routes", query_string={"agency": "GSBC001"})
+        cli = app.test_cli_runner()
+        refused, reset = cli.invoke(args=["init-db"]), cli.invoke(args=["init-db", "--reset-gtfs"])
+        print(json.dumps({"first": [first.status_code, first.json["error"]],
+                          "refused": [refused.exit_code, refused.output], "reset": reset.exit_code,
+                          "columns": [c["name"] for c in api.inspect(api.engine).get_columns("gtfs_stop_times")],
+                          "after": app.test_client().post("/auth/login", json={"username": "admin", "password": "admin"}).status_code}))
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "app.sqlite")
+        res = _run_probe(probe, db, tmp=tmp)
+    assert res["first"][0] == 503 and "--reset-gtfs" in res["first"][1], res["first"]
+    assert res["refused"][0] != 0 and "gtfs_stop_times" in res["refused"][1], res["refused"]
+    ok("An outdated GTFS table is not dropped on start: requests get 503 and `init-db` names the table")
+    assert res["reset"] == 0 and "trip_pk" in res["columns"] and res["after"] == 200, res
+    ok("`init-db --reset-gtfs` drops and recreates it")
+
+    # the same feed parsed inline in one piece and in 64 KB stop_times chunks across two processes
+    probe = """if True:
+        import hashlib, json, api, gtfs_synth
+        from concurrent.futures import ProcessPoolExecutor
+        api.create_app()
+        api.init_db()
+        feed = gtfs_synth.build_feed(scale=0.05, seed=5)
+        db = api.SessionLocal()
+        serial = api._import_gtfs(db, "buses:GSBC001", feed)
+        api.PARSE_CHUNK_BYTES = 64 * 1024
+        with api._open_zip(feed) as z:
+            chunks = sum(1 for fn, _ in api._parse_tasks(z, feed, []) if fn is api._parse_range)
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            chunked = api._import_gtfs(db, "buses:GSBC002", feed, pool=pool, workers=2)
+        def digest(key):
+            pk = api._agency_pks(db, [key])[key]
+            rows = (db.query(api.Trip.trip_id, api.StopTime.stop_sequence, api.Stop.stop_id,
+                             api.StopTime.arrival_secs, api.StopTime.departure_secs)
+                    .join(api.Trip, api.Trip.id == api.StopTime.trip_pk).join(api.Stop, api.Stop.id == api.StopTime.stop_pk)
+                    .filter(api.Trip.agency_pk == pk).order_by(api.Trip.trip_id, api.StopTime.stop_sequence))
+            return hashlib.sha256(repr(rows.all()).encode()).hexdigest()
+        print(json.dumps({"serial": serial["rows"], "chunked": chunked["rows"], "chunks": chunks,
+                          "same": digest("buses:GSBC001") == digest("buses:GSBC002")}))
+    """
+    res = _run_probe(probe)
+    assert res["chunks"] > 1, res
+    assert res["serial"] == res["chunked"] and res["same"], res
+    ok(f"stop_times in {res['chunks']} chunks over a process pool give the same rows as a serial parse "
+       f"({res['serial']['gtfs_stop_times']} stop_times)")
+    print("Set 26 checks passed ✅")
+
+
+def test_set27_bench_smoke():
+    print("\n===== Set 27 – Benchmark Smoke Test =====")
+    # a tiny bench.py run: results file, then --compare against a baseline with one impossible p95
+    probe = """if True:
+        import contextlib, io, json, os, sys, bench
+        tmp = sys.argv[1]
+        baseline = {"results": {"client/routes_page/c1": {"p95_ms": 0.001, "rps": 1.0},
+                                "client/stops_search/c1": {"p95_ms": 1e9, "rps": 0.001}}}
+        with open(os.path.join(tmp, "baseline.json"), "w") as f:
+            json.dump(baseline, f)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            code = bench.main(["--driver", "client", "--scale", "0.02", "--concurrency", "1,2", "--requests", "5",
+                               "--scenarios", "routes_page,stops_search", "--import-runs", "1",
+                               "--out", os.path.join(tmp, "results.json"), "--compare", os.path.join(tmp, "baseline.json")])
+        with open(os.path.join(tmp, "results.json")) as f:
+            results = json.load(f)
+        print(json.dumps({"code": code, "results": results, "report": out.getvalue().splitlines()}))
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        res = _run_probe(probe, tmp, tmp=tmp)
+    results = res["results"]["results"]
+    expected = {f"client/{s}/c{c}" for s in ("routes_page", "stops_search") for c in (1, 2)} | {"client/import/c1"}
+    assert expected <= set(results), sorted(results)
+    assert all(r["errors"] == 0 and r["requests"] > 0 and 0 < r["p50_ms"] <= r["p95_ms"] <= r["max_ms"]
+               for r in results.values()), results
+    assert res["results"]["meta"]["totals"]["routes"] > 0, res["results"]["meta"]
+    ok(f"bench.py records p50/p95/p99 and req/s for every scenario and concurrency ({len(results)} series)")
+    report = [line.split() for line in res["report"]]
+    assert res["code"] == 1, res["report"][-5:]
+    assert ["REGRESSION", "client/routes_page/c1", "p95_ms"] in [r[:3] for r in report], res["report"][-5:]
+    assert ["ok", "client/stops_search/c1", "p95_ms"] in [r[:3] for r in report], res["report"][-5:]
+    ok("--compare flags a regression against the baseline and exits 1")
+    print("Set 27 checks passed ✅")
+
+
+def test_set28_app_factory_and_workers():
+    print("\n===== Set 28 – App Factory & Pre-forked Workers =====")
+    probe = """if True:
+        import json, os, sys, api
+        a, b = (f"sqlite:///{os.path.join(sys.argv[1], n)}.sqlite" for n in ("a", "b"))
+        login = lambda app: app.test_client().post("/auth/login", json={"username": "admin", "password": "admin"}).status_code
+        app_a = api.create_app({"DATABASE_URL": a})
+        first = login(app_a)
+        engine_a = api.engine
+        same = api.create_app({"DATABASE_URL": a}).config["DATABASE_URL"] == a and api.engine is engine_a
+        app_b = api.create_app({"DATABASE_URL": b, "AUTO_INIT_DB": False})
+        before = os.path.exists(os.path.join(sys.argv[1], "b.sqlite")) and api.inspect(api.engine).has_table("users")
+        api.init_db()
+        print(json.dumps({"first": first, "same": same, "switched": api.engine is not engine_a,
+                          "before_init": before, "after_init": login(app_b)}))
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        res = _run_probe(probe, tmp, tmp=tmp)
+    assert res == {"first": 200, "same": True, "switched": True, "before_init": False, "after_init": 200}, res
+    ok("create_app applies config overrides, reuses the engine for the same DATABASE_URL and swaps it for another")
+
+    def children(pid):
+        kids = []
+        for entry in filter(str.isdigit, os.listdir("/proc")):
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:   # field 4: parent pid
+                        kids.append(int(entry))
+            except (OSError, ValueError, IndexError):
+                continue
+        return sorted(kids)
+
+    if not os.path.isdir("/proc") or not hasattr(os, "fork"):
+        info("no /proc or fork(); skipping the serve.py worker checks")
+        print("Set 28 checks passed ✅")
+        return
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {k: v for k, v in os.environ.items() if k not in _PROBE_ENV_DROP}
+        env.update(DATABASE_URL=f"sqlite:///{tmp}/app.sqlite", GTFS_PARSE_WORKERS="1")
+        proc = subprocess.Popen([sys.executable, "serve.py", "--workers", "2", "--port", "0", "--server", "builtin"],
+                                cwd=here, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            banner = proc.stdout.readline()
+            assert banner.startswith("[serve] http://"), banner
+            base = banner.split()[1]
+            con = sqlite3.connect(os.path.join(tmp, "app.sqlite"))
+            seeded = con.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            con.close()
+            assert seeded >= 3, "the master seeds the database before forking"
+            deadline = time.time() + 30
+            while len(children(proc.pid)) < 2 and time.time() < deadline:
+                time.sleep(0.1)
+            workers = children(proc.pid)
+            assert len(workers) == 2, workers
+            login_ok = lambda: requests.post(f"{base}/auth/login", json={"username": "admin", "password": "admin"},
+                                             timeout=30).status_code == 200
+            assert all(login_ok() for _ in range(6))
+            ok(f"serve.py seeds the database in the master, then forks 2 workers on one socket ({base})")
+            os.kill(workers[0], 9)
+            while (len(children(proc.pid)) < 2 or workers[0] in children(proc.pid)) and time.time() < deadline + 30:
+                time.sleep(0.1)
+            assert len(children(proc.pid)) == 2 and workers[0] not in children(proc.pid), children(proc.pid)
+            assert all(login_ok() for _ in range(6))
+            ok("A worker that dies is replaced and requests keep succeeding")
+        finally:
+            proc.terminate()
+            code = proc.wait(timeout=30)
+            proc.stdout.close()
+    assert code == 0 and not children(proc.pid), code
+    ok("SIGTERM stops the master and its workers")
+    print("Set 28 checks passed ✅")
+
+
 if __name__ == "__main__":
     test_set1_user_management_and_roles()
     test_set2_import_only()
@@ -403,3 +1644,25 @@ if __name__ == "__main__":
     test_set4_exploring_stops()
     test_set5_favourites()
     test_set6_visual_and_export()
+    test_set7_batch_lookup()
+    test_set8_multi_agency()
+    test_set9_instrumentation()
+    test_set10_cold_start()
+    test_set11_asgi_parity()
+    test_set12_list_serialization()
+    test_set13_compression()
+    test_set14_agency_shards()
+    test_set15_snapshots()
+    test_set16_shared_cache()
+    test_set17_admission_control()
+    test_set18_route_stats()
+    test_set19_reverse_indexes()
+    test_set20_planner_analytics()
+    test_set21_reachability()
+    test_set22_user_bulk_provisioning()
+    test_set23_import_sources()
+    test_set24_synthetic_feeds()
+    test_set25_bulk_import()
+    test_set26_parallel_import()
+    test_set27_bench_smoke()
+    test_set28_app_factory_and_workers()